@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Synthetic benchmarks for the recensor cog, run outside of the bot
+
+Loads recensor.py the way Red does, as cogs.recensor, so it needs discord.py installed and a Red directory for the
+cog's cogs.utils imports. Nothing connects to Discord, and nothing is read from or written to the bot's data folder:
+each run gets its own executor and pattern cache.
+
+    python3 bench.py --red ~/Red-DiscordBot checks --filters 10 100 1000
+    python3 bench.py --red ~/Red-DiscordBot links --filters 5000 --edits 200
+    python3 bench.py --red ~/Red-DiscordBot asciify --count 1000
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+import discord
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+import unicodedata
+
+BENCH_SIZES = (10, 100, 1000)  # filters per synthetic server by default
+BENCH_AUTHORS = 200
+BENCH_CHANNELS = 20  # whitelist filters are restricted to the last one
+
+BENCH_WORDS = ['hello', 'there', 'free', 'click', 'here', 'lol', 'ok', 'the', 'game', 'server', 'anyone', 'want',
+               'to', 'play', 'tonight', 'what', 'is', 'this', 'link', 'gg', 'nice', 'thanks', 'caf\u00e9', 'why']
+
+recensor = None  # the cog module, loaded by main()
+
+
+class BenchChannel(discord.Channel):
+    """
+    A channel with only an ID, which channel lists can check like a real one
+    """
+    __slots__ = ()
+
+    def __init__(self, channel_id: str):
+        self.id = channel_id
+
+
+def load_cog(red_path: str, cog_path: str):
+    """
+    Imports the cog at cog_path as cogs.recensor, with red_path providing the cogs package
+    """
+    sys.path.insert(0, os.path.abspath(red_path))
+    spec = importlib.util.spec_from_file_location('cogs.recensor', cog_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_cog(loop, workers: int = None):
+    """
+    Returns a ReCensor with just what ServerConfig uses set up: a private executor, scheduler and pattern cache,
+    and no bot. Only the executor methods are the cog's own; timeouts are counted instead of diagnosed.
+    """
+    class BenchCog(recensor.ReCensor):
+        def __init__(self):
+            self.bot = SimpleNamespace(loop=loop)
+            self.executor = recensor.ExecutorClass(max_workers=workers)
+            self.scheduler = recensor.ExecutorScheduler(recensor.pool_size(self.executor))
+            self.pools = {}
+            self.settings = {}
+            self.pattern_cache = recensor.PatternCache()  # never saved
+            self.timeouts = 0
+
+        def is_mod_or_superior(self, obj):
+            return False  # stubs have no server to look up mod roles in
+
+        def report_timeout(self, config, items):
+            self.timeouts += len(items)
+
+    return BenchCog()
+
+
+def bench_fixture(num_filters: int, seed: int = 0) -> dict:
+    """
+    Returns server settings, in the saved format, with num_filters synthetic filters
+
+    Mostly blacklisted words and links, with multi-message, asciify, start-anchored, override, role-restricted and
+    single-channel whitelist filters mixed in. Filter i's patterns mention token i, which bench_corpus draws from.
+    """
+    rng = random.Random(seed)
+    filters = {}
+
+    for i in range(num_filters):
+        kind = i % 20
+        data = {'enabled': True}
+
+        if kind < 10:
+            words = '|'.join('%s%i' % (w, i) for w in rng.sample(BENCH_WORDS, 2))
+            data['pattern'] = r'\b(?:badword%i|%s)s?\b' % (i, words) if kind < 3 else r'\bbadword%i\b' % i
+        elif kind < 13:
+            data['pattern'] = r'https?://(?:www\.)?spam%i\.(?:com|net|gg)(?:/\S*)?' % i
+        elif kind == 13:
+            data.update(pattern=r'fr[e3]{2}\s*n[i1!]tr[o0]%i' % i, asciify=True)
+        elif kind == 14:
+            data.update(pattern=r'free\W+nitro%i' % i, multi_msg=True)
+        elif kind == 15:
+            data.update(pattern=r'!spam%i\b' % i, position=recensor.POSITION.START.value)
+        elif kind == 16:
+            data.update(pattern=r'(\w)\1{9,}|zz%i' % i, flags='I')
+        elif kind == 17:
+            data.update(pattern=r'@(?:everyone|here)%i' % i, override=True)
+        elif kind == 18:
+            data.update(pattern=r'(?:https?://\S+|link%i)' % i, mode=True,
+                        channels_list={'enabled': True, 'mode': True, 'items': [str(BENCH_CHANNELS - 1)]})
+        else:
+            data.update(pattern=r'\bspoiler%i\b' % i, roles_list={'enabled': True, 'mode': True, 'items': ['1']})
+
+        filters['bench%i' % i] = data
+
+    return {'asciify': False, 'priv_exempt': True, 'filters': filters}
+
+
+def bench_corpus(count: int, num_filters: int, seed: int = 0) -> list:
+    """
+    Returns count stub messages for bench_fixture(num_filters): mostly clean chatter, some with filter tokens,
+    links, zalgo or emoji, and multi-message attempts split across two messages from one author
+    """
+    rng = random.Random(seed)
+    marks = [chr(c) for c in range(0x300, 0x370)]
+    emoji = list(recensor.EMOJI_LETTERS)
+    timestamp = datetime.utcnow()
+    messages = []
+    pending = {}
+
+    for i in range(count):
+        author = rng.randrange(BENCH_AUTHORS)
+        channel = str(author % BENCH_CHANNELS)
+        token = rng.randrange(max(num_filters, 1))
+        roll = rng.random()
+
+        if (channel, author) in pending:
+            content = pending.pop((channel, author))
+        else:
+            content = ' '.join(rng.choice(BENCH_WORDS) for _ in range(rng.randint(2, 20)))
+
+            if roll < 0.05:
+                content += ' badword%i' % token
+            elif roll < 0.08:
+                content += ' https://spam%i.com/x' % token
+            elif roll < 0.10:
+                content = 'free'
+                pending[(channel, author)] = 'nitro%i' % token
+            elif roll < 0.15:
+                content = ''.join(c + ''.join(rng.choice(marks) for _ in range(rng.randint(0, 4))) for c in content)
+            elif roll < 0.20:
+                content = ''.join(rng.choice(emoji) if rng.random() < 0.3 else c for c in content)
+            elif roll < 0.22:
+                content = '!spam%i %s' % (token, content)
+
+        roles = ['1'] if author % 4 == 0 else []
+        timestamp += timedelta(milliseconds=100)
+        message = recensor.ReplayMessage(i + 1, channel, str(author), content, timestamp, roles=roles)
+        message.channel = BenchChannel(channel)
+        messages.append(message)
+
+    return messages
+
+
+def bench_link_fixture(num_filters: int, seed: int = 0) -> dict:
+    """
+    Returns bench_fixture(num_filters) with most of the filters' lists linked to an earlier filter's
+
+    Most links go to the filter just before, making chains, and the rest to any earlier filter, making trees.
+    """
+    rng = random.Random(seed)
+    data = bench_fixture(num_filters, seed)
+    names = list(data['filters'])
+
+    for i, name in enumerate(names):
+        for list_name in ['roles_list', 'channels_list']:
+            roll = rng.random()
+
+            if i and roll < 0.6:
+                data['filters'][name][list_name + '_link'] = names[i - 1]
+            elif i and roll < 0.8:
+                data['filters'][name][list_name + '_link'] = rng.choice(names[:i])
+
+    return data
+
+
+async def benchmark_checks(cog, config, messages: list, concurrency: int = 8) -> dict:
+    """
+    Feeds messages through config the way on_message does, concurrency at a time
+
+    Returns throughput, per-message latency percentiles, how many messages would be deleted, and the number of
+    executor calls in flight or waiting as each message started.
+    """
+    histories = defaultdict(lambda: recensor.BoundedOrderedDict(maxlen=recensor.MSG_HISTORY_MAX_NUM))
+    lane = cog.scheduler.lanes[config.server_id]
+    latencies = []
+    depths = []
+    deleted = 0
+    pending = iter(messages)
+
+    async def worker():
+        nonlocal deleted
+
+        for message in pending:
+            t0 = time.perf_counter()
+            depths.append(lane.in_flight + len(lane.queue))
+            list_cache = {}
+            history = histories[(message.channel.id, message.author.id)]
+            history[message.id] = message
+
+            if await config.check_message(message, list_cache):
+                deleted += 1
+                history.pop(message.id, None)
+
+            while history:
+                to_delete = await config.check_sequence(list(history.values()), list_cache)
+
+                if not to_delete:
+                    break
+
+                deleted += len(to_delete)
+
+                for m in to_delete:
+                    history.pop(m.id, None)
+
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0
+
+    return {
+        'messages': len(latencies),
+        'elapsed': elapsed,
+        'rate': len(latencies) / elapsed if elapsed else 0,
+        'p50': percentile(0.5),
+        'p99': percentile(0.99),
+        'deleted': deleted,
+        'timeouts': cog.timeouts,
+        'depth_avg': sum(depths) / len(depths) if depths else 0,
+        'depth_max': max(depths, default=0)
+    }
+
+
+def benchmark_links(cog, num_filters: int, edits: int, seed: int = 0) -> dict:
+    """
+    Times loading bench_link_fixture(num_filters) and then linking, unlinking, renaming and deleting filters
+
+    Returns seconds for the load and the average seconds per operation of each kind.
+    """
+    rng = random.Random(seed)
+    data = bench_link_fixture(num_filters, seed)
+
+    t0 = time.perf_counter()
+    config = recensor.ServerConfig(cog, 'bench', **data)
+    ret = {'load': time.perf_counter() - t0, 'filters': num_filters}
+    timings = defaultdict(list)
+
+    for i in range(edits):
+        names = list(config.filters)
+        list_name = rng.choice(['roles_list', 'channels_list'])
+        owner = config.filters[rng.choice(names)]
+        target = config.filters[rng.choice(names)]
+
+        if owner is not target:
+            t0 = time.perf_counter()
+
+            try:
+                config.make_link(owner, target, list_name)
+            except ValueError:  # would make a cycle; still a full check
+                pass
+
+            timings['link'].append(time.perf_counter() - t0)
+
+        owner = config.filters[rng.choice(names)]
+
+        if list_name in owner.links:
+            t0 = time.perf_counter()
+            config.break_link(owner, list_name, copy=True)
+            timings['unlink'].append(time.perf_counter() - t0)
+
+        name = rng.choice(names)
+        t0 = time.perf_counter()
+        config.rename_filter(name, 'renamed%i' % i)
+        timings['rename'].append(time.perf_counter() - t0)
+
+        leaf = next((f for f in map(config.filters.get, rng.sample(names, min(20, len(names))))
+                     if f and not any(f in index for index in config.dependents.values())), None)
+
+        if leaf and len(config.filters) > 1:
+            t0 = time.perf_counter()
+            config.delete_filter(leaf)
+            timings['delete'].append(time.perf_counter() - t0)
+
+    for kind in ('link', 'unlink', 'rename', 'delete'):
+        ret[kind] = sum(timings[kind]) / len(timings[kind]) if timings[kind] else 0
+
+    return ret
+
+
+def asciify_reference(string: str) -> str:
+    # The original per-character implementation, kept to benchmark and check asciify_string against
+    string = (c for c in string if not unicodedata.category(c).startswith('M'))
+    string = ''.join(recensor.EMOJI_LETTERS.get(c, c) for c in string)
+
+    if recensor.unidecode:
+        return recensor.unidecode(string)
+
+    return string
+
+
+def asciify_corpus(count: int, seed: int = 0) -> list:
+    """
+    Returns a mix of plain, zalgo-heavy and emoji-heavy messages
+    """
+    rng = random.Random(seed)
+    marks = [chr(c) for c in range(0x300, 0x370)]
+    emoji = list(recensor.EMOJI_LETTERS) + ['\U0001F600', '\U0001F44D', '\u2764']
+    words = ['hello', 'there', 'free', 'nitro', 'click', 'here', 'lol', 'ok', 'caf\u00e9', 'na\u00efve']
+    corpus = []
+
+    for i in range(count):
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 20)))
+
+        if i % 3 == 1:
+            text = ''.join(c + ''.join(rng.choice(marks) for _ in range(rng.randint(0, 8))) for c in text)
+        elif i % 3 == 2:
+            text = ''.join(rng.choice(emoji) if rng.random() < 0.5 else c for c in text)
+
+        corpus.append(text)
+
+    return corpus
+
+
+def benchmark_asciify(count: int = 1000, rounds: int = 5, seed: int = 0) -> dict:
+    """
+    Times the original asciify implementation against the table and the cache over asciify_corpus(count)
+
+    Each is timed as the best of `rounds` passes, and the cache, the same size as the cog's, is warmed up by the first
+    one. Returns seconds per pass for each, and how many outputs differed from the original.
+    """
+    corpus = asciify_corpus(count, seed)
+    ids = [str(i) for i in range(count)]
+    cache = recensor.BoundedOrderedDict(maxlen=recensor.ASCIIFY_CACHE_SIZE)
+    ret = {}
+
+    for name, func in [('reference', lambda: [asciify_reference(s) for s in corpus]),
+                       ('table', lambda: [recensor.asciify_string(s) for s in corpus]),
+                       ('cached', lambda: [recensor.asciify_cached(s, i, cache) for s, i in zip(corpus, ids)])]:
+        timings = []
+
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - t0)
+
+        ret[name] = min(timings)
+
+    ret['mismatches'] = sum(asciify_reference(s) != recensor.asciify_string(s) for s in corpus)
+    return ret
+
+
+def run_checks(cog, args) -> dict:
+    ret = {}
+
+    if not args.json:
+        print('%7s %9s %8s %8s %8s %11s' % ('Filters', 'Msgs/s', 'p50 ms', 'p99 ms', 'Deleted', 'Queue avg/max'))
+
+    for size in args.filters:
+        config = recensor.ServerConfig(cog, 'bench', **bench_fixture(size, args.seed))
+        corpus = bench_corpus(args.messages, size, args.seed)
+        cog.timeouts = 0
+        ret[size] = stats = cog.bot.loop.run_until_complete(benchmark_checks(cog, config, corpus, args.concurrency))
+
+        if not args.json:
+            print('%7i %9.0f %8.3f %8.3f %8i %7.1f/%i' % (
+                size, stats['rate'], stats['p50'] * 1000, stats['p99'] * 1000, stats['deleted'], stats['depth_avg'],
+                stats['depth_max']
+            ))
+
+    if not args.json:
+        print('\n%i messages per run, %i at a time, %s with %i workers' % (
+            args.messages, args.concurrency, type(cog.executor).__name__, recensor.pool_size(cog.executor)
+        ))
+
+    return ret
+
+
+def run_links(cog, args) -> dict:
+    ret = benchmark_links(cog, args.filters, args.edits, args.seed)
+
+    if not args.json:
+        print('%i filters loaded in %.1f ms' % (ret['filters'], ret['load'] * 1000))
+        print('%i rounds of edits, average per operation:' % args.edits)
+
+        for kind in ('link', 'unlink', 'rename', 'delete'):
+            print('%-7s %9.3f ms' % (kind, ret[kind] * 1000))
+
+    return ret
+
+
+def run_asciify(cog, args) -> dict:
+    ret = benchmark_asciify(args.count, args.rounds, args.seed)
+
+    if not args.json:
+        print('%i messages, best of %i:' % (args.count, args.rounds))
+
+        for name in ('reference', 'table', 'cached'):
+            print('%-10s %8.2f ms  %6.1fx' % (name, ret[name] * 1000, ret['reference'] / max(ret[name], 1e-9)))
+
+        print('Outputs differing from reference: %i' % ret['mismatches'])
+
+        if not recensor.unidecode:
+            print('(unidecode is not installed)')
+
+    return ret
+
+
+def main(argv=None):
+    global recensor
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--red', default='.', help="Red's directory, containing cogs/utils (default: current)")
+    parser.add_argument('--cog', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recensor.py'),
+                        help='the recensor.py to benchmark (default: the one next to this script)')
+    parser.add_argument('--workers', type=int, help='executor workers (default: one per CPU)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON, to compare between versions')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    checks = commands.add_parser('checks', help='time message and multi-message checks on synthetic servers')
+    checks.add_argument('--filters', type=int, nargs='+', default=list(BENCH_SIZES), help='filters per server, '
+                        'one run each (default: %s)' % ' '.join(map(str, BENCH_SIZES)))
+    checks.add_argument('--messages', type=int, default=2000)
+    checks.add_argument('--concurrency', type=int, default=8)
+    checks.set_defaults(func=run_checks)
+
+    links = commands.add_parser('links', help='load a server whose filters are linked in chains and trees, and then '
+                                              'link, unlink, rename and delete filters')
+    links.add_argument('--filters', type=int, default=5000)
+    links.add_argument('--edits', type=int, default=200)
+    links.set_defaults(func=run_links)
+
+    asciify = commands.add_parser('asciify', help='time the asciify pipeline on zalgo- and emoji-heavy messages')
+    asciify.add_argument('--count', type=int, default=1000)
+    asciify.add_argument('--rounds', type=int, default=5)
+    asciify.set_defaults(func=run_asciify)
+
+    args = parser.parse_args(argv)
+    recensor = load_cog(args.red, args.cog)
+
+    loop = asyncio.get_event_loop()
+    cog = bench_cog(loop, args.workers)
+
+    try:
+        ret = args.func(cog, args)
+    finally:
+        cog.executor.shutdown()
+
+    if args.json:
+        print(json.dumps(ret, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
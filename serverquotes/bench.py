@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Synthetic benchmarks for the serverquotes cog's database, run outside of the bot
+
+Loads serverquotes.py the way Red does, as cogs.serverquotes, so it needs discord.py installed and a Red directory for
+the cog's cogs.utils imports. Nothing connects to Discord, and the bot's quote database isn't touched: each run builds
+its own database of synthetic quotes and deletes it afterwards. At a million quotes, expect a few minutes and ~1 GB of
+disk.
+
+    python3 bench.py --red ~/Red-DiscordBot search --quotes 1000000
+    python3 bench.py --red ~/Red-DiscordBot storage --quotes 100000
+"""
+import argparse
+import importlib.util
+import json
+import os
+from random import Random
+import sys
+import tempfile
+import time
+from typing import List, Optional, Sequence
+
+serverquotes = None  # the cog module, loaded by main()
+
+
+def load_cog(red_path: str, cog_path: str):
+    """
+    Imports the cog at cog_path as cogs.serverquotes, with red_path providing the cogs package
+    """
+    sys.path.insert(0, os.path.abspath(red_path))
+    spec = importlib.util.spec_from_file_location('cogs.serverquotes', cog_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def temp_db(directory: Optional[str] = None) -> str:
+    """
+    Returns the path of a new, empty database file in directory, so that runs never share one
+    """
+    fd, path = tempfile.mkstemp(suffix='.sqlite', prefix='benchmark-', dir=directory)
+    os.close(fd)
+    return path
+
+
+def bench_vocabulary(rng: Random, size: int = 20000) -> List[str]:
+    syllables = ('ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'da', 'fe', 'go', 'hu', 'ji', 'pa', 'wen')
+    words = set()
+
+    while len(words) < size:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 5))))
+
+    return sorted(words)
+
+
+def bench_word(rng: Random, vocab: Sequence[str], skew: int = 3) -> str:
+    # low indexes come up far more often, so a few words are in most quotes and most are rare
+    return vocab[int(len(vocab) * rng.random() ** skew)]
+
+
+def bench_quote_row(rng: Random, vocab: Sequence[str]) -> tuple:
+    quote = ' '.join(bench_word(rng, vocab) for _ in range(rng.randint(4, 30)))
+    return rng.randint(1, 100), rng.randint(1, 5000), rng.randint(1, 5000), quote
+
+
+def benchmark_search(path: str, num_quotes: int, searches: int = 200, inserts: int = 200, seed: int = 0,
+                     storage: Optional[dict] = None, fts4: bool = True) -> dict:
+    """
+    Builds a database of num_quotes synthetic quotes in the empty file at path (see temp_db) and times searches,
+    lookups by quote number and single-quote inserts on it, first with FTS4 and the Python bm25() and then again after
+    migrating it to FTS5
+
+    Searches are one or two words in one to four linked servers out of 100, 50 results, as [p]quote search runs them.
+    Lookups are [p]quote show's query. `storage` is the profile to open the database with (see STORAGE_PROFILES), and
+    with fts4=False only FTS5 is timed if it's available. Returns the seconds taken to build and migrate, and lists
+    of times per FTS version. The database is deleted afterwards.
+    """
+    rng = Random(seed)
+    vocab = bench_vocabulary(rng)
+    queries = [(' '.join(bench_word(rng, vocab, 2) for _ in range(rng.randint(1, 2))),
+                rng.sample(range(1, 101), rng.randint(1, 4))) for _ in range(searches)]
+    lookups = [(rng.sample(range(1, 101), rng.randint(1, 4)), rng.randint(1, max(1, num_quotes // 100)))
+               for _ in range(searches)]
+    ret = {'quotes': num_quotes, 'build': None, 'migrate': None}
+    con = serverquotes.connect_db(path, storage)
+
+    try:
+        con.executescript(serverquotes.INIT_SQL)
+        t0 = time.perf_counter()
+        fts_version = serverquotes.init_fts(con, allow_fts5=not (fts4 and serverquotes.check_fts4()))
+
+        with con:
+            con.executemany("INSERT INTO quotes (server_id, added_by, author_id, quote) VALUES (?, ?, ?, ?);",
+                            (bench_quote_row(rng, vocab) for _ in range(num_quotes)))
+
+        ret['build'] = time.perf_counter() - t0
+
+        while fts_version:
+            timings = ret[fts_version] = {'search': [], 'lookup': [], 'insert': []}
+
+            for term, server_ids in queries:
+                if fts_version == 5:
+                    term = serverquotes.fts5_query(term)
+
+                where, params = serverquotes.build_where({'server_id': server_ids}, [term],
+                                                         [serverquotes.FTS_MATCH[fts_version]])
+                params += [50, 0] + ([term] if fts_version == 4 else [])
+                sql = serverquotes.search_sql(fts_version, where)
+
+                t0 = time.perf_counter()
+                con.execute(sql, params).fetchall()
+                timings['search'].append(time.perf_counter() - t0)
+
+            for server_ids, server_quote_id in lookups:
+                where, params = serverquotes.build_where({'server_id': server_ids, 'server_quote_id': server_quote_id})
+
+                t0 = time.perf_counter()
+                con.execute("SELECT * FROM quotes_view_250 " + where, params).fetchall()
+                timings['lookup'].append(time.perf_counter() - t0)
+
+            for _ in range(inserts):
+                row = bench_quote_row(rng, vocab)
+                t0 = time.perf_counter()
+
+                with con:
+                    con.execute("INSERT INTO quotes (server_id, added_by, author_id, quote) VALUES (?, ?, ?, ?);", row)
+
+                timings['insert'].append(time.perf_counter() - t0)
+
+            if fts_version == 4 and serverquotes.check_fts5():
+                t0 = time.perf_counter()
+                fts_version = serverquotes.init_fts(con)
+                ret['migrate'] = time.perf_counter() - t0
+            else:
+                fts_version = None
+    finally:
+        con.close()
+
+        for suffix in ('', '-journal', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    return ret
+
+
+def bench_header() -> str:
+    return '%-6s %10s %10s %10s %10s %10s' % ('', 'search ms', 'median', 'p95', 'lookup ms', 'insert ms')
+
+
+def bench_line(name: str, timings: dict) -> str:
+    search = sorted(timings['search'])
+    lookup = timings['lookup']
+    insert = timings['insert']
+
+    return '%-6s %10.2f %10.2f %10.2f %10.2f %10.2f' % (
+        name, sum(search) * 1000 / len(search), search[len(search) // 2] * 1000,
+        search[int(len(search) * 0.95)] * 1000, sum(lookup) * 1000 / len(lookup),
+        sum(insert) * 1000 / len(insert))
+
+
+def run_search(args) -> dict:
+    storage = serverquotes.STORAGE_PROFILES[args.storage]
+    ret = benchmark_search(temp_db(args.dir), args.quotes, args.searches, args.inserts, args.seed,
+                           storage=storage)
+
+    if not args.json:
+        line = '%i quotes, built in %.1f s' % (args.quotes, ret['build'])
+
+        if ret['migrate'] is not None:
+            line += ', migrated to FTS5 in %.1f s' % ret['migrate']
+
+        print(line)
+        print(bench_header())
+
+        for version in (4, 5):
+            if version in ret:
+                print(bench_line('FTS%i' % version, ret[version]))
+
+    return ret
+
+
+def run_storage(args) -> dict:
+    ret = {}
+
+    if not args.json:
+        print('%i quotes' % args.quotes)
+        print(bench_header())
+
+    for name, storage in sorted(serverquotes.STORAGE_PROFILES.items()):
+        ret[name] = timings = benchmark_search(temp_db(args.dir), args.quotes, args.searches, args.inserts,
+                                               args.seed, storage=storage, fts4=False)
+
+        if not args.json:
+            print(bench_line(name, timings[5 if 5 in timings else 4]))
+
+    return ret
+
+
+def main(argv=None):
+    global serverquotes
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--red', default='.', help="Red's directory, containing cogs/utils (default: current)")
+    parser.add_argument('--cog', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serverquotes.py'),
+                        help='the serverquotes.py to benchmark (default: the one next to this script)')
+    parser.add_argument('--dir', help='where to build the synthetic databases, on the filesystem to test; each run '
+                                      "gets its own file (default: the system's temp directory)")
+    parser.add_argument('--quotes', type=int, default=100000)
+    parser.add_argument('--searches', type=int, default=200)
+    parser.add_argument('--inserts', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON, to compare between versions')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    search = commands.add_parser('search', help='time searching and adding quotes with FTS4 vs FTS5')
+    search.add_argument('--storage', choices=['compat', 'wal'], default='wal',
+                        help='the storage profile to open the database with (default: wal)')
+    search.set_defaults(func=run_search)
+
+    storage = commands.add_parser('storage', help='time searching, looking up and adding quotes with each storage '
+                                                  'profile, using FTS5 if available')
+    storage.set_defaults(func=run_storage)
+
+    args = parser.parse_args(argv)
+
+    if not (0 < args.quotes and 0 < args.searches and 0 < args.inserts):
+        parser.error('--quotes, --searches and --inserts must be at least 1')
+
+    serverquotes = load_cog(args.red, args.cog)
+
+    if not (serverquotes.check_fts4() or serverquotes.check_fts5()):
+        parser.error('missing FTS extension, nothing to benchmark')
+
+    ret = args.func(args)
+
+    if args.json:
+        print(json.dumps(ret, indent=2))  # results mix FTS version and name keys, which sort_keys can't order
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,12 @@
 import aiohttp
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from datetime import datetime
 import discord
 from discord.ext import commands
 from discord.ext.commands.view import StringView
 from enum import Enum
+from functools import partial
 from io import BytesIO, StringIO
 import math
 import os
@@ -13,9 +15,9 @@ import re
 import sqlite3
 import struct
 from textwrap import dedent
-from typing import Iterable, Optional, Sequence
+from typing import Iterable, List, Optional, Sequence
 
-from .utils.chat_formatting import error, warning
+from .utils.chat_formatting import box, error, warning
 from .utils.checks import check_permissions, is_owner, admin_or_permissions, mod_or_permissions
 from .utils.dataIO import dataIO
 
@@ -23,6 +25,7 @@ from .utils.dataIO import dataIO
 PATH = 'data/serverquotes/'
 JSON = PATH + 'quotes.json'
 SQLDB = PATH + 'quotes.sqlite'
+SETTINGS = PATH + 'settings.json'
 DEFAULT_UPDATE_KEYS = (('quote_id',), ('server_id', 'server_quote_id'))
 
 # message links in embeds don't work yet
@@ -38,6 +41,34 @@ numbs = {
     "show": "🔍"
 }
 
+# Recomputes the quote_display rows of the quotes selected by a WHERE clause appended to it. The triggers in INIT_SQL
+# cover changes to quotes; changes to users and nicknames go through _update_member and _populate_userinfo.
+DISPLAY_REFRESH_SQL = """
+REPLACE INTO quote_display (quote_id, author_avatar_url, added_by_avatar_url, global_author, global_added_by,
+                            display_author, display_added_by)
+  SELECT quotes.quote_id,
+         qu.avatar_url,
+         au.avatar_url,
+         COALESCE(qu.username || '#' || SUBSTR('0000' || qu.discriminator, -4, 4), author_name,
+                  'missingno#' || author_id, '(unknown)'),
+         COALESCE(au.username || '#' || SUBSTR('0000' || au.discriminator, -4, 4),
+                  'missingno#' || added_by, '(unknown)'),
+         COALESCE(qn.nickname, qu.username || '#' || SUBSTR('0000' || qu.discriminator, -4, 4), author_name,
+                  'missingno#' || author_id, '(unknown)'),
+         COALESCE(an.nickname, au.username || '#' || SUBSTR('0000' || au.discriminator, -4, 4),
+                  'missingno#' || added_by, '(unknown)')
+  FROM quotes
+  LEFT JOIN users qu ON qu.user_id = quotes.author_id
+  LEFT JOIN users au ON au.user_id = quotes.added_by
+  LEFT JOIN nicknames qn ON qn.server_id = quotes.server_id
+                        AND qn.user_id = quotes.author_id
+  LEFT JOIN nicknames an ON an.server_id = quotes.server_id
+                        AND an.user_id = quotes.added_by
+"""
+
+DISPLAY_USER_SQL = DISPLAY_REFRESH_SQL + " WHERE quotes.author_id = ? OR quotes.added_by = ?;"
+DISPLAY_MISSING_SQL = DISPLAY_REFRESH_SQL + " WHERE quotes.quote_id NOT IN (SELECT quote_id FROM quote_display);"
+
 INIT_SQL = """
 CREATE TABLE IF NOT EXISTS quotes (
     quote_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -131,27 +162,45 @@ CREATE TABLE IF NOT EXISTS server_links (
 CREATE INDEX IF NOT EXISTS server_links_from_id ON server_links(from_id);
 
 DROP VIEW IF EXISTS quotes_view;
+DROP VIEW IF EXISTS quotes_view_230;
+DROP VIEW IF EXISTS quotes_view_250;
+
+CREATE TABLE IF NOT EXISTS quote_display (
+    quote_id INTEGER PRIMARY KEY,
+    author_avatar_url TEXT,
+    added_by_avatar_url TEXT,
+    global_author TEXT,
+    global_added_by TEXT,
+    display_author TEXT,
+    display_added_by TEXT
+);
 
-CREATE VIEW IF NOT EXISTS quotes_view_230 AS
+CREATE TRIGGER IF NOT EXISTS quote_display_INSERT AFTER INSERT ON quotes
+  BEGIN
+    {refresh} WHERE quotes.quote_id = NEW.quote_id;
+  END;
+
+CREATE TRIGGER IF NOT EXISTS quote_display_UPDATE AFTER UPDATE OF server_id, author_id, author_name, added_by ON quotes
+  BEGIN
+    {refresh} WHERE quotes.quote_id = NEW.quote_id;
+  END;
+
+CREATE TRIGGER IF NOT EXISTS quote_display_DELETE AFTER DELETE ON quotes
+  BEGIN
+    DELETE FROM quote_display WHERE quote_id = OLD.quote_id;
+  END;
+
+CREATE VIEW IF NOT EXISTS quotes_view_250 AS
   SELECT quotes.*,
-         qu.avatar_url AS author_avatar_url,
-         au.avatar_url AS added_by_avatar_url,
-         COALESCE(qu.username || '#' || SUBSTR('0000' || qu.discriminator, -4, 4), author_name,
-                  'missingno#' || author_id, '(unknown)') AS global_author,
-         COALESCE(au.username || '#' || SUBSTR('0000' || au.discriminator, -4, 4),
-                  'missingno#' || added_by, '(unknown)') AS global_added_by,
-         COALESCE(qn.nickname, qu.username || '#' || SUBSTR('0000' || qu.discriminator, -4, 4), author_name,
-                  'missingno#' || author_id, '(unknown)') AS display_author,
-         COALESCE(an.nickname, au.username || '#' || SUBSTR('0000' || au.discriminator, -4, 4),
-                  'missingno#' || added_by, '(unknown)') AS display_added_by
+         d.author_avatar_url,
+         d.added_by_avatar_url,
+         d.global_author,
+         d.global_added_by,
+         d.display_author,
+         d.display_added_by
   FROM quotes
-  LEFT JOIN users qu ON qu.user_id = quotes.author_id
-  LEFT JOIN users au ON au.user_id = quotes.added_by
-  LEFT JOIN nicknames qn ON qn.server_id = quotes.server_id
-                        AND qn.user_id = quotes.author_id
-  LEFT JOIN nicknames an ON an.server_id = quotes.server_id
-                        AND an.user_id = quotes.added_by;
-"""
+  JOIN quote_display d ON d.quote_id = quotes.quote_id;
+""".format(refresh=DISPLAY_REFRESH_SQL.strip())
 
 FTS_SQL = """
 CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts USING FTS4(tokenize=porter);
@@ -174,8 +223,39 @@ CREATE TRIGGER IF NOT EXISTS quotes_UPDATE AFTER UPDATE ON quotes
   BEGIN
     UPDATE quotes_fts SET content=NEW.quote WHERE quotes_fts.rowid = OLD.quote_id;
   END;
+
+DROP TRIGGER IF EXISTS quotes_fts5_INSERT;
+DROP TRIGGER IF EXISTS quotes_fts5_DELETE;
+DROP TRIGGER IF EXISTS quotes_fts5_UPDATE;
 """
 
+FTS5_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts5 USING FTS5(content, tokenize=porter);
+
+CREATE TRIGGER IF NOT EXISTS quotes_fts5_INSERT AFTER INSERT ON quotes
+  BEGIN
+    INSERT INTO quotes_fts5(rowid, content) VALUES (NEW.quote_id, NEW.quote);
+  END;
+
+CREATE TRIGGER IF NOT EXISTS quotes_fts5_DELETE AFTER DELETE ON quotes
+  BEGIN
+    DELETE FROM quotes_fts5 WHERE rowid = OLD.quote_id;
+  END;
+
+CREATE TRIGGER IF NOT EXISTS quotes_fts5_UPDATE AFTER UPDATE ON quotes
+  WHEN OLD.quote IS NOT NEW.quote
+  BEGIN
+    UPDATE quotes_fts5 SET content = NEW.quote WHERE rowid = OLD.quote_id;
+  END;
+
+DROP TRIGGER IF EXISTS quotes_fts_INSERT;
+DROP TRIGGER IF EXISTS quotes_DELETE;
+DROP TRIGGER IF EXISTS quotes_UPDATE;
+"""
+
+# Fills a newly created FTS index from quotes; quotes added before it existed would never be found otherwise
+FTS_FILL_SQL = "INSERT INTO {table}(rowid, content) SELECT quote_id, quote FROM quotes;"
+
 SQL_211 = """
 CREATE TABLE server_counters_new (
     server_id INTEGER NOT NULL DEFAULT 0,
@@ -205,6 +285,34 @@ WHERE user_id IS NOT NULL;
 
 RANK_SQL = "bm25(MATCHINFO(quotes_fts, 'pcnalx'), 1)"
 
+FTS_MATCH = {4: "content MATCH ?", 5: "quotes_fts5 MATCH ?"}
+FTS5_OPERATORS = ('AND', 'OR', 'NOT')
+FTS5_WORD_RE = re.compile(r'-?"[^"]*"|\S+')
+
+# compat is SQLite's defaults, for filesystems that WAL doesn't work on (e.g. network shares). Values are pragmas,
+# except cached_statements, the size of the sqlite3 module's prepared statement cache.
+STORAGE_PROFILES = {
+    'compat': {
+        'journal_mode'      : 'DELETE',
+        'synchronous'       : 'FULL',
+        'mmap_size'         : 0,
+        'cache_size'        : -2000,
+        'cached_statements' : 100
+    },
+    'wal': {
+        'journal_mode'      : 'WAL',
+        'synchronous'       : 'NORMAL',
+        'mmap_size'         : 256 * 1024 ** 2,
+        'cache_size'        : -32000,
+        'cached_statements' : 512
+    }
+}
+
+DEFAULT_SETTINGS = {'storage': STORAGE_PROFILES['wal']}
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+IN_EXACT_MAX = 8
+
 # Analytics core
 import zlib, base64
 exec(zlib.decompress(base64.b85decode("""c-oB^YjfMU@w<No&NCTMHA`DgE_b6jrg7c0=eC!Z-Rs==JUobmEW{+iBS0ydO#XX!7Y|XglIx5;0)gG
@@ -236,7 +344,7 @@ Rj(Y0|;SU2d?s+MPi6(PPLva(Jw(n0~TKDN@5O)F|k^_pcwolv^jBVTLhNqMQ#x6WU9J^I;wLr}Cut#l
 FU1|1o`VZODxuE?x@^rESdOK`qzRAwqpai|-7cM7idki4HKY>0$z!aloMM7*HJs+?={U5?4IFt""".replace("\n", ""))))
 # End analytics core
 
-__version__ = '2.4.2'
+__version__ = '2.5.0'
 
 
 class SortField(Enum):
@@ -265,6 +373,193 @@ def check_fts4() -> bool:
         return ('ENABLE_FTS3',) in available_pragmas
 
 
+def check_fts5() -> bool:
+    with sqlite3.connect(':memory:') as con:
+        cur = con.execute('pragma compile_options;')
+        available_pragmas = cur.fetchall()
+        return ('ENABLE_FTS5',) in available_pragmas
+
+
+def storage_pragmas(storage: dict) -> List[str]:
+    journal_mode = str(storage['journal_mode']).upper()
+    synchronous = str(storage['synchronous']).upper()
+
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError('invalid journal_mode %r, must be one of %s' % (journal_mode, ', '.join(JOURNAL_MODES)))
+    elif synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError('invalid synchronous %r, must be one of %s' % (synchronous, ', '.join(SYNCHRONOUS_MODES)))
+
+    return ['PRAGMA journal_mode = %s;' % journal_mode,
+            'PRAGMA synchronous = %s;' % synchronous,
+            'PRAGMA mmap_size = %i;' % int(storage['mmap_size']),
+            'PRAGMA cache_size = %i;' % int(storage['cache_size'])]
+
+
+def connect_db(path: str, storage: Optional[dict] = None) -> sqlite3.Connection:
+    """
+    Opens the quote database with a storage profile (see STORAGE_PROFILES); missing keys are SQLite's defaults
+    """
+    storage = dict(STORAGE_PROFILES['compat'], **(storage or {}))
+    pragmas = storage_pragmas(storage)
+
+    con = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES,
+                          cached_statements=int(storage['cached_statements']))
+    con.row_factory = sqlite3.Row
+
+    for pragma in pragmas:
+        con.execute(pragma)
+
+    return con
+
+
+def in_placeholders(values: Sequence) -> tuple:
+    """
+    Returns "(?, ?, ...)" and its parameters for an IN list. Lists longer than IN_EXACT_MAX are padded to a power of
+    two by repeating the last value.
+
+    That way queries that only differ in list length (e.g. the number of linked servers) share a bounded number of
+    SQL strings, which the sqlite3 module's statement cache can reuse instead of preparing each one again. Short
+    lists are kept exact, since binding padding costs more than the few statements it would save.
+    """
+    values = list(values)
+
+    if len(values) <= IN_EXACT_MAX:
+        return '(%s)' % ', '.join('?' * len(values)), values
+
+    size = 1 << (len(values) - 1).bit_length()
+    values.extend(values[-1:] * (size - len(values)))
+    return '(%s)' % ', '.join('?' * size), values
+
+
+def build_where(kwargs: dict, params: Optional[list] = None, wheres: Optional[list] = None) -> tuple:
+    if wheres is None:
+        wheres = []
+
+    if params is None:
+        params = []
+
+    # sorted, so the same filters always give the same SQL
+    for param, value in sorted(kwargs.items()):
+        if isinstance(value, Iterable) and not isinstance(value, str):
+            placeholders, values = in_placeholders(value)
+            wheres.append(param + " IN " + placeholders)
+            params.extend(values)
+        else:
+            wheres.append(param + " IS ?")
+            params.append(value)
+
+    if wheres:
+        where = " WHERE " + " AND ".join(wheres)
+    else:
+        where = " "
+
+    return where, params
+
+
+def init_fts(con, allow_fts5=True) -> Optional[int]:
+    """
+    Sets up full-text search on quotes and returns the FTS version in use, or None if neither is available
+
+    FTS5 is preferred, since it ranks with its own bm25() in C. Switching to it fills quotes_fts5 from the quotes
+    table and drops the old FTS4 quotes_fts in the same transaction. FTS4 with the Python bm25() is the fallback.
+    """
+    tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+
+    if allow_fts5 and check_fts5():
+        if 'quotes_fts5' in tables:
+            con.executescript(FTS5_SQL)
+        else:
+            script = ['BEGIN;', FTS5_SQL, FTS_FILL_SQL.format(table='quotes_fts5')]
+
+            # dropping a virtual table needs its module, so a leftover FTS4 table is kept if there's no FTS4
+            if 'quotes_fts' in tables and check_fts4():
+                script.append('DROP TABLE quotes_fts;')
+
+            con.executescript('\n'.join(script + ['COMMIT;']))
+
+        return 5
+    elif check_fts4():
+        script = [FTS_SQL]
+
+        if 'quotes_fts' not in tables:
+            script = ['BEGIN;', FTS_SQL, FTS_FILL_SQL.format(table='quotes_fts'), 'COMMIT;']
+
+        con.executescript('\n'.join(script))
+        con.create_function('bm25', -1, bm25)
+        return 4
+
+    return None
+
+
+def fts5_query(query: str) -> str:
+    """
+    Converts a search as typed for FTS4 into an FTS5 query
+
+    FTS5 raises syntax errors on punctuation that FTS4 ignores (e.g. "don't"), so every word becomes a string.
+    "Phrases", trailing * prefixes, AND/OR/NOT and -excluded words still work.
+    """
+    parts = []
+
+    for word in FTS5_WORD_RE.findall(query):
+        if word in FTS5_OPERATORS:
+            if parts and parts[-1] not in FTS5_OPERATORS:
+                parts.append(word)
+            continue
+
+        exclude = word.startswith('-') and len(word) > 1
+
+        if exclude:
+            word = word[1:]
+
+        if len(word) > 1 and word.startswith('"') and word.endswith('"'):
+            word = word[1:-1]
+
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+
+        if not word:
+            continue
+        elif exclude and parts and parts[-1] not in FTS5_OPERATORS:
+            parts.append('NOT')
+
+        parts.append('"%s"%s' % (word.replace('"', '""'), '*' if prefix else ''))
+
+    while parts and parts[-1] in FTS5_OPERATORS:
+        parts.pop()
+
+    return ' '.join(parts)
+
+
+def search_sql(fts_version: int, where: str) -> str:
+    """
+    Returns the query for a page of search results, best match first
+
+    Its parameters are those of `where` (starting with the MATCH term, see FTS_MATCH), then the limit and offset,
+    and for FTS4 the MATCH term once more.
+    """
+    if fts_version == 5:
+        return dedent("""
+            SELECT snippet(quotes_fts5, 0, '**', '**', '…', 15) AS snippet, quotes_view_250.*
+            FROM quotes_fts5
+            JOIN quotes_view_250 ON quote_id = quotes_fts5.rowid
+            {where} ORDER BY quotes_fts5.rank LIMIT ? OFFSET ?
+            """.format(where=where))
+
+    # bm25() returns negated scores, so the best match sorts first in ascending order
+    return dedent("""
+        SELECT SNIPPET(quotes_fts, '**', '**', '…') AS snippet, quotes_view_250.*
+        FROM quotes_fts
+        JOIN (
+            SELECT docid, {rank} AS rank
+            FROM quotes_fts
+            JOIN quotes_view_250 ON docid = quote_id
+            {where} ORDER BY rank LIMIT ? OFFSET ?
+        ) AS rt USING(docid)
+        JOIN quotes_view_250 ON quote_id = docid
+        WHERE quotes_fts MATCH ? ORDER BY rt.rank
+        """.format(rank=RANK_SQL, where=where))
+
+
 def _parse_match_info(buf):
     # See http://sqlite.org/fts3.html#matchinfo
     bufsize = len(buf)  # Length in bytes.
@@ -345,6 +640,194 @@ def _map_scalar_or_vector(value, operation, check_type=None):
         return conv(value)
 
 
+class QuoteDB:
+    """
+    The quote database, accessed only from one worker thread
+
+    Queries run there behind coroutines, so a slow search or a large dump doesn't hold up the event loop (and with
+    it the gateway heartbeat). Having one thread also serializes all access to the connection.
+    """
+
+    def __init__(self, loop, path: str, storage: Optional[dict] = None):
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.con = None
+        self.run_sync(self._connect, path, storage, transaction=False)
+
+    def _connect(self, con, path: str, storage: Optional[dict]):
+        self.con = connect_db(path, storage)
+
+    def _call(self, func, args, kwargs, transaction):
+        if not transaction:
+            return func(self.con, *args, **kwargs)
+
+        with self.con as con:
+            return func(con, *args, **kwargs)
+
+    def run_sync(self, func, *args, transaction=True, **kwargs):
+        """
+        Calls func(con, *args, **kwargs) on the worker thread and waits for it; only for setup and unloading
+        """
+        return self.executor.submit(self._call, func, args, kwargs, transaction).result()
+
+    async def run(self, func, *args, transaction=True, **kwargs):
+        """
+        Calls func(con, *args, **kwargs) on the worker thread, committing afterwards (or rolling back if it raises)
+        """
+        call = partial(self._call, func, args, kwargs, transaction)
+        return await self.loop.run_in_executor(self.executor, call)
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        return await self.run(lambda con: con.execute(sql, params).rowcount)
+
+    async def fetchall(self, sql: str, params: Sequence = ()) -> list:
+        return await self.run(lambda con: con.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql: str, params: Sequence = ()) -> Optional[sqlite3.Row]:
+        return await self.run(lambda con: con.execute(sql, params).fetchone())
+
+    def close(self):
+        if self.con:
+            self.run_sync(self._close, transaction=False)
+
+        self.executor.shutdown()
+
+    def _close(self, con):
+        con.commit()
+        con.close()
+        self.con = None
+
+
+class QuotePager:
+    """
+    Rows of quotes_view_250 matching a filter in quote_id order, loaded a window at a time for embed_menu
+
+    Only the count and the rows around the last one looked at are kept. Stepping past either end of the window
+    continues from its first or last quote_id (keyset pagination). Anything further away, like a random jump, first
+    finds the quote_id at that position with LIMIT 1 OFFSET on the quotes table, from whichever end is closer.
+    """
+
+    def __init__(self, db: QuoteDB, where: str, params: Sequence, window: int = 10):
+        self.db = db
+        self.where = where
+        self.params = list(params)
+        self.window = window
+        self.start = 0
+        self.rows = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    async def refresh(self) -> 'QuotePager':
+        self.count = await self.db.run(self._count)
+        self.start = 0
+        self.rows = []
+        return self
+
+    async def get(self, index: int):
+        if index < 0:
+            index += self.count
+
+        if not 0 <= index < self.count:
+            raise IndexError('quote index out of range')
+        elif self.start <= index < self.start + len(self.rows):
+            return self.rows[index - self.start]
+
+        return await self.db.run(self._get, index)
+
+    def _get(self, con, index: int):
+        self._load(con, index)
+
+        # quotes were deleted since the count was taken
+        if not self.start <= index < self.start + len(self.rows):
+            self.count = self._count(con)
+
+            if index >= self.count:
+                raise IndexError('quote index out of range')
+
+            self._seek(con, index)
+
+        return self.rows[index - self.start]
+
+    def _where(self, clause: Optional[str] = None) -> str:
+        if clause is None:
+            return self.where
+        elif self.where.strip():
+            return self.where + " AND " + clause
+
+        return " WHERE " + clause
+
+    def _count(self, con) -> int:
+        return con.execute("SELECT COUNT(*) FROM quotes" + self.where, self.params).fetchone()[0]
+
+    def _fetch(self, con, clause: str, key: int, limit: int, reverse: bool = False) -> list:
+        sql = "SELECT * FROM quotes_view_250 %s ORDER BY quote_id %s LIMIT ?"
+        sql %= (self._where(clause), 'DESC' if reverse else 'ASC')
+        rows = con.execute(sql, self.params + [key, limit]).fetchall()
+
+        if reverse:
+            rows.reverse()
+
+        return rows
+
+    def _load(self, con, index: int):
+        end = self.start + len(self.rows)
+        keep = 3 * self.window
+
+        if self.rows and end <= index < end + self.window:
+            rows = self._fetch(con, "quote_id > ?", self.rows[-1]['quote_id'], index - end + self.window)
+            self.rows.extend(rows)
+            drop = max(0, len(self.rows) - keep)
+            self.start += drop
+            del self.rows[:drop]
+        elif self.rows and self.start - self.window <= index < self.start:
+            rows = self._fetch(con, "quote_id < ?", self.rows[0]['quote_id'], self.start - index + self.window // 2,
+                               reverse=True)
+            self.start -= len(rows)
+            self.rows = rows + self.rows[:keep - len(rows)]
+        else:
+            self._seek(con, index)
+
+    def _seek(self, con, index: int):
+        first = max(0, index - self.window // 2)
+
+        if first < self.count // 2:
+            direction, offset = 'ASC', first
+        else:
+            direction, offset = 'DESC', self.count - 1 - first
+
+        sql = "SELECT quote_id FROM quotes %s ORDER BY quote_id %s LIMIT 1 OFFSET ?" % (self.where, direction)
+        row = con.execute(sql, self.params + [offset]).fetchone()
+        self.start = first
+        self.rows = self._fetch(con, "quote_id >= ?", row[0], 2 * self.window) if row else []
+
+
+def quotes_csv(cols: Sequence[str], rows: Sequence[sqlite3.Row]) -> bytes:
+    strbuf = StringIO(newline='')
+    writer = csv.DictWriter(strbuf, fieldnames=cols, extrasaction='ignore', quoting=csv.QUOTE_MINIMAL)
+    writer.writeheader()
+
+    for row in rows:
+        row = dict(row)
+
+        for k in ['date_said', 'date_added']:
+            if row[k]:
+                row[k] = row[k].timestamp()
+
+        writer.writerow(row)
+
+    return b'\xef\xbb\xbf' + strbuf.getvalue().encode()
+
+
+async def get_record(records: Sequence, index: int):
+    # records is either a list of rows or a QuotePager
+    if isinstance(records, QuotePager):
+        return await records.get(index)
+
+    return records[index]
+
+
 class ServerQuotes:
     """
     Store and retrieve memorable quotes from your server
@@ -352,23 +835,20 @@ class ServerQuotes:
 
     def __init__(self, bot):
         self.bot = bot
-        self.db = sqlite3.connect(SQLDB, detect_types=sqlite3.PARSE_DECLTYPES)
-        self.db.row_factory = sqlite3.Row
+        self.settings = dataIO.load_json(SETTINGS)
+        self.storage = dict(DEFAULT_SETTINGS['storage'], **self.settings.get('storage', {}))
+        self.db = QuoteDB(bot.loop, SQLDB, self.storage)
 
-        with self.db as con:
-            con.executescript(INIT_SQL)
-
-            if check_fts4():
-                self.has_fts = True
-                con.executescript(FTS_SQL)
-                con.create_function('bm25', -1, bm25)
-            else:
-                self.has_fts = False
+        # schema setup and upgrades still block, since commands can't run before they finish
+        self.db.run_sync(lambda con: con.executescript(INIT_SQL), transaction=False)
+        self.fts_version = self.db.run_sync(init_fts)
+        self.has_fts = self.fts_version is not None
 
         self.bot.loop.create_task(self._populate_userinfo())
         self.bot.loop.create_task(self._upgrade_210())
-        self._upgrade_211()
-        self._upgrade_230()
+        self.db.run_sync(self._upgrade_211)
+        self.db.run_sync(self._upgrade_230)
+        self.db.run_sync(self._upgrade_250)
 
         try:
             self.analytics = CogAnalytics(self)
@@ -377,12 +857,8 @@ class ServerQuotes:
             self.analytics = None
 
     def __unload(self):
-        self.save()
         self.db.close()
 
-    def save(self):
-        self.db.commit()
-
     # Authorization/permission checks
 
     async def _authorize_del(self, ctx, record):
@@ -398,123 +874,149 @@ class ServerQuotes:
     async def _populate_userinfo(self):
         await self.bot.wait_until_ready()
 
-        with self.db:
-            users = {}
-            nicknames = {}
-            missing_ids = set()
-            updated_ids = set()
+        users = {}
+        nicknames = {}
+        missing_ids = set()
+        updated_ids = set()
 
-            query = self.db.execute(NAMES_SQL)
+        query = await self.db.fetchall(NAMES_SQL)
 
-            for server_id, user_id, nickname, username, discriminator, avatar_url in query:
-                server = self.bot.get_server(str(server_id))
+        for server_id, user_id, nickname, username, discriminator, avatar_url in query:
+            server = self.bot.get_server(str(server_id))
 
-                if not server:
-                    continue
+            if not server:
+                continue
 
-                member = server.get_member(str(user_id))
+            member = server.get_member(str(user_id))
 
-                if not member:
-                    missing_ids.add(user_id)
-                    continue
+            if not member:
+                missing_ids.add(user_id)
+                continue
 
-                m_avatar_url = member.avatar_url or member.default_avatar_url
+            m_avatar_url = member.avatar_url or member.default_avatar_url
 
-                if user_id not in users and (discriminator != member.discriminator or username != member.name
-                                             or avatar_url != m_avatar_url):
-                    users[user_id] = (member.name, member.discriminator, m_avatar_url)
+            if user_id not in users and (discriminator != int(member.discriminator) or username != member.name
+                                         or avatar_url != m_avatar_url):
+                users[user_id] = (member.name, member.discriminator, m_avatar_url)
 
-                nk = (server_id, user_id)
-                if nk not in nicknames and nickname != member.nick:
-                    nicknames[nk] = member.nick
+            nk = (server_id, user_id)
+            if nk not in nicknames and nickname != member.nick:
+                nicknames[nk] = member.nick
 
-                updated_ids.add(user_id)
+            updated_ids.add(user_id)
 
-            missing_ids -= updated_ids
+        missing_ids -= updated_ids
 
-            if missing_ids:
-                missing_ids = set(str(x) for x in missing_ids)
+        if missing_ids:
+            missing_ids = set(str(x) for x in missing_ids)
 
-                for member in self.bot.get_all_members():
-                    if member.id in missing_ids:
-                        missing_ids.remove(member.id)
-                        users[int(member.id)] = (member.name, member.discriminator,
-                                                 member.avatar_url or member.default_avatar_url)
+            for member in self.bot.get_all_members():
+                if member.id in missing_ids:
+                    missing_ids.remove(member.id)
+                    users[int(member.id)] = (member.name, member.discriminator,
+                                             member.avatar_url or member.default_avatar_url)
 
+        def write(con):
             if users:
                 rows = [(uid, *t) for uid, t in users.items()]
-                self.db.executemany("REPLACE INTO users (user_id, username, discriminator, avatar_url) "
-                                    "VALUES (?, ?, ?, ?);", rows)
+                con.executemany("REPLACE INTO users (user_id, username, discriminator, avatar_url) "
+                                "VALUES (?, ?, ?, ?);", rows)
 
             if nicknames:
                 rows = [(*nk, nickname) for nk, nickname in nicknames.items()]
-                self.db.executemany("REPLACE INTO nicknames (server_id, user_id, nickname) VALUES (?, ?, ?);", rows)
+                con.executemany("REPLACE INTO nicknames (server_id, user_id, nickname) VALUES (?, ?, ?);", rows)
+
+            changed_ids = set(users).union(uid for sid, uid in nicknames)
+
+            if changed_ids:
+                con.executemany(DISPLAY_USER_SQL, [(uid, uid) for uid in changed_ids])
+
+        if users or nicknames:
+            await self.db.run(write)
 
     async def _upgrade_210(self):
-        with self.db as con:
-            cols = {c['name'] for c in con.execute("PRAGMA table_info(quotes);")}
-
-            for cname, ctype in {
-                'image_url'           : 'TEXT',
-                'attachment_url'      : 'TEXT',
-                'attachment_filename' : 'TEXT',
-                'message_id'          : 'INTEGER',
-                'channel_id'          : 'INTEGER'
-            }.items():
-                if cname not in cols:
-                    con.execute("ALTER TABLE quotes ADD COLUMN {} {};".format(cname, ctype))
-                if ctype == 'INTEGER':
-                    con.execute("CREATE INDEX IF NOT EXISTS quotes_{0}_idx ON quotes({0});".format(cname))
+        await self.db.run(self._upgrade_210_columns)
 
         url_regex = re.compile(r"(?is)\b(?:https?://)(?:[a-z0-9]\.?)+/[^\s]+")
+        rows = await self.db.fetchall("SELECT quote_id, quote FROM quotes WHERE image_url IS NULL;")
 
-        with self.db as con:
-            async with aiohttp.ClientSession() as session:
-                for row in con.execute("SELECT quote_id, quote FROM quotes WHERE image_url IS NULL;"):
-                    match = url_regex.search(row['quote'])
+        async with aiohttp.ClientSession() as session:
+            for row in rows:
+                match = url_regex.search(row['quote'])
+
+                if not match:
+                    continue
+
+                url = match.group()
 
-                    if not match:
+                async with session.head(url, allow_redirects=True) as response:
+                    if response.status != 200 or not response.headers['Content-Type'].lower().startswith('image/'):
                         continue
 
-                    url = match.group()
+                params = [row['quote'].replace(url, ''), url, row['quote_id']]
+                await self.db.execute("UPDATE quotes SET quote = ?, image_url = ? WHERE quote_id = ?", params)
 
-                    async with session.head(url, allow_redirects=True) as response:
-                        if response.status != 200 or not response.headers['Content-Type'].lower().startswith('image/'):
-                            continue
+    def _upgrade_210_columns(self, con):
+        cols = {c['name'] for c in con.execute("PRAGMA table_info(quotes);")}
 
-                    params = [row['quote'].replace(url, ''), url, row['quote_id']]
-                    con.execute("UPDATE quotes SET quote = ?, image_url = ? WHERE quote_id = ?", params)
+        for cname, ctype in {
+            'image_url'           : 'TEXT',
+            'attachment_url'      : 'TEXT',
+            'attachment_filename' : 'TEXT',
+            'message_id'          : 'INTEGER',
+            'channel_id'          : 'INTEGER'
+        }.items():
+            if cname not in cols:
+                con.execute("ALTER TABLE quotes ADD COLUMN {} {};".format(cname, ctype))
+            if ctype == 'INTEGER':
+                con.execute("CREATE INDEX IF NOT EXISTS quotes_{0}_idx ON quotes({0});".format(cname))
 
-    def _upgrade_211(self):
-        with self.db as con:
-            cols = {c['name']: c for c in con.execute("PRAGMA table_info(server_counters);")}
+    def _upgrade_211(self, con):
+        cols = {c['name']: c for c in con.execute("PRAGMA table_info(server_counters);")}
 
-            if cols['server_id']['pk']:
-                con.executescript(SQL_211)
+        if cols['server_id']['pk']:
+            con.executescript(SQL_211)
 
-    def _upgrade_230(self):
-        with self.db as con:
-            cols = {c['name']: c for c in con.execute("PRAGMA table_info(quotes);")}
+    def _upgrade_230(self, con):
+        cols = {c['name']: c for c in con.execute("PRAGMA table_info(quotes);")}
 
-            if 'is_global' not in cols:
-                con.executescript("ALTER TABLE quotes ADD COLUMN is_global INTEGER NOT NULL DEFAULT 0;"
-                                  "CREATE INDEX quotes_is_global ON quotes(is_global);")
+        if 'is_global' not in cols:
+            con.executescript("ALTER TABLE quotes ADD COLUMN is_global INTEGER NOT NULL DEFAULT 0;"
+                              "CREATE INDEX quotes_is_global ON quotes(is_global);")
 
-    def _update_member(self, member: discord.Member, update_only=False):
+    def _upgrade_250(self, con):
+        # fills quote_display for quotes from before it existed, or added while its triggers were missing
+        con.execute(DISPLAY_MISSING_SQL)
+
+    async def _update_member(self, member: discord.Member, update_only=False):
         mid = int(member.id)
+        sid = int(member.server.id)
+        name, discriminator, nick = member.name, member.discriminator, member.nick
         avatar = member.avatar_url or member.default_avatar_url
 
-        with self.db as con:
-            if update_only:
-                con.execute("UPDATE nicknames SET nickname = ? WHERE server_id = ? AND user_id = ?",
-                            (member.nick, member.server.id, mid))
-                con.execute("UPDATE users SET username = ?, discriminator = ?, avatar_url = ? WHERE user_id = ?",
-                            (member.name, member.discriminator, avatar, mid))
-            else:
-                con.execute("REPLACE INTO nicknames(server_id, user_id, nickname) VALUES (?, ?, ?);",
-                            (member.server.id, mid, member.nick))
+        def update(con):
+            changed = False
+            user_row = con.execute("SELECT username, discriminator, avatar_url FROM users WHERE user_id = ?;",
+                                   (mid,)).fetchone()
+            nick_row = con.execute("SELECT nickname FROM nicknames WHERE server_id = ? AND user_id = ?;",
+                                   (sid, mid)).fetchone()
+
+            # only write (and refresh the member's quote_display rows) if something changed
+            if (user_row or not update_only) and (user_row is None or
+                                                  tuple(user_row) != (name, int(discriminator), avatar)):
                 con.execute("REPLACE INTO users(user_id, username, discriminator, avatar_url) VALUES (?, ?, ?, ?);",
-                            (mid, member.name, member.discriminator, avatar))
+                            (mid, name, discriminator, avatar))
+                changed = True
+
+            if (nick_row or not update_only) and (nick_row is None or nick_row['nickname'] != nick):
+                con.execute("REPLACE INTO nicknames(server_id, user_id, nickname) VALUES (?, ?, ?);",
+                            (sid, mid, nick))
+                changed = True
+
+            if changed:
+                con.execute(DISPLAY_USER_SQL, (mid, mid))
+
+        await self.db.run(update)
 
     def _normalize_kwargs(self, kwargs):
         kwargs = kwargs.copy()
@@ -545,29 +1047,7 @@ class ServerQuotes:
         return kwargs
 
     def _build_where(self, kwargs, params=None, wheres=None):
-        if wheres is None:
-            wheres = []
-
-        if params is None:
-            params = []
-
-        for param, value in kwargs.items():
-            if isinstance(value, Iterable) and not isinstance(value, str):
-                if not isinstance(value, Sequence):
-                    value = tuple(value)
-
-                wheres.append(param + " IN (%s)" % ', '.join('?' * len(value)))
-                params.extend(value)
-            else:
-                wheres.append(param + " IS ?")
-                params.append(value)
-
-        if wheres:
-            where = " WHERE " + " AND ".join(wheres)
-        else:
-            where = " "
-
-        return where, params
+        return build_where(kwargs, params, wheres)
 
     def _message_to_kwargs(self, message: discord.Message, set_server=True) -> dict:
         kwargs = {
@@ -600,7 +1080,7 @@ class ServerQuotes:
 
         return kwargs
 
-    def _add_quote(self, ctx, **kwargs):
+    async def _add_quote(self, ctx, **kwargs):
         message = kwargs.pop('message', ctx.message)
         message_dict = self._message_to_kwargs(message, set_server=kwargs.get('server') is None)
 
@@ -624,11 +1104,13 @@ class ServerQuotes:
         params = [params[k] for k in columns]
         sql = "INSERT INTO quotes (%s) VALUES (%s);" % (', '.join(columns), ', '.join('?' * len(params)))
 
-        with self.db as con:
+        def insert(con):
             cur = con.execute(sql, params)
-            return cur.execute("SELECT * FROM quotes_view_230 WHERE quote_id = last_insert_rowid();").fetchone()
+            return cur.execute("SELECT * FROM quotes_view_250 WHERE quote_id = ?;", (cur.lastrowid,)).fetchone()
 
-    def _update_quotes(self, key_on=DEFAULT_UPDATE_KEYS, *, where=None, enforce_key=True, **kwargs) -> int:
+        return await self.db.run(insert)
+
+    async def _update_quotes(self, key_on=DEFAULT_UPDATE_KEYS, *, where=None, enforce_key=True, **kwargs) -> int:
         if 'message' in kwargs:
             message = kwargs.pop('message')
             message_dict = self._message_to_kwargs(message, set_server=kwargs.get('server') is None)
@@ -667,45 +1149,38 @@ class ServerQuotes:
         sets = ', '.join('%s = ?' % c for c in columns)
         where, params = self._build_where(where, params)
         sql = "UPDATE quotes SET %s %s;" % (sets, where)
+        return await self.db.execute(sql, params)
 
-        with self.db as con:
-            cursor = con.execute(sql, params)
-            return cursor.rowcount
-
-    def _delete_quotes(self, **kwargs) -> int:
+    async def _delete_quotes(self, **kwargs) -> int:
         kwargs = self._normalize_kwargs(kwargs)
         where, params = self._build_where(kwargs)
         sql = "DELETE FROM quotes " + where
+        return await self.db.execute(sql, params)
 
-        with self.db as con:
-            cursor = con.execute(sql, params)
-            return cursor.rowcount
-
-    def _populate_linked_server_ids(self, kwargs):
+    async def _populate_linked_server_ids(self, kwargs):
         if 'server_id' in kwargs:
             server_id = kwargs['server_id']
 
             if not isinstance(server_id, Iterable):
                 server_id = [server_id]
 
-            with self.db as con:
-                params = ','.join('?'*len(server_id))
-                cur = con.execute("SELECT to_id FROM server_links WHERE from_id IN (%s)" % params, server_id)
-                server_id.extend(r['to_id'] for r in cur.fetchall())
-
+            server_id = list(server_id)
+            placeholders, params = in_placeholders(server_id)
+            rows = await self.db.fetchall("SELECT to_id FROM server_links WHERE from_id IN " + placeholders, params)
+            server_id.extend(r['to_id'] for r in rows)
             kwargs['server_id'] = server_id
 
         return kwargs
 
-    def _get_quotes(self, sort_field=SortField.QUOTE_ID, sort_direction=SortDirection.ASC, limit=None, **kwargs):
+    async def _get_quotes(self, sort_field=SortField.QUOTE_ID, sort_direction=SortDirection.ASC, limit=None, **kwargs):
         kwargs = self._normalize_kwargs(kwargs)
 
         if kwargs.pop('link', False):
-            kwargs = self._populate_linked_server_ids(kwargs)
+            kwargs = await self._populate_linked_server_ids(kwargs)
 
         where, params = self._build_where(kwargs)
 
-        sql = "SELECT * FROM quotes_view_230 " + where
+        sql = "SELECT * FROM quotes_view_250 " + where
 
         if sort_direction is SortDirection.RANDOM:
             sql += " ORDER BY RANDOM() "
@@ -719,39 +1194,39 @@ class ServerQuotes:
             sql += " LIMIT ?"
             params.append(limit)
 
-        with self.db as con:
-            cur = con.execute(sql, params)
-            return cur.fetchall()
+        return await self.db.fetchall(sql, params)
 
-    def _do_search(self, term, limit=10, offset=0, link=False, **kwargs):
+    async def _page_quotes(self, **kwargs) -> QuotePager:
         kwargs = self._normalize_kwargs(kwargs)
 
-        if link:
-            kwargs = self._populate_linked_server_ids(kwargs)
+        if kwargs.pop('link', False):
+            kwargs = await self._populate_linked_server_ids(kwargs)
+
+        where, params = self._build_where(kwargs)
+        return await QuotePager(self.db, where, params).refresh()
+
+    async def _do_search(self, term, limit=10, offset=0, link=False, **kwargs):
+        kwargs = self._normalize_kwargs(kwargs)
 
-        where, params = self._build_where(kwargs, params=[term], wheres=["content MATCH ?"])
+        if link:
+            kwargs = await self._populate_linked_server_ids(kwargs)
 
         if not self.has_fts:
             return []
+        elif self.fts_version == 5:
+            term = fts5_query(term)
 
-        sql = dedent("""
-            SELECT SNIPPET(quotes_fts, '**', '**', '…') AS snippet, quotes_view_230.*
-            FROM quotes_fts
-            JOIN (
-                SELECT docid, bm25(MATCHINFO(quotes_fts, 'pcnalx'), 1) AS rank
-                FROM quotes_fts
-                JOIN quotes_view_230 ON docid = quote_id
-                {where} ORDER BY rank DESC LIMIT ? OFFSET ?
-            ) AS rt USING(docid)
-            JOIN quotes_view_230 ON quote_id = docid
-            WHERE quotes_fts MATCH ? ORDER BY rt.rank DESC
-            """.format(where=where))
+            if not term:
+                return []
 
-        params.extend((limit, offset, term))
+        where, params = self._build_where(kwargs, params=[term], wheres=[FTS_MATCH[self.fts_version]])
+        sql = search_sql(self.fts_version, where)
+        params.extend((limit, offset))
 
-        with self.db as con:
-            cur = con.execute(sql, params)
-            return cur.fetchall()
+        if self.fts_version == 4:
+            params.append(term)
+
+        return await self.db.fetchall(sql, params)
 
     # Commands
 
@@ -785,7 +1260,7 @@ class ServerQuotes:
         """
         Allows you to page through a list of all quotes
         """
-        records = self._get_quotes(server=ctx.message.server, link=True)
+        records = await self._page_quotes(server=ctx.message.server, link=True)
 
         if not records:
             await self.bot.say(warning("There are no quotes in this server!"))
@@ -795,7 +1270,7 @@ class ServerQuotes:
             page = randrange(len(records)) if jump_to_random else 0
             await self.embed_menu(ctx, records, page=page)
         else:
-            embed = self.format_quote_embed(ctx, records[0])
+            embed = self.format_quote_embed(ctx, await get_record(records, 0))
             await self.bot.say(embed=embed)
 
     @quote.command(pass_context=True, no_pm=True, name='search', rest_is_raw=True)
@@ -804,10 +1279,10 @@ class ServerQuotes:
         """
         Searches for quotes by quoted text
 
-        Results are sorted by relevance (uses sqlite FTS4 + Okapi BM25)
+        Results are sorted by relevance (uses sqlite FTS5 or FTS4 + Okapi BM25)
         """
         query = query.lstrip()
-        records = self._do_search(query, limit=50, server=ctx.message.server, link=True)
+        records = await self._do_search(query, limit=50, server=ctx.message.server, link=True)
 
         if not self.has_fts:
             await self.bot.say(warning("Missing FTS extension; please contact the bot owner. If you are the owner, see "
@@ -825,7 +1300,7 @@ class ServerQuotes:
         """
         Displays a stored quote by its number
         """
-        records = self._get_quotes(server=ctx.message.server, server_quote_id=num, link=True)
+        records = await self._get_quotes(server=ctx.message.server, server_quote_id=num, link=True)
 
         if not records:
             await self.bot.say(warning("Couldn't find that quote in this server."))
@@ -846,8 +1321,11 @@ class ServerQuotes:
 
         If show_all is a trueish value, page through all quotes by the member
         """
-        kwargs = {} if show_all else {'sort_direction': SortDirection.RANDOM, 'limit': 1}
-        records = self._get_quotes(server=ctx.message.server, author=member, link=True, **kwargs)
+        if show_all:
+            records = await self._page_quotes(server=ctx.message.server, author=member, link=True)
+        else:
+            records = await self._get_quotes(server=ctx.message.server, author=member, link=True,
+                                       sort_direction=SortDirection.RANDOM, limit=1)
 
         if not records:
             await self.bot.say(warning("There aren't any quotes by %s yet." % member))
@@ -856,7 +1334,7 @@ class ServerQuotes:
         if len(records) > 1:
             await self.embed_menu(ctx, records)
         else:
-            embed = self.format_quote_embed(ctx, records[0])
+            embed = self.format_quote_embed(ctx, await get_record(records, 0))
             await self.bot.say(embed=embed)
 
     @commands.cooldown(6, 60, commands.BucketType.channel)
@@ -867,8 +1345,11 @@ class ServerQuotes:
 
         If show_all is a trueish value, page through all quotes by the author
         """
-        kwargs = {} if show_all else {'sort_direction': SortDirection.RANDOM, 'limit': 1}
-        records = self._get_quotes(server=ctx.message.server, author_name=author, link=True, **kwargs)
+        if show_all:
+            records = await self._page_quotes(server=ctx.message.server, author_name=author, link=True)
+        else:
+            records = await self._get_quotes(server=ctx.message.server, author_name=author, link=True,
+                                       sort_direction=SortDirection.RANDOM, limit=1)
 
         if not records:
             await self.bot.say(warning("There aren't any quotes by %s yet." % author))
@@ -877,7 +1358,7 @@ class ServerQuotes:
         if len(records) > 1:
             await self.embed_menu(ctx, records)
         else:
-            embed = self.format_quote_embed(ctx, records[0])
+            embed = self.format_quote_embed(ctx, await get_record(records, 0))
             await self.bot.say(embed=embed)
 
     @commands.cooldown(6, 60, commands.BucketType.channel)
@@ -888,8 +1369,11 @@ class ServerQuotes:
 
         If show_all is a trueish value, page through all quotes by the member
         """
-        kwargs = {} if show_all else {'sort_direction': SortDirection.RANDOM, 'limit': 1}
-        records = self._get_quotes(server=ctx.message.server, author=ctx.message.author, **kwargs, link=True)
+        if show_all:
+            records = await self._page_quotes(server=ctx.message.server, author=ctx.message.author, link=True)
+        else:
+            records = await self._get_quotes(server=ctx.message.server, author=ctx.message.author, link=True,
+                                       sort_direction=SortDirection.RANDOM, limit=1)
 
         if not records:
             await self.bot.say(warning("There aren't any quotes by you yet."))
@@ -898,7 +1382,7 @@ class ServerQuotes:
         if len(records) > 1:
             await self.embed_menu(ctx, records)
         else:
-            embed = self.format_quote_embed(ctx, records[0])
+            embed = self.format_quote_embed(ctx, await get_record(records, 0))
             await self.bot.say(embed=embed)
 
     @mod_or_permissions(administrator=True)
@@ -921,9 +1405,9 @@ class ServerQuotes:
                 quote = quote[1:-1]
 
         if quote or ctx.message.attachments or (ctx.message.embeds and ctx.message.embeds[0].get('type') == 'image'):
-            self._update_member(ctx.message.author)
-            self._update_member(author)
-            ret = self._add_quote(ctx, quote=quote, author=author)
+            await self._update_member(ctx.message.author)
+            await self._update_member(author)
+            ret = await self._add_quote(ctx, quote=quote, author=author)
             await self.bot.say(okay("Quote #%i added." % ret['server_quote_id']))
         else:
             await self.bot.say(warning("Cannot add a quote with no text, attachments or embed images."))
@@ -949,8 +1433,8 @@ class ServerQuotes:
                 quote = quote[1:-1]
 
         if quote or ctx.message.attachments or (ctx.message.embeds and ctx.message.embeds[0].get('type') == 'image'):
-            self._update_member(ctx.message.author)
-            ret = self._add_quote(ctx, quote=quote, author_name=author)
+            await self._update_member(ctx.message.author)
+            ret = await self._add_quote(ctx, quote=quote, author_name=author)
             await self.bot.say(okay("Quote #%i added." % ret['server_quote_id']))
         else:
             await self.bot.say(warning("Cannot add a quote with no text, attachments or embed images."))
@@ -972,9 +1456,9 @@ class ServerQuotes:
             return
 
         if msg.content or msg.attachments or (msg.embeds and msg.embeds[0].get('type') == 'image'):
-            self._update_member(ctx.message.author)
-            self._update_member(msg.author)
-            ret = self._add_quote(ctx, message=msg)
+            await self._update_member(ctx.message.author)
+            await self._update_member(msg.author)
+            ret = await self._add_quote(ctx, message=msg)
             await self.bot.say(okay("Quote #%i added." % ret['server_quote_id']))
         else:
             await self.bot.say(warning("Cannot add a quote with no text, attachments or embed images."))
@@ -984,7 +1468,7 @@ class ServerQuotes:
         """
         Deletes a quote by its number
         """
-        match = self._get_quotes(server=ctx.message.server, server_quote_id=num)
+        match = await self._get_quotes(server=ctx.message.server, server_quote_id=num)
 
         if not match:
             await self.bot.say(warning("Couldn't find that quote in this server."))
@@ -997,7 +1481,7 @@ class ServerQuotes:
         if not await self.confirm_thing(ctx, thing="delete this quote", require_yn=True, embed=embed):
             return
 
-        self._delete_quotes(quote_id=match[0]['quote_id'])
+        await self._delete_quotes(quote_id=match[0]['quote_id'])
         await self.bot.say(okay("Quote #%i deleted.") % num)
 
     @mod_or_permissions(administrator=True)
@@ -1006,7 +1490,7 @@ class ServerQuotes:
         """
         Sets whether a quote is accessible in all servers
         """
-        match = self._get_quotes(server=ctx.message.server, server_quote_id=num)
+        match = await self._get_quotes(server=ctx.message.server, server_quote_id=num)
 
         if not match:
             await self.bot.say(warning("Couldn't find that quote in this server."))
@@ -1025,14 +1509,14 @@ class ServerQuotes:
                                             require_yn=True, embed=embed):
                 return
 
-            self._update_quotes(quote_id=quote_id, is_global=True)
+            await self._update_quotes(quote_id=quote_id, is_global=True)
             await self.bot.say(okay("Quote #%i published as #g%i.") % (num, quote_id))
         else:
             if not match[0]['is_global']:
                 await self.bot.say(warning("That quote is already not published."))
                 return
 
-            self._update_quotes(quote_id=quote_id, is_global=False)
+            await self._update_quotes(quote_id=quote_id, is_global=False)
             await self.bot.say(okay("Quote #%i unpublished.") % num)
 
     @quote.command(pass_context=True, no_pm=True, name='dump', aliases=['csv'])
@@ -1040,27 +1524,15 @@ class ServerQuotes:
         """
         Uploads all quotes in the server as a CSV
         """
-        strbuf = StringIO(newline='')
         fname = 'quotes_%i_%s.csv' % (datetime.now().timestamp(), ctx.message.server.name)
 
-        rows = []
-
-        with self.db as con:
-            cols = [r['name'] for r in con.execute("PRAGMA table_info(quotes);").fetchall()]
-            cols.remove('quote_id')
-            cols += ['display_author', 'display_added_by']
-            writer = csv.DictWriter(strbuf, fieldnames=cols, extrasaction='ignore', quoting=csv.QUOTE_MINIMAL)
-            writer.writeheader()
-            rows = [dict(row) for row in self._get_quotes(server=ctx.message.server)]
+        cols = [r['name'] for r in await self.db.fetchall("PRAGMA table_info(quotes);")]
+        cols.remove('quote_id')
+        cols += ['display_author', 'display_added_by']
+        rows = await self._get_quotes(server=ctx.message.server)
 
-            for row in rows:
-                for k in ['date_said', 'date_added']:
-                    if row[k]:
-                        row[k] = row[k].timestamp()
-
-            writer.writerows(rows)
-
-        buf = BytesIO(b'\xef\xbb\xbf' + strbuf.getvalue().encode())
+        # formatting a large server's CSV takes a while as well
+        buf = BytesIO(await self.bot.loop.run_in_executor(None, quotes_csv, cols, rows))
         buf.seek(0)
         await self.bot.upload(buf, filename=fname)
 
@@ -1076,7 +1548,7 @@ class ServerQuotes:
         params = (int(ctx.message.server.id), server_id)
 
         if server_id is None:
-            links = self.db.execute('SELECT to_id FROM server_links WHERE from_id = ?', params[:1]).fetchall()
+            links = await self.db.fetchall('SELECT to_id FROM server_links WHERE from_id = ?', params[:1])
 
             if not links:
                 await self.bot.say("Not linked to any servers yet.")
@@ -1109,11 +1581,10 @@ class ServerQuotes:
 
         if not (link_server and link_server.get_member(ctx.message.author.id)):
             await self.bot.say(error("Either I'm not in that server or you aren't."))
-        elif self.db.execute('SELECT * FROM server_links WHERE from_id = ? AND to_id = ?', params).fetchall():
+        elif await self.db.fetchall('SELECT * FROM server_links WHERE from_id = ? AND to_id = ?', params):
             await self.bot.say(warning("Already linked to %s." % link_server.name))
         else:
-            with self.db as con:
-                con.execute('INSERT INTO server_links (from_id, to_id) VALUES (?,?)', params)
+            await self.db.execute('INSERT INTO server_links (from_id, to_id) VALUES (?,?)', params)
 
             await self.bot.say(okay("Now linked to %s." % link_server.name))
 
@@ -1127,10 +1598,10 @@ class ServerQuotes:
         params = (int(ctx.message.server.id), server_id)
         disp = link_server.name if link_server else ('server ID %i' % server_id)
 
-        if not self.db.execute('SELECT * FROM server_links WHERE from_id = ? AND to_id = ?', params).fetchall():
+        if not await self.db.fetchall('SELECT * FROM server_links WHERE from_id = ? AND to_id = ?', params):
             await self.bot.say("Not linked to %s." % disp)
         else:
-            self.db.execute('DELETE FROM server_links WHERE from_id = ? AND to_id = ?', params)
+            await self.db.execute('DELETE FROM server_links WHERE from_id = ? AND to_id = ?', params)
             await self.bot.say(okay("Removed link to %s." % disp))
 
     @commands.group(pass_context=True, invoke_without_command=True)
@@ -1163,7 +1634,7 @@ class ServerQuotes:
         """
         Allows you to page through a list of all quotes
         """
-        records = self._get_quotes(is_global=True)
+        records = await self._page_quotes(is_global=True)
 
         if not records:
             await self.bot.say(warning("There are no quotes in this server!"))
@@ -1173,7 +1644,7 @@ class ServerQuotes:
             page = randrange(len(records)) if jump_to_random else 0
             await self.embed_menu(ctx, records, page=page)
         else:
-            embed = self.format_quote_embed(ctx, records[0])
+            embed = self.format_quote_embed(ctx, await get_record(records, 0))
             await self.bot.say(embed=embed)
 
     @gquote.command(pass_context=True, name='search', rest_is_raw=True)
@@ -1182,10 +1653,10 @@ class ServerQuotes:
         """
         Searches for global quotes by quoted text
 
-        Results are sorted by relevance (uses sqlite FTS4 + Okapi BM25)
+        Results are sorted by relevance (uses sqlite FTS5 or FTS4 + Okapi BM25)
         """
         query = query.lstrip()
-        records = self._do_search(query, limit=50, is_global=True)
+        records = await self._do_search(query, limit=50, is_global=True)
 
         if not self.has_fts:
             await self.bot.say(warning("Missing FTS extension; please contact the bot owner. If you are the owner, see "
@@ -1203,7 +1674,7 @@ class ServerQuotes:
         """
         Displays a stored quote by its number
         """
-        records = self._get_quotes(quote_id=num, is_global=True)
+        records = await self._get_quotes(quote_id=num, is_global=True)
 
         if not records:
             await self.bot.say(warning("Couldn't find that quote."))
@@ -1220,8 +1691,11 @@ class ServerQuotes:
 
         If show_all is a trueish value, page through all quotes by the author
         """
-        kwargs = {} if show_all else {'sort_direction': SortDirection.RANDOM, 'limit': 1}
-        records = self._get_quotes(author_name=author, is_global=True, **kwargs)
+        if show_all:
+            records = await self._page_quotes(author_name=author, is_global=True)
+        else:
+            records = await self._get_quotes(author_name=author, is_global=True, sort_direction=SortDirection.RANDOM,
+                                       limit=1)
 
         if not records:
             await self.bot.say(warning("There aren't any global quotes by %s." % author))
@@ -1230,7 +1704,7 @@ class ServerQuotes:
         if len(records) > 1:
             await self.embed_menu(ctx, records)
         else:
-            embed = self.format_quote_embed(ctx, records[0])
+            embed = self.format_quote_embed(ctx, await get_record(records, 0))
             await self.bot.say(embed=embed)
 
     @commands.cooldown(6, 60, commands.BucketType.channel)
@@ -1242,7 +1716,7 @@ class ServerQuotes:
         If show_all is a trueish value, page through all quotes by the member
         """
         kwargs = {} if show_all else {'sort_direction': SortDirection.RANDOM, 'limit': 1}
-        records = self._get_quotes(author_id=ctx.message.author.id, is_global=True, **kwargs)
+        records = await self._get_quotes(author_id=ctx.message.author.id, is_global=True, **kwargs)
 
         if not records:
             await self.bot.say(warning("There aren't any global quotes by you yet."))
@@ -1271,9 +1745,9 @@ class ServerQuotes:
                 quote = quote[1:-1]
 
         if quote or ctx.message.attachments or (ctx.message.embeds and ctx.message.embeds[0].get('type') == 'image'):
-            self._update_member(ctx.message.author)
-            self._update_member(author)
-            ret = self._add_quote(ctx, quote=quote, author=author, is_global=True, server=False)
+            await self._update_member(ctx.message.author)
+            await self._update_member(author)
+            ret = await self._add_quote(ctx, quote=quote, author=author, is_global=True, server=False)
             await self.bot.say(okay("Global quote #g%i added." % ret['quote_id']))
         else:
             await self.bot.say(warning("Cannot add a quote with no text, attachments or embed images."))
@@ -1299,8 +1773,8 @@ class ServerQuotes:
                 quote = quote[1:-1]
 
         if quote or ctx.message.attachments or (ctx.message.embeds and ctx.message.embeds[0].get('type') == 'image'):
-            self._update_member(ctx.message.author)
-            ret = self._add_quote(ctx, quote=quote, author_name=author, is_global=True, server=False)
+            await self._update_member(ctx.message.author)
+            ret = await self._add_quote(ctx, quote=quote, author_name=author, is_global=True, server=False)
             await self.bot.say(okay("Global quote #g%i added." % ret['quote_id']))
         else:
             await self.bot.say(warning("Cannot add a quote with no text, attachments or embed images."))
@@ -1322,9 +1796,9 @@ class ServerQuotes:
             return
 
         if msg.content or msg.attachments or (msg.embeds and msg.embeds[0].get('type') == 'image'):
-            self._update_member(ctx.message.author)
-            self._update_member(msg.author)
-            ret = self._add_quote(ctx, message=msg, is_global=True, server=False)
+            await self._update_member(ctx.message.author)
+            await self._update_member(msg.author)
+            ret = await self._add_quote(ctx, message=msg, is_global=True, server=False)
             await self.bot.say(okay("Global quote #g%i added." % ret['quote_id']))
         else:
             await self.bot.say(warning("Cannot add a quote with no text, attachments or embed images."))
@@ -1335,7 +1809,7 @@ class ServerQuotes:
         """
         Deletes a quote by its number
         """
-        match = self._get_quotes(quote_id=num, is_global=True)
+        match = await self._get_quotes(quote_id=num, is_global=True)
 
         if not match:
             await self.bot.say(warning("Couldn't find that quote."))
@@ -1346,7 +1820,7 @@ class ServerQuotes:
         if not await self.confirm_thing(ctx, thing="delete this quote", require_yn=True, embed=embed):
             return
 
-        self._delete_quotes(quote_id=match[0]['quote_id'])
+        await self._delete_quotes(quote_id=match[0]['quote_id'])
         await self.bot.say(okay("Global quote #%i deleted.") % num)
 
     @is_owner()
@@ -1355,7 +1829,7 @@ class ServerQuotes:
         """
         Unpublishes a global quote
         """
-        match = self._get_quotes(quote_id=num, is_global=True)
+        match = await self._get_quotes(quote_id=num, is_global=True)
 
         if not match:
             await self.bot.say(warning("Couldn't find that quote."))
@@ -1369,9 +1843,36 @@ class ServerQuotes:
         if not await self.confirm_thing(ctx, thing="unpublish this quote", require_yn=True, embed=embed):
             return
 
-        self._update_quotes(quote_id=num, is_global=False)
+        await self._update_quotes(quote_id=num, is_global=False)
         await self.bot.say(okay("Global quote #%i unpublished.") % num)
 
+    @is_owner()
+    @quote.command(pass_context=True, name='storage')
+    async def quote_storage(self, ctx, profile: str = None):
+        """
+        Shows or sets how the quote database is stored
+
+        Profiles are wal (the default) and compat, for filesystems that don't
+        support WAL, like network shares. Individual settings can be changed in
+        data/serverquotes/settings.json. Takes effect when the cog is reloaded.
+        """
+        if profile is None:
+            settings = dict(DEFAULT_SETTINGS['storage'], **self.settings.get('storage', {}))
+            width = max(map(len, settings))
+            lines = ['%-*s %s' % (width, k, v) for k, v in sorted(settings.items())]
+            await self.bot.say(box('\n'.join(lines)))
+            return
+
+        profile = profile.lower()
+
+        if profile not in STORAGE_PROFILES:
+            await self.bot.say(error('Unknown profile; choose from %s.' % ', '.join(sorted(STORAGE_PROFILES))))
+            return
+
+        self.settings['storage'] = dict(STORAGE_PROFILES[profile])
+        dataIO.save_json(SETTINGS, self.settings)
+        await self.bot.say(okay('Storage profile set to %s; reload the cog to apply it.') % profile)
+
     # Legacy command stubs
 
     @commands.command(pass_context=True, no_pm=True)
@@ -1438,7 +1939,7 @@ class ServerQuotes:
 
         return embed
 
-    async def embed_menu(self, ctx, records: list, message: discord.Message = None,
+    async def embed_menu(self, ctx, records: Sequence, message: discord.Message = None,
                          page=0, timeout: int = 30, edata=None, use_snippet=None):
         """
         menu control logic for this taken from
@@ -1446,7 +1947,7 @@ class ServerQuotes:
         """
 
         num_records = len(records)
-        record = records[page]
+        record = await get_record(records, page)
         content = 'Result %i/%i:' % (page + 1, num_records)
         embed = self.format_quote_embed(ctx, record, use_snippet=use_snippet)
 
@@ -1608,7 +2109,7 @@ class ServerQuotes:
     async def on_member_update(self, before, after):
         if (before.nick != after.nick or before.name != after.name or
                 before.discriminator != after.discriminator or before.avatar != after.avatar):
-            self._update_member(after, update_only=True)
+            await self._update_member(after, update_only=True)
 
     async def on_command(self, command, ctx):
         if ctx.cog is self and self.analytics:
@@ -1622,6 +2123,10 @@ def check_folder():
 
 
 def check_file():
+    if not dataIO.is_valid_json(SETTINGS):
+        print("Creating default serverquotes settings.json...")
+        dataIO.save_json(SETTINGS, DEFAULT_SETTINGS)
+
     if dataIO.is_valid_json(JSON):
         print("Migrating quotes.json...")
         data = dataIO.load_json(JSON)